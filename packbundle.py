@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+#
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import argparse
+from src.bundle import pack
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Pack test data files into a bundle for use with testcaldav.py --bundle.',
+    )
+    parser.add_argument(
+        '-o', '--output', action='store', default='resources.bundle',
+        help='Path of the bundle file to write'
+    )
+    parser.add_argument(
+        'paths', nargs='*', default=['Resource', 'scripts/tests'],
+        help='Files and directories to pack, relative to the directory testcaldav.py is run from'
+    )
+    args = parser.parse_args()
+
+    count = pack(args.output, args.paths)
+    print "Packed %d files into %s" % (count, args.output,)
@@ -16,12 +16,23 @@
 
 __all__ = [
     "caldavtest",
+    "canonical",
+    "bundle",
+    "context",
+    "expectedcache",
+    "filecache",
     "httpshandler",
     "manager",
+    "multistatus",
+    "plancache",
+    "plugins",
+    "responsebody",
     "request",
     "serverinfo",
+    "spool",
     "test",
     "testsuite",
+    "waiter",
     "xmlDefs",
     "xmlUtils",
 ]
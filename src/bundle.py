@@ -0,0 +1,182 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to read data files packed into a single bundle file.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+# A bundle file is the magic string, the offset and length of the index, the
+# contents of each file one after the other, and then the index as JSON giving
+# the offset and length of each file and the modification time of each
+# directory the files were packed from
+BUNDLE_MAGIC = "CDTBNDL2"
+BUNDLE_HEADER = ">QQ"
+
+
+def bundleKey(path):
+    """
+    Get the name a file is stored under in a bundle: its path relative to the
+    current directory.
+
+    @param path: path of the file
+    @type path: L{str}
+    @rtype: L{str}
+    """
+    path = os.path.normpath(path)
+    if os.path.isabs(path):
+        path = os.path.relpath(path)
+    return path
+
+
+def pack(bundlepath, paths):
+    """
+    Pack files into a bundle.
+
+    @param bundlepath: path of the bundle file to write
+    @type bundlepath: L{str}
+    @param paths: files, and directories whose files are all packed
+    @type paths: L{list} of L{str}
+    @return: the number of files packed
+    @rtype: L{int}
+    """
+    files = set()
+    dirs = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _ignore_dirnames, filenames in os.walk(path):
+                files.update([os.path.join(dirpath, filename) for filename in filenames])
+                dirs[bundleKey(dirpath)] = os.stat(dirpath).st_mtime
+        else:
+            files.add(path)
+            dirpath = os.path.dirname(path) or os.curdir
+            dirs[bundleKey(dirpath)] = os.stat(dirpath).st_mtime
+
+    index = {}
+    header = len(BUNDLE_MAGIC) + struct.calcsize(BUNDLE_HEADER)
+    with open(bundlepath, "wb") as f:
+        f.write("\0" * header)
+        offset = header
+        for path in sorted(files):
+            with open(path, "rb") as infile:
+                data = infile.read()
+            f.write(data)
+            index[bundleKey(path)] = (offset, len(data),)
+            offset += len(data)
+
+        data = json.dumps({"files": index, "dirs": dirs}, sort_keys=True)
+        f.write(data)
+        f.seek(0)
+        f.write(BUNDLE_MAGIC + struct.pack(BUNDLE_HEADER, offset, len(data)))
+
+    return len(index)
+
+
+class bundle(object):
+    """
+    A bundle of data files, as written by L{pack}. The bundle is
+    memory-mapped, so files are served from it without opening them. Files
+    are looked up by their path relative to the current directory, as they
+    were when the bundle was packed.
+
+    When the bundle is opened the directories the files were packed from are
+    checked, and if any has changed since the bundle was packed (a file added,
+    removed or replaced) the bundle is stale and nothing is served from it.
+    Files edited in place do not change their directory, so the bundle must be
+    re-packed after such edits.
+    """
+
+    def __init__(self, path):
+        """
+        @param path: path of the bundle file
+        @type path: L{str}
+        @raise ValueError: if the file is not a bundle
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = len(BUNDLE_MAGIC) + struct.calcsize(BUNDLE_HEADER)
+        if self.map.size() < header or self.map[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError("Not a bundle file: %s" % (path,))
+        offset, length = struct.unpack(BUNDLE_HEADER, self.map[len(BUNDLE_MAGIC):header])
+        index = json.loads(self.map[offset:offset + length])
+
+        self.files = {}
+        self.dirs = {}
+        self.stale = not self.current(index["dirs"])
+        if self.stale:
+            return
+        for name, entry in index["files"].items():
+            name = name.encode("utf-8")
+            self.files[name] = tuple(entry)
+            while True:
+                dirname, basename = os.path.split(name)
+                self.dirs.setdefault(dirname, set()).add(basename)
+                if not dirname:
+                    break
+                name = dirname
+
+    def __len__(self):
+        return len(self.files)
+
+    def get(self, path):
+        """
+        Get the contents of a file.
+
+        @param path: path of the file
+        @type path: L{str}
+        @return: the contents, or L{None} if the file is not in the bundle
+        @rtype: L{buffer}
+        """
+        try:
+            offset, length = self.files[bundleKey(path)]
+        except KeyError:
+            return None
+        return buffer(self.map, offset, length)
+
+    def current(self, dirs):
+        """
+        Determine whether the directories the files were packed from are
+        unchanged on disk.
+
+        @param dirs: the modification time of each directory when packed
+        @type dirs: L{dict}
+        @rtype: L{bool}
+        """
+        for name, mtime in dirs.items():
+            try:
+                if os.stat(name).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def listdir(self, path):
+        """
+        Get the names of the files and directories in a directory.
+
+        @param path: path of the directory
+        @type path: L{str}
+        @return: the names, or L{None} if the directory is not in the bundle
+        @rtype: L{list} of L{str}
+        """
+        names = self.dirs.get(bundleKey(path))
+        return list(names) if names is not None else None
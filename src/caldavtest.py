@@ -18,29 +18,29 @@
 Class to encapsulate a single caldav test run.
 """
 
-from cStringIO import StringIO
-try:
-    # Treat pycalendar as optional
-    from pycalendar.icalendar.calendar import Calendar
-except ImportError:
-    pass
-from src.httpshandler import SmartHTTPConnection
 from src.jsonPointer import JSONMatcher
 from src.manager import manager
+from src.multistatus import isOK
 from src.request import data, pause
 from src.request import request
 from src.request import stats
+from src.responsebody import responseBody
+from src.spool import readResponse, spooledbody
 from src.testsuite import testsuite
+from src.waiter import waiter
 from src.xmlUtils import nodeForPath, xmlPathSplit
 from xml.etree.cElementTree import ElementTree, tostring
+from xml.parsers.expat import ExpatError
+from xml.sax.saxutils import escape
+import collections
 import commands
 import httplib
-import json
 import os
 import rfc822
 import socket
 import src.xmlDefs
 import sys
+import threading
 import time
 import traceback
 import urllib
@@ -52,12 +52,23 @@ Patch the HTTPConnection.send to record full request details
 
 httplib.HTTPConnection._send = httplib.HTTPConnection.send
 
+# Size of the pieces that verbatim request bodies are sent in
+SEND_BLOCK_SIZE = 256 * 1024
+
 
 def recordRequestHeaders(self, str):
     if not hasattr(self, "requestData"):
         self.requestData = ""
-    self.requestData += str
-    httplib.HTTPConnection._send(self, str)  # @UndefinedVariable
+    if isinstance(str, basestring):
+        self.requestData += str
+        httplib.HTTPConnection._send(self, str)  # @UndefinedVariable
+    else:
+        # A verbatim file body, memory-mapped or from a bundle, is sent a piece
+        # at a time straight from the mapping, rather than being read into a
+        # string first
+        self.requestData += "<%d bytes from file>" % (len(str),)
+        for offset in xrange(0, len(str), SEND_BLOCK_SIZE):
+            self.sock.sendall(buffer(str, offset, SEND_BLOCK_SIZE))
 
 httplib.HTTPConnection.send = recordRequestHeaders
 
@@ -76,9 +87,20 @@ def getVersionStringFromResponse(response):
 
 class caldavtest(object):
 
-    def __init__(self, manager, name):
+    def __init__(self, manager, name, path=None):
+        """
+        @param manager: the manager running the tests
+        @type manager: L{manager}
+        @param name: name of the test file
+        @type name: L{str}
+        @param path: path of the test file, if only its header has been parsed
+            and the rest is to be parsed by L{load} when needed
+        @type path: L{str}
+        """
         self.manager = manager
         self.name = name
+        self.path = path
+        self.loaded = path is None
         self.description = ""
         self.require_features = set()
         self.exclude_features = set()
@@ -86,11 +108,7 @@ class caldavtest(object):
         self.only = False
         self.start_requests = []
         self.end_requests = []
-        self.end_deletes = []
         self.suites = []
-        self.grabbedlocation = None
-        self.previously_found = set()
-        self.uidmaps = {}
 
     def missingFeatures(self):
         return self.require_features - self.manager.server_info.features
@@ -98,78 +116,177 @@ class caldavtest(object):
     def excludedFeatures(self):
         return self.exclude_features & self.manager.server_info.features
 
-    def run(self):
+    def load(self):
+        """
+        Parse the start requests, test suites and end requests of a test file
+        for which only the header was parsed.
+        """
+        if not self.loaded:
+            try:
+                with self.manager.fileCache.open(self.path) as f:
+                    tree = ElementTree(file=f)
+            except (ExpatError, SyntaxError), e:
+                raise RuntimeError("Unable to parse file '%s' because: %s" % (self.path, e,))
+            self.start_requests = []
+            self.end_requests = []
+            self.suites = []
+            self.parseXML(tree.getroot())
+            self.loaded = True
+
+    def unload(self):
+        """
+        Forget the parsed start requests, test suites and end requests, if
+        they can be parsed again by L{load}.
+        """
+        if self.path is not None and self.loaded:
+            self.start_requests = []
+            self.end_requests = []
+            self.suites = []
+            self.loaded = False
+
+    def run(self, ctx, teardown=True):
+        """
+        Run the test file.
+
+        @param ctx: the state for the run
+        @type ctx: L{context}
+        @param teardown: whether to run the end deletes and end requests, or
+            leave them for the caller to run later via L{teardown}, in which
+            case the context's deferred_teardown is set when needed
+        @type teardown: L{bool}
+        @return: L{tuple} of the ok, failed and ignored counts
+        """
         if len(self.missingFeatures()) != 0:
-            self.manager.testFile(self.name, "Missing features: %s" % (", ".join(sorted(self.missingFeatures()),)), manager.RESULT_IGNORED)
+            ctx.testFile(self.name, "Missing features: %s" % (", ".join(sorted(self.missingFeatures()),)), manager.RESULT_IGNORED)
             return 0, 0, 1
         if len(self.excludedFeatures()) != 0:
-            self.manager.testFile(self.name, "Excluded features: %s" % (", ".join(sorted(self.excludedFeatures()),)), manager.RESULT_IGNORED)
+            ctx.testFile(self.name, "Excluded features: %s" % (", ".join(sorted(self.excludedFeatures()),)), manager.RESULT_IGNORED)
             return 0, 0, 1
 
         # Always need a new set of UIDs for the entire test
-        uids = self.manager.server_info.newUIDs()
+        uids = ctx.server_info.newUIDs()
         for uid, uidname in uids:
-            self.uidmaps[uid] = "{u} - {n}".format(u=uidname, n=self.name)
+            ctx.uidmaps[uid] = "{u} - {n}".format(u=uidname, n=self.name)
 
-        self.only = any([suite.only for suite in self.suites])
         try:
-            result = self.dorequests("Start Requests...", self.start_requests, False, True, label="%s | %s" % (self.name, "START_REQUESTS"))
+            self.load()
+            self.only = any([suite.only for suite in self.suites])
+            result = self.dorequests(ctx, "Start Requests...", self.start_requests, False, True, label="%s | %s" % (self.name, "START_REQUESTS"))
             if not result:
-                self.manager.testFile(self.name, "Start items failed - tests will not be run.", manager.RESULT_ERROR)
+                ctx.testFile(self.name, "Start items failed - tests will not be run.", manager.RESULT_ERROR)
                 ok, failed, ignored = (0, 1, 0,)
             else:
-                ok, failed, ignored = self.run_tests(label=self.name)
-            self.doenddelete("Deleting Requests...", label="%s | %s" % (self.name, "END_DELETE"))
-            self.dorequests("End Requests...", self.end_requests, False, label="%s | %s" % (self.name, "END_REQUESTS"))
+                ok, failed, ignored = self.run_tests(ctx, label=self.name)
+            if teardown:
+                self.doteardown(ctx)
+            else:
+                ctx.deferred_teardown = self
             return ok, failed, ignored
         except socket.error, msg:
-            self.manager.testFile(self.name, "SOCKET ERROR: %s" % (msg,), manager.RESULT_ERROR)
+            ctx.testFile(self.name, "SOCKET ERROR: %s" % (msg,), manager.RESULT_ERROR)
             return 0, 1, 0
         except Exception, e:
-            self.manager.testFile(self.name, "FATAL ERROR: %s" % (e,), manager.RESULT_ERROR)
-            if self.manager.debug:
+            ctx.testFile(self.name, "FATAL ERROR: %s" % (e,), manager.RESULT_ERROR)
+            if ctx.debug:
                 traceback.print_exc()
             return 0, 1, 0
 
-    def run_tests(self, label=""):
+    def teardown(self, ctx):
+        """
+        Run the end deletes and end requests deferred by L{run}.
+
+        @param ctx: the state for the run
+        @type ctx: L{context}
+        @return: the number of failures
+        @rtype: L{int}
+        """
+        ctx.deferred_teardown = None
+        try:
+            self.doteardown(ctx)
+            return 0
+        except socket.error, msg:
+            ctx.testFile(self.name, "SOCKET ERROR: %s" % (msg,), manager.RESULT_ERROR)
+            return 1
+        except Exception, e:
+            ctx.testFile(self.name, "FATAL ERROR: %s" % (e,), manager.RESULT_ERROR)
+            if ctx.debug:
+                traceback.print_exc()
+            return 1
+
+    def doteardown(self, ctx):
+        self.doenddelete(ctx, "Deleting Requests...", label="%s | %s" % (self.name, "END_DELETE"))
+        self.dorequests(ctx, "End Requests...", self.end_requests, False, label="%s | %s" % (self.name, "END_REQUESTS"))
+
+    def requestURIs(self, ctx, requests):
+        """
+        Get the URIs targeted by a list of requests.
+
+        @return: the URIs, with any variables not yet known left in place
+        @rtype: L{list} of L{str}
+        """
+        uris = []
+        for req in requests:
+            if isinstance(req, request):
+                uris.extend([ctx.server_info.extrasubs(uri) for uri in (req.ruris if req.ruris else [req.ruri])])
+        return uris
+
+    def targetURIs(self, ctx):
+        """
+        Get the URIs targeted by the start requests and the requests of every
+        test.
+        """
+        self.load()
+        uris = self.requestURIs(ctx, self.start_requests)
+        for suite in self.suites:
+            for test in suite.tests:
+                uris.extend(self.requestURIs(ctx, test.requests))
+        return uris
+
+    def teardownURIs(self, ctx):
+        """
+        Get the URIs targeted by the deferred end deletes and end requests.
+        """
+        return [uri for uri, _ignore_request in ctx.end_deletes] + self.requestURIs(ctx, self.end_requests)
+
+    def run_tests(self, ctx, label=""):
         ok = 0
         failed = 0
         ignored = 0
-        testfile = self.manager.testFile(self.name, self.description)
+        testfile = ctx.testFile(self.name, self.description)
         for suite in self.suites:
-            o, f, i = self.run_test_suite(testfile, suite, label="%s | %s" % (label, suite.name))
+            o, f, i = self.run_test_suite(ctx, testfile, suite, label="%s | %s" % (label, suite.name))
             ok += o
             failed += f
             ignored += i
         return (ok, failed, ignored)
 
-    def run_test_suite(self, testfile, suite, label=""):
+    def run_test_suite(self, ctx, testfile, suite, label=""):
         result_name = suite.name
         ok = 0
         failed = 0
         ignored = 0
         postgresCount = None
         if self.only and not suite.only or suite.ignore:
-            self.manager.testSuite(testfile, result_name, "    Deliberately ignored", manager.RESULT_IGNORED)
+            ctx.testSuite(testfile, result_name, "    Deliberately ignored", manager.RESULT_IGNORED)
             ignored = len(suite.tests)
         elif len(suite.missingFeatures()) != 0:
-            self.manager.testSuite(testfile, result_name, "    Missing features: %s" % (", ".join(sorted(suite.missingFeatures())),), manager.RESULT_IGNORED)
+            ctx.testSuite(testfile, result_name, "    Missing features: %s" % (", ".join(sorted(suite.missingFeatures())),), manager.RESULT_IGNORED)
             ignored = len(suite.tests)
         elif len(suite.excludedFeatures()) != 0:
-            self.manager.testSuite(testfile, result_name, "    Excluded features: %s" % (", ".join(sorted(suite.excludedFeatures())),), manager.RESULT_IGNORED)
+            ctx.testSuite(testfile, result_name, "    Excluded features: %s" % (", ".join(sorted(suite.excludedFeatures())),), manager.RESULT_IGNORED)
             ignored = len(suite.tests)
         else:
             postgresCount = self.postgresInit()
-            if self.manager.memUsage:
-                start_usage = self.manager.getMemusage()
+            if ctx.memUsage:
+                start_usage = ctx.getMemusage()
             etags = {}
             only_tests = any([test.only for test in suite.tests])
-            testsuite = self.manager.testSuite(testfile, result_name, "")
-            uids = suite.aboutToRun()
+            testsuite = ctx.testSuite(testfile, result_name, "")
+            uids = suite.aboutToRun(ctx)
             for uid, uidname in uids:
-                self.uidmaps[uid] = "{u} - {l}".format(u=uidname, l=label)
+                ctx.uidmaps[uid] = "{u} - {l}".format(u=uidname, l=label)
             for test in suite.tests:
-                result = self.run_test(testsuite, test, etags, only_tests, label="%s | %s" % (label, test.name))
+                result = self.run_test(ctx, testsuite, test, etags, only_tests, label="%s | %s" % (label, test.name))
                 if result == "t":
                     ok += 1
                 elif result == "f":
@@ -177,24 +294,24 @@ class caldavtest(object):
                 else:
                     ignored += 1
 
-            if self.manager.memUsage:
-                end_usage = self.manager.getMemusage()
-                self.manager.message("trace", "    Mem. Usage: RSS=%s%% VSZ=%s%%" % (str(((end_usage[1] - start_usage[1]) * 100) / start_usage[1]), str(((end_usage[0] - start_usage[0]) * 100) / start_usage[0])))
+            if ctx.memUsage:
+                end_usage = ctx.getMemusage()
+                ctx.message("trace", "    Mem. Usage: RSS=%s%% VSZ=%s%%" % (str(((end_usage[1] - start_usage[1]) * 100) / start_usage[1]), str(((end_usage[0] - start_usage[0]) * 100) / start_usage[0])))
 
-        self.manager.message("trace", "  Suite Results: %d PASSED, %d FAILED, %d IGNORED\n" % (ok, failed, ignored))
+        ctx.message("trace", "  Suite Results: %d PASSED, %d FAILED, %d IGNORED\n" % (ok, failed, ignored))
         if postgresCount is not None:
-            self.postgresResult(postgresCount, indent=4)
+            self.postgresResult(ctx, postgresCount, indent=4)
         return (ok, failed, ignored)
 
-    def run_test(self, testsuite, test, etags, only, label=""):
+    def run_test(self, ctx, testsuite, test, etags, only, label=""):
         if test.ignore or only and not test.only:
-            self.manager.testResult(testsuite, test.name, "      Deliberately ignored", manager.RESULT_IGNORED)
+            ctx.testResult(testsuite, test.name, "      Deliberately ignored", manager.RESULT_IGNORED)
             return "i"
         elif len(test.missingFeatures()) != 0:
-            self.manager.testResult(testsuite, test.name, "      Missing features: %s" % (", ".join(sorted(test.missingFeatures())),), manager.RESULT_IGNORED)
+            ctx.testResult(testsuite, test.name, "      Missing features: %s" % (", ".join(sorted(test.missingFeatures())),), manager.RESULT_IGNORED)
             return "i"
         elif len(test.excludedFeatures()) != 0:
-            self.manager.testResult(testsuite, test.name, "      Excluded features: %s" % (", ".join(sorted(test.excludedFeatures())),), manager.RESULT_IGNORED)
+            ctx.testResult(testsuite, test.name, "      Excluded features: %s" % (", ".join(sorted(test.excludedFeatures())),), manager.RESULT_IGNORED)
             return "i"
         else:
             result = True
@@ -204,59 +321,67 @@ class caldavtest(object):
                 reqstats = stats()
             else:
                 reqstats = None
+            ctx.waited = 0.0
+            ctx.cleanuptime = 0.0
             for ctr in range(test.count):
                 for req_count, req in enumerate(test.requests):
-                    t = time.time() + (self.manager.server_info.waitsuccess if getattr(req, "wait_for_success", False) else 100)
+                    t = time.time() + (ctx.server_info.waitsuccess if getattr(req, "wait_for_success", False) else 100)
+                    wait = waiter(ctx)
                     while t > time.time():
                         failed = False
                         if getattr(req, "iterate_data", False):
                             if not req.hasNextData():
-                                self.manager.testResult(testsuite, test.name, "      No iteration data - ignored", manager.RESULT_IGNORED)
+                                ctx.testResult(testsuite, test.name, "      No iteration data - ignored", manager.RESULT_IGNORED)
                                 return "i"
                             while req.getNextData():
-                                result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(req, test.details, True, False, reqstats, etags=etags, label="%s | #%s" % (label, req_count + 1,), count=ctr + 1)
+                                result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(ctx, req, test.details, True, False, reqstats, etags=etags, label="%s | #%s" % (label, req_count + 1,), count=ctr + 1)
                                 if not result:
                                     failed = True
                                     break
                         else:
-                            result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(req, test.details, True, False, reqstats, etags=etags, label="%s | #%s" % (label, req_count + 1,), count=ctr + 1)
+                            result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(ctx, req, test.details, True, False, reqstats, etags=etags, label="%s | #%s" % (label, req_count + 1,), count=ctr + 1)
                             if not result:
                                 failed = True
 
                         if not failed or not req.wait_for_success:
                             break
+                        wait.pause()
                     if failed:
                         break
 
             addons = {}
             if len(resulttxt) > 0:
-                self.manager.message("trace", resulttxt)
+                ctx.message("trace", resulttxt)
             if result and test.stats:
-                self.manager.message("trace", "    Total Time: %.3f secs" % (reqstats.totaltime,), indent=8)
-                self.manager.message("trace", "    Average Time: %.3f secs" % (reqstats.totaltime / reqstats.count,), indent=8)
+                ctx.message("trace", "    Total Time: %.3f secs" % (reqstats.totaltime,), indent=8)
+                ctx.message("trace", "    Average Time: %.3f secs" % (reqstats.totaltime / reqstats.count,), indent=8)
                 addons["timing"] = {
                     "total": reqstats.totaltime,
                     "average": reqstats.totaltime / reqstats.count,
                 }
-            self.postgresResult(postgresCount, indent=8)
-            self.manager.testResult(testsuite, test.name, resulttxt, manager.RESULT_OK if result else manager.RESULT_FAILED, addons)
+            if ctx.waited:
+                addons["waited"] = ctx.waited
+            if ctx.cleanuptime:
+                addons["cleanup"] = ctx.cleanuptime
+            self.postgresResult(ctx, postgresCount, indent=8)
+            ctx.testResult(testsuite, test.name, resulttxt, manager.RESULT_OK if result else manager.RESULT_FAILED, addons)
             return ["f", "t"][result]
 
-    def dorequests(self, description, list, doverify=True, forceverify=False, label="", count=1):
+    def dorequests(self, ctx, description, list, doverify=True, forceverify=False, label="", count=1):
         if len(list) == 0:
             return True
-        self.manager.message("trace", "Start: " + description)
+        ctx.message("trace", "Start: " + description)
         for req_count, req in enumerate(list):
-            result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(req, False, doverify, forceverify, label="%s | #%s" % (label, req_count + 1), count=count)
+            result, resulttxt, _ignore_response, _ignore_respdata = self.dorequest(ctx, req, False, doverify, forceverify, label="%s | #%s" % (label, req_count + 1), count=count)
             if not result:
                 resulttxt += "\nFailure during multiple requests #%d out of %d, request=%s" % (req_count + 1, len(list), str(req))
                 break
-        self.manager.message("trace", "{name:<60}{value:>10}".format(name="End: " + description, value=["[FAILED]", "[OK]"][result]))
+        ctx.message("trace", "{name:<60}{value:>10}".format(name="End: " + description, value=["[FAILED]", "[OK]"][result]))
         if len(resulttxt) > 0:
-            self.manager.message("trace", resulttxt)
+            ctx.message("trace", resulttxt)
         return result
 
-    def doget(self, original_request, resource, label=""):
+    def doget(self, ctx, original_request, resource, label=""):
         req = request(self.manager)
         req.method = "GET"
         req.host = original_request.host
@@ -267,13 +392,74 @@ class caldavtest(object):
             req.user = resource[1]
         if len(resource[2]):
             req.pswd = resource[2]
-        _ignore_result, _ignore_resulttxt, response, respdata = self.dorequest(req, False, False, label=label)
+        _ignore_result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label=label)
         if response.status / 100 != 2:
             return False, None
 
         return True, respdata
 
-    def dofindall(self, original_request, collection, label=""):
+    def dogetmany(self, ctx, original_request, collection, hrefs, label=""):
+        """
+        Get the data of several resources in a collection, using batches of
+        calendar-multiget or addressbook-multiget REPORTs, falling back to a
+        GET of each resource the server did not return.
+
+        @param hrefs: the resources to get
+        @type hrefs: L{list} of L{str}
+        @return: an iterator of L{tuple} of href and data (or L{None}) for each
+            resource, in the same order as C{hrefs}
+        """
+        reports = [
+            ("urn:ietf:params:xml:ns:caldav", "calendar-multiget", "calendar-data",),
+            ("urn:ietf:params:xml:ns:carddav", "addressbook-multiget", "address-data",),
+        ]
+        batchsize = max(ctx.server_info.multigetbatch, 1)
+        for start in range(0, len(hrefs), batchsize):
+            batch = hrefs[start:start + batchsize]
+            found = {}
+            while reports:
+                namespace, reportname, dataname = reports[0]
+                req = request(self.manager)
+                req.method = "REPORT"
+                req.host = original_request.host
+                req.port = original_request.port
+                req.ruris.append(collection[0])
+                req.ruri = collection[0]
+                if len(collection[1]):
+                    req.user = collection[1]
+                if len(collection[2]):
+                    req.pswd = collection[2]
+                req.data = data(self.manager)
+                req.data.value = """<?xml version="1.0" encoding="utf-8" ?>
+<M:%s xmlns:D="DAV:" xmlns:M="%s">
+<D:prop>
+<M:%s/>
+</D:prop>
+%s
+</M:%s>
+""" % (reportname, namespace, dataname, "\n".join(["<D:href>%s</D:href>" % (escape(href),) for href in batch]), reportname,)
+                req.data.content_type = "text/xml"
+                result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "MULTIGET"))
+                if result and (response is not None) and (response.status == 207) and (respdata is not None):
+                    try:
+                        for response in responseBody(response, respdata).responses():
+                            _ignore_code, value = response.properties.get("{%s}%s" % (namespace, dataname,), (None, None,))
+                            if response.hrefs and value is not None and value.text:
+                                found[urllib.unquote(response.hrefs[0])] = value.text.encode("utf-8")
+                    except Exception:
+                        pass
+                    break
+
+                # Try the other type of multiget, or give up on them
+                reports.pop(0)
+
+            for href in batch:
+                respdata = found.get(urllib.unquote(href))
+                if respdata is None:
+                    _ignore_result, respdata = self.doget(ctx, original_request, (href, collection[1], collection[2],), label)
+                yield href, respdata
+
+    def dofindall(self, ctx, original_request, collection, label=""):
         hrefs = []
         req = request(self.manager)
         req.method = "PROPFIND"
@@ -295,28 +481,68 @@ class caldavtest(object):
 </D:propfind>
 """
         req.data.content_type = "text/xml"
-        result, _ignore_resulttxt, response, respdata = self.dorequest(req, False, False, label=label)
+        result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label=label)
         if result and (response is not None) and (response.status == 207) and (respdata is not None):
+            request_uri = req.getURI(ctx.server_info)
             try:
-                tree = ElementTree(file=StringIO(respdata))
+                for response in responseBody(response, respdata).responses():
+
+                    # Get href for this response
+                    if response.href is None:
+                        return False, "           Wrong number of DAV:href elements\n"
+                    if response.href != request_uri:
+                        hrefs.append((response.href, collection[1], collection[2]))
             except Exception:
                 return ()
-
-            request_uri = req.getURI(self.manager.server_info)
-            for response in tree.findall("{DAV:}response"):
-
-                # Get href for this response
-                href = response.findall("{DAV:}href")
-                if len(href) != 1:
-                    return False, "           Wrong number of DAV:href elements\n"
-                href = href[0].text
-                if href != request_uri:
-                    hrefs.append((href, collection[1], collection[2]))
         return hrefs
 
-    def dodeleteall(self, original_request, deletes, label=""):
-        if len(deletes) == 0:
-            return True
+    def dodeletes(self, ctx, requests, label=""):
+        """
+        Run a set of DELETE requests concurrently, with at most the manager's
+        cleanupConcurrency requests in progress to any one server. The time
+        taken is added to the context's cleanup time.
+
+        @param requests: the DELETE requests to run
+        @type requests: L{list} of L{request}
+        @return: a description of each request that failed
+        @rtype: L{list} of L{str}
+        """
+        if len(requests) == 0:
+            return []
+        start = time.time()
+        failures = [None] * len(requests)
+
+        def _delete(pending):
+            while True:
+                try:
+                    index, req = pending.popleft()
+                except IndexError:
+                    return
+                try:
+                    _ignore_result, _ignore_resulttxt, response, _ignore_respdata = self.dorequest(ctx, req, False, False, label=label)
+                    if response.status / 100 != 2:
+                        failures[index] = "DELETE %s: %d %s" % (req.ruri, response.status, response.reason,)
+                except Exception, e:
+                    failures[index] = "DELETE %s: %s" % (req.ruri, e,)
+
+        # Requests to each server share one queue, serviced by a limited number of threads
+        queues = {}
+        for index, req in enumerate(requests):
+            queues.setdefault((req.host, req.port,), collections.deque()).append((index, req,))
+        threads = []
+        for pending in queues.values():
+            for _ignore in range(min(max(ctx.cleanupConcurrency, 1), len(pending))):
+                thread = threading.Thread(target=_delete, args=(pending,))
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        ctx.cleanuptime += time.time() - start
+        return [failure for failure in failures if failure is not None]
+
+    def dodeleteall(self, ctx, original_request, deletes, label=""):
+        requests = []
         for deleter in deletes:
             req = request(self.manager)
             req.method = "DELETE"
@@ -328,107 +554,170 @@ class caldavtest(object):
                 req.user = deleter[1]
             if len(deleter[2]):
                 req.pswd = deleter[2]
-            _ignore_result, _ignore_resulttxt, response, _ignore_respdata = self.dorequest(req, False, False, label=label)
-            if response.status / 100 != 2:
-                return False
+            requests.append(req)
 
-        return True
+        return self.dodeletes(ctx, requests, label=label)
 
-    def dofindnew(self, original_request, collection, label="", other=False):
-        hresult = ""
+    def dosynccollection(self, ctx, original_request, collection, uri, label=""):
+        """
+        Get the members of a collection that changed since the last time this
+        was called for it, or all of its members the first time, using a
+        sync-collection REPORT. The sync-token for each collection is kept in
+        the context.
+
+        @return: the multistatus response, or L{None} if the server does not
+            support the report
+        @rtype: L{multistatus}
+        """
+        key = (original_request.host, original_request.port, uri, collection[1],)
+        token = ctx.synctokens.get(key, "")
+        if token is None:
+            return None
 
-        uri = collection[0]
-        if other:
-            uri = self.manager.server_info.extrasubs(uri)
-            skip = uri
-            uri = "/".join(uri.split("/")[:-1]) + "/"
-        else:
-            skip = None
-        possible_matches = set()
         req = request(self.manager)
-        req.method = "PROPFIND"
+        req.method = "REPORT"
         req.host = original_request.host
         req.port = original_request.port
         req.ruris.append(uri)
         req.ruri = uri
-        req.headers["Depth"] = "1"
+        req.headers["Depth"] = "0"
         if len(collection[1]):
             req.user = collection[1]
         if len(collection[2]):
             req.pswd = collection[2]
         req.data = data(self.manager)
         req.data.value = """<?xml version="1.0" encoding="utf-8" ?>
-<D:propfind xmlns:D="DAV:">
+<D:sync-collection xmlns:D="DAV:">
+<D:sync-token>%s</D:sync-token>
+<D:sync-level>1</D:sync-level>
 <D:prop>
 <D:getetag/>
 <D:getlastmodified/>
 </D:prop>
-</D:propfind>
-"""
+</D:sync-collection>
+""" % (token,)
         req.data.content_type = "text/xml"
-        result, _ignore_resulttxt, response, respdata = self.dorequest(req, False, False, label="%s | %s" % (label, "FINDNEW"))
+        result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "SYNC"))
+        responses = None
         if result and (response is not None) and (response.status == 207) and (respdata is not None):
             try:
-                tree = ElementTree(file=StringIO(respdata))
+                responses = responseBody(response, respdata).multistatus()
             except Exception:
-                return hresult
+                pass
+        newtoken = responses.root.find("{DAV:}sync-token") if responses is not None else None
+        if newtoken is None or not newtoken.text:
+            # Start again from scratch next time if the token was rejected
+            if token:
+                del ctx.synctokens[key]
+            else:
+                ctx.synctokens[key] = None
+            return None
 
-            latest = 0
-            request_uri = req.getURI(self.manager.server_info)
-            for response in tree.findall("{DAV:}response"):
-
-                # Get href for this response
-                href = response.findall("{DAV:}href")
-                if len(href) != 1:
-                    return False, "           Wrong number of DAV:href elements\n"
-                href = href[0].text
-                if href != request_uri and (not other or href != skip):
-
-                    # Get all property status
-                    propstatus = response.findall("{DAV:}propstat")
-                    for props in propstatus:
-                        # Determine status for this propstat
-                        status = props.findall("{DAV:}status")
-                        if len(status) == 1:
-                            statustxt = status[0].text
-                            status = False
-                            if statustxt.startswith("HTTP/1.1 ") and (len(statustxt) >= 10):
-                                status = (statustxt[9] == "2")
-                        else:
-                            status = False
+        ctx.synctokens[key] = newtoken.text
+        return responses
+
+    def findlatest(self, responses, request_uri, skip=None):
+        """
+        Find the most recently modified members in a multistatus response.
+
+        @param responses: the responses in the multistatus
+        @type responses: iterable of L{msresponse}
+        @return: the hrefs of the members with the latest DAV:getlastmodified
+        @rtype: L{set}
+        """
+        possible_matches = set()
+        latest = 0
+        for response in responses:
+
+            # Get href for this response
+            href = response.href
+            if href is None:
+                continue
+            if href != request_uri and href != skip:
+
+                # Get all property status
+                for code, props in response.propstats:
+                    if isOK(code):
+                        # Get properties for this propstat
+                        for el in props:
 
-                        if status:
                             # Get properties for this propstat
-                            prop = props.findall("{DAV:}prop")
-                            for el in prop:
-
-                                # Get properties for this propstat
-                                glm = el.findall("{DAV:}getlastmodified")
-                                if len(glm) != 1:
-                                    continue
-                                value = glm[0].text
-                                value = rfc822.parsedate(value)
-                                value = time.mktime(value)
-                                if value > latest:
-                                    possible_matches.clear()
-                                    possible_matches.add(href)
-                                    latest = value
-                                elif value == latest:
-                                    possible_matches.add(href)
-                        elif not hresult:
-                            possible_matches.add(href)
+                            glm = el.findall("{DAV:}getlastmodified")
+                            if len(glm) != 1:
+                                continue
+                            value = glm[0].text
+                            value = rfc822.parsedate(value)
+                            value = time.mktime(value)
+                            if value > latest:
+                                possible_matches.clear()
+                                possible_matches.add(href)
+                                latest = value
+                            elif value == latest:
+                                possible_matches.add(href)
+                    else:
+                        possible_matches.add(href)
+
+        return possible_matches
+
+    def dofindnew(self, ctx, original_request, collection, label="", other=False):
+        hresult = ""
+
+        uri = collection[0]
+        if other:
+            uri = ctx.server_info.extrasubs(uri)
+            skip = uri
+            uri = "/".join(uri.split("/")[:-1]) + "/"
+        else:
+            skip = None
+        possible_matches = set()
+
+        # Members changed since the last look at the collection are newer than
+        # all the others, so only those need to be examined
+        responses = self.dosynccollection(ctx, original_request, collection, uri, label="%s | %s" % (label, "FINDNEW"))
+        if responses is not None:
+            possible_matches = self.findlatest(responses, None, skip)
+
+        # Otherwise scan the whole collection
+        if not possible_matches:
+            req = request(self.manager)
+            req.method = "PROPFIND"
+            req.host = original_request.host
+            req.port = original_request.port
+            req.ruris.append(uri)
+            req.ruri = uri
+            req.headers["Depth"] = "1"
+            if len(collection[1]):
+                req.user = collection[1]
+            if len(collection[2]):
+                req.pswd = collection[2]
+            req.data = data(self.manager)
+            req.data.value = """<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:">
+<D:prop>
+<D:getetag/>
+<D:getlastmodified/>
+</D:prop>
+</D:propfind>
+"""
+            req.data.content_type = "text/xml"
+            result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "FINDNEW"))
+            if result and (response is not None) and (response.status == 207) and (respdata is not None):
+                try:
+                    possible_matches = self.findlatest(responseBody(response, respdata).responses(), req.getURI(ctx.server_info), skip)
+                except Exception:
+                    return hresult
 
         if len(possible_matches) == 1:
             hresult = possible_matches.pop()
         elif len(possible_matches) > 1:
-            not_seen_before = possible_matches - self.previously_found
+            not_seen_before = possible_matches - ctx.previously_found
             if len(not_seen_before) == 1:
                 hresult = not_seen_before.pop()
         if hresult:
-            self.previously_found.add(hresult)
+            ctx.previously_found.add(hresult)
         return hresult
 
-    def dofindcontains(self, original_request, collection, match, label=""):
+    def dofindcontains(self, ctx, original_request, collection, match, label=""):
         hresult = ""
 
         uri = collection[0]
@@ -452,35 +741,87 @@ class caldavtest(object):
 </D:propfind>
 """
         req.data.content_type = "text/xml"
-        result, _ignore_resulttxt, response, respdata = self.dorequest(req, False, False, label="%s | %s" % (label, "FINDNEW"))
+        result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "FINDNEW"))
         if result and (response is not None) and (response.status == 207) and (respdata is not None):
+            request_uri = req.getURI(ctx.server_info)
+            hrefs = []
             try:
-                tree = ElementTree(file=StringIO(respdata))
+                for response in responseBody(response, respdata).responses():
+
+                    # Get href for this response
+                    if response.href is None:
+                        return False, "           Wrong number of DAV:href elements\n"
+                    if response.href != request_uri:
+                        hrefs.append(response.href)
             except Exception:
                 return hresult
 
-            request_uri = req.getURI(self.manager.server_info)
-            for response in tree.findall("{DAV:}response"):
+            for href, respdata in self.dogetmany(ctx, req, collection, hrefs, label):
+                if respdata is not None and respdata.find(match) != -1:
+                    hresult = href
+                    break
 
-                # Get href for this response
-                href = response.findall("{DAV:}href")
-                if len(href) != 1:
-                    return False, "           Wrong number of DAV:href elements\n"
-                href = href[0].text
-                if href != request_uri:
+        return hresult
 
-                    _ignore_result, respdata = self.doget(req, (href, collection[1], collection[2],), label)
-                    if respdata.find(match) != -1:
-                        break
-            else:
-                href = None
+    def dogetchangeindicator(self, ctx, original_request, collection, label=""):
+        """
+        Get the CS:getctag and DAV:sync-token of a collection, which change
+        whenever its members change.
 
-        return href
+        @return: L{tuple} of the two values, or L{None} if the server supports
+            neither
+        """
+        req = request(self.manager)
+        req.method = "PROPFIND"
+        req.host = original_request.host
+        req.port = original_request.port
+        req.ruris.append(collection[0])
+        req.ruri = collection[0]
+        req.headers["Depth"] = "0"
+        if len(collection[1]):
+            req.user = collection[1]
+        if len(collection[2]):
+            req.pswd = collection[2]
+        req.data = data(self.manager)
+        req.data.value = """<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:" xmlns:CS="http://calendarserver.org/ns/">
+<D:prop>
+<CS:getctag/>
+<D:sync-token/>
+</D:prop>
+</D:propfind>
+"""
+        req.data.content_type = "text/xml"
+        result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "CHANGED"))
+        if result and (response is not None) and (response.status == 207) and (respdata is not None):
+            body = responseBody(response, respdata)
+            indicator = (
+                self.extractProperty("{http://calendarserver.org/ns/}getctag", body),
+                self.extractProperty("{DAV:}sync-token", body),
+            )
+            if any([isinstance(value, basestring) for value in indicator]):
+                return indicator
+
+        return None
 
-    def dowaitcount(self, original_request, collection, count, label=""):
+    def dowaitcount(self, ctx, original_request, collection, count, label=""):
 
         hrefs = []
-        for _ignore in range(self.manager.server_info.waitcount):
+        wait = waiter(ctx)
+        checkchanged = True
+        lastchange = None
+        for _ignore in range(ctx.server_info.waitcount):
+
+            # Only count the members again once the collection has changed
+            if checkchanged:
+                change = self.dogetchangeindicator(ctx, original_request, collection, label="%s | %s %d" % (label, "WAITCOUNT", count))
+                if change is None:
+                    checkchanged = False
+                elif change == lastchange:
+                    wait.pause()
+                    continue
+                lastchange = change
+
             req = request(self.manager)
             req.method = "PROPFIND"
             req.host = original_request.host
@@ -501,43 +842,40 @@ class caldavtest(object):
 </D:propfind>
 """
             req.data.content_type = "text/xml"
-            result, _ignore_resulttxt, response, respdata = self.dorequest(req, False, False, label="%s | %s %d" % (label, "WAITCOUNT", count))
+            result, _ignore_resulttxt, response, respdata = self.dorequest(ctx, req, False, False, label="%s | %s %d" % (label, "WAITCOUNT", count))
             hrefs = []
             if result and (response is not None) and (response.status == 207) and (respdata is not None):
-                tree = ElementTree(file=StringIO(respdata))
-
-                for response in tree.findall("{DAV:}response"):
-                    href = response.findall("{DAV:}href")[0]
-                    if href.text.rstrip("/") != collection[0].rstrip("/"):
-                        hrefs.append(href.text)
+                for response in responseBody(response, respdata).responses():
+                    href = response.hrefs[0]
+                    if href.rstrip("/") != collection[0].rstrip("/"):
+                        hrefs.append(href)
 
                 if len(hrefs) == count:
                     return True, None
-            delay = self.manager.server_info.waitdelay
-            starttime = time.time()
-            while (time.time() < starttime + delay):
-                pass
+            wait.pause()
 
-        if self.manager.debug and hrefs:
+        if ctx.debug and hrefs:
             # Get the content of each resource
             rdata = ""
-            for href in hrefs:
-                result, respdata = self.doget(req, (href, collection[1], collection[2],), label)
+            for href, respdata in self.dogetmany(ctx, req, collection, hrefs, label):
                 test = "unknown"
+                if respdata is None:
+                    respdata = ""
                 if respdata.startswith("BEGIN:VCALENDAR"):
                     uid = respdata.find("UID:")
                     if uid != -1:
                         uid = respdata[uid + 4:uid + respdata[uid:].find("\r\n")]
-                        test = self.uidmaps.get(uid, "unknown")
+                        test = ctx.uidmaps.get(uid, "unknown")
                 rdata += "\n\nhref: {h}\ntest: {t}\n\n{r}\n".format(h=href, t=test, r=respdata)
 
             return False, rdata
         else:
             return False, len(hrefs)
 
-    def dowaitchanged(self, original_request, uri, etag, user, pswd, label=""):
+    def dowaitchanged(self, ctx, original_request, uri, etag, user, pswd, label=""):
 
-        for _ignore in range(self.manager.server_info.waitcount):
+        wait = waiter(ctx)
+        for _ignore in range(ctx.server_info.waitcount):
             req = request(self.manager)
             req.method = "HEAD"
             req.host = original_request.host
@@ -548,7 +886,7 @@ class caldavtest(object):
                 req.user = user
             if pswd:
                 req.pswd = pswd
-            result, _ignore_resulttxt, response, _ignore_respdata = self.dorequest(req, False, False, label="%s | %s" % (label, "WAITCHANGED"))
+            result, _ignore_resulttxt, response, _ignore_respdata = self.dorequest(ctx, req, False, False, label="%s | %s" % (label, "WAITCHANGED"))
             if result and (response is not None):
                 if response.status / 100 == 2:
                     hdrs = response.msg.getheaders("Etag")
@@ -558,20 +896,18 @@ class caldavtest(object):
                             break
                 else:
                     return False
-            delay = self.manager.server_info.waitdelay
-            starttime = time.time()
-            while (time.time() < starttime + delay):
-                pass
+            wait.pause()
         else:
             return False
 
         return True
 
-    def doenddelete(self, description, label=""):
-        if len(self.end_deletes) == 0:
+    def doenddelete(self, ctx, description, label=""):
+        if len(ctx.end_deletes) == 0:
             return True
-        self.manager.message("trace", "Start: " + description)
-        for uri, delete_request in self.end_deletes:
+        ctx.message("trace", "Start: " + description)
+        requests = []
+        for uri, delete_request in ctx.end_deletes:
             req = request(self.manager)
             req.method = "DELETE"
             req.host = delete_request.host
@@ -581,10 +917,17 @@ class caldavtest(object):
             req.user = delete_request.user
             req.pswd = delete_request.pswd
             req.cert = delete_request.cert
-            self.dorequest(req, False, False, label=label)
-        self.manager.message("trace", "{name:<60}{value:>10}".format(name="End: " + description, value="[DONE]"))
-
-    def dorequest(self, req, details=False, doverify=True, forceverify=False, stats=None, etags=None, label="", count=1):
+            requests.append(req)
+        ctx.end_deletes = []
+        start = time.time()
+        failures = self.dodeletes(ctx, requests, label=label)
+        ctx.message("trace", "{name:<60}{value:>10}".format(name="End: " + description, value="[FAILED]" if failures else "[DONE]"))
+        if failures:
+            ctx.message("trace", "\n".join(failures))
+        ctx.message("trace", "    Cleanup Time: %.3f secs" % (time.time() - start,))
+        return not failures
+
+    def dorequest(self, ctx, req, details=False, doverify=True, forceverify=False, stats=None, etags=None, label="", count=1):
 
         req.count = count
 
@@ -603,43 +946,41 @@ class caldavtest(object):
         if req.method == "DELETEALL":
             for ruri in req.ruris:
                 collection = (ruri, req.user, req.pswd)
-                hrefs = self.dofindall(req, collection, label="%s | %s" % (label, "DELETEALL"))
-                if not self.dodeleteall(req, hrefs, label="%s | %s" % (label, "DELETEALL")):
-                    return False, "DELETEALL failed for: {r}".format(r=ruri), None, None
+                hrefs = self.dofindall(ctx, req, collection, label="%s | %s" % (label, "DELETEALL"))
+                failures = self.dodeleteall(ctx, req, hrefs, label="%s | %s" % (label, "DELETEALL"))
+                if failures:
+                    return False, "DELETEALL failed for: {r}\n{f}".format(r=ruri, f="\n".join(failures)), None, None
             return True, "", None, None
 
         # Special for delay
         elif req.method == "DELAY":
             # self.ruri contains a numeric delay in seconds
-            delay = int(req.ruri)
-            starttime = time.time()
-            while (time.time() < starttime + delay):
-                pass
+            ctx.sleep(int(req.ruri))
             return True, "", None, None
 
         # Special for GETNEW
         elif req.method == "GETNEW":
             collection = (req.ruri, req.user, req.pswd)
-            self.grabbedlocation = self.dofindnew(req, collection, label=label)
+            ctx.grabbedlocation = self.dofindnew(ctx, req, collection, label=label)
             if req.graburi:
-                self.manager.server_info.addextrasubs({req.graburi: self.grabbedlocation})
+                ctx.server_info.addextrasubs({req.graburi: ctx.grabbedlocation})
             req.method = "GET"
             req.ruri = "$"
 
         # Special for FINDNEW
         elif req.method == "FINDNEW":
             collection = (req.ruri, req.user, req.pswd)
-            self.grabbedlocation = self.dofindnew(req, collection, label=label)
+            ctx.grabbedlocation = self.dofindnew(ctx, req, collection, label=label)
             if req.graburi:
-                self.manager.server_info.addextrasubs({req.graburi: self.grabbedlocation})
+                ctx.server_info.addextrasubs({req.graburi: ctx.grabbedlocation})
             return True, "", None, None
 
         # Special for GETOTHER
         elif req.method == "GETOTHER":
             collection = (req.ruri, req.user, req.pswd)
-            self.grabbedlocation = self.dofindnew(req, collection, label=label, other=True)
+            ctx.grabbedlocation = self.dofindnew(ctx, req, collection, label=label, other=True)
             if req.graburi:
-                self.manager.server_info.addextrasubs({req.graburi: self.grabbedlocation})
+                ctx.server_info.addextrasubs({req.graburi: ctx.grabbedlocation})
             req.method = "GET"
             req.ruri = "$"
 
@@ -647,11 +988,11 @@ class caldavtest(object):
         elif req.method.startswith("GETCONTAINS"):
             match = req.method[12:]
             collection = (req.ruri, req.user, req.pswd)
-            self.grabbedlocation = self.dofindcontains(req, collection, match, label=label)
-            if not self.grabbedlocation:
+            ctx.grabbedlocation = self.dofindcontains(ctx, req, collection, match, label=label)
+            if not ctx.grabbedlocation:
                 return False, "No matching resource", None, None
             if req.graburi:
-                self.manager.server_info.addextrasubs({req.graburi: self.grabbedlocation})
+                ctx.server_info.addextrasubs({req.graburi: ctx.grabbedlocation})
             req.method = "GET"
             req.ruri = "$"
 
@@ -660,7 +1001,7 @@ class caldavtest(object):
             count = int(req.method[10:])
             for ruri in req.ruris:
                 collection = (ruri, req.user, req.pswd)
-                waitresult, waitdetails = self.dowaitcount(req, collection, count, label=label)
+                waitresult, waitdetails = self.dowaitcount(ctx, req, collection, count, label=label)
                 if not waitresult:
                     return False, "Count did not change: {w}".format(w=waitdetails), None, None
             else:
@@ -671,10 +1012,12 @@ class caldavtest(object):
             count = int(req.method[len("WAITDELETEALL"):])
             for ruri in req.ruris:
                 collection = (ruri, req.user, req.pswd)
-                waitresult, waitdetails = self.dowaitcount(req, collection, count, label=label)
+                waitresult, waitdetails = self.dowaitcount(ctx, req, collection, count, label=label)
                 if waitresult:
-                    hrefs = self.dofindall(req, collection, label="%s | %s" % (label, "DELETEALL"))
-                    self.dodeleteall(req, hrefs, label="%s | %s" % (label, "DELETEALL"))
+                    hrefs = self.dofindall(ctx, req, collection, label="%s | %s" % (label, "DELETEALL"))
+                    failures = self.dodeleteall(ctx, req, hrefs, label="%s | %s" % (label, "DELETEALL"))
+                    if failures:
+                        return False, "DELETEALL failed for: {r}\n{f}".format(r=ruri, f="\n".join(failures)), None, None
                 else:
                     return False, "Count did not change: {w}".format(w=waitdetails), None, None
             else:
@@ -686,15 +1029,15 @@ class caldavtest(object):
         respdata = None
 
         method = req.method
-        uri = req.getURI(self.manager.server_info)
+        uri = req.getURI(ctx.server_info)
         if (uri == "$"):
-            uri = self.grabbedlocation
-        headers = req.getHeaders(self.manager.server_info)
-        data = req.getData()
+            uri = ctx.grabbedlocation
+        headers = req.getHeaders(ctx, uri)
+        data = req.getData(ctx)
 
         # Cache delayed delete
         if req.end_delete:
-            self.end_deletes.append((uri, req,))
+            ctx.end_deletes.append((uri, req,))
 
         if details:
             resulttxt += "        %s: %s\n" % (method, uri)
@@ -702,6 +1045,7 @@ class caldavtest(object):
         # Special for GETCHANGED
         if req.method == "GETCHANGED":
             if not self.dowaitchanged(
+                ctx,
                 req,
                 uri, etags[uri], req.user, req.pswd,
                 label=label
@@ -713,58 +1057,71 @@ class caldavtest(object):
         if stats:
             stats.startTimer()
 
-        # Do the http request
-        http = SmartHTTPConnection(
-            req.host,
-            req.port,
-            self.manager.server_info.ssl,
-            afunix=req.afunix,
-            cert=os.path.join(self.manager.server_info.certdir, req.cert) if req.cert else None
-        )
-
         if 'User-Agent' not in headers and label is not None:
             headers['User-Agent'] = label.encode("utf-8")
 
+        # Do the http request on a pooled connection
+        http = None
+        requestData = ""
         try:
             puri = list(urlparse.urlparse(uri))
             if req.ruri_quote:
                 puri[2] = urllib.quote(puri[2])
             quri = urlparse.urlunparse(puri)
 
-            http.request(method, quri, data, headers)
-
-            response = http.getresponse()
-
-            respdata = None
-            respdata = response.read()
+            # Re-try once if challenged for digest auth
+            for _ignore_attempt in range(2):
+                http, response = ctx.connectionPool.request(
+                    req.host,
+                    req.port,
+                    ctx.server_info.ssl,
+                    req.afunix,
+                    os.path.join(ctx.server_info.certdir, req.cert) if req.cert else None,
+                    method, quri, data, headers
+                )
+
+                respdata = None
+                respdata = readResponse(response, ctx.spoolThreshold)
+                if response.status != 401 or not req.digestChallenged(ctx, response, uri, headers):
+                    break
+                ctx.connectionPool.releaseConnection(http, response)
+                http = None
 
         finally:
-            http.close()
+            if http is not None:
+                # Another thread may re-use the connection once it is released
+                requestData = http.requestData
+                ctx.connectionPool.releaseConnection(http, response if respdata is not None else None)
 
             # Stop request timer before verification
             if stats:
                 stats.endTimer()
 
         if doverify and (respdata is not None):
-            result, txt = self.verifyrequest(req, uri, response, respdata)
+            result, txt = self.verifyrequest(ctx, req, uri, response, respdata)
             resulttxt += txt
         elif forceverify:
             result = (response.status / 100 == 2)
             if not result:
                 resulttxt += "Status Code Error: %d" % response.status
 
-        if req.print_request or (self.manager.print_request_response_on_error and not result and not req.wait_for_success):
+        if req.print_request or (ctx.print_request_response_on_error and not result and not req.wait_for_success):
             requesttxt = "\n-------BEGIN:REQUEST-------\n"
-            requesttxt += http.requestData
+            requesttxt += requestData
             requesttxt += "\n--------END:REQUEST--------\n"
-            self.manager.message("protocol", requesttxt)
+            ctx.message("protocol", requesttxt)
 
-        if req.print_response or (self.manager.print_request_response_on_error and not result and not req.wait_for_success):
+        if req.print_response or (ctx.print_request_response_on_error and not result and not req.wait_for_success):
             responsetxt = "\n-------BEGIN:RESPONSE-------\n"
             responsetxt += "%s %s %s\n" % (getVersionStringFromResponse(response), response.status, response.reason,)
-            responsetxt += str(response.msg) + "\n" + respdata
+            if isinstance(respdata, spooledbody):
+                # Only log the start of large bodies
+                responsetxt += str(response.msg) + "\n" + respdata[:4096]
+                responsetxt += "\n... ({n} bytes, MD5 {m}, SHA-1 {s})".format(n=len(respdata), m=respdata.md5, s=respdata.sha1)
+            else:
+                responsetxt += str(response.msg) + "\n" + respdata
             responsetxt += "\n--------END:RESPONSE--------\n"
-            self.manager.message("protocol", responsetxt)
+            ctx.message("protocol", responsetxt)
 
         if etags is not None and req.method == "GET":
             hdrs = response.msg.getheaders("Etag")
@@ -772,25 +1129,24 @@ class caldavtest(object):
                 etags[uri] = hdrs[0].encode("utf-8")
 
         if req.graburi:
-            self.manager.server_info.addextrasubs({req.graburi: self.grabbedlocation})
+            ctx.server_info.addextrasubs({req.graburi: ctx.grabbedlocation})
 
         if req.grabcount:
             ctr = None
             if result and (response is not None) and (response.status == 207) and (respdata is not None):
-                tree = ElementTree(file=StringIO(respdata))
-                ctr = len(tree.findall("{DAV:}response")) - 1
+                ctr = sum(1 for _ignore in responseBody(response, respdata).responses()) - 1
 
             if ctr is None or ctr == -1:
                 result = False
                 resulttxt += "\nCould not count resources in response\n"
             else:
-                self.manager.server_info.addextrasubs({req.grabcount: str(ctr)})
+                ctx.server_info.addextrasubs({req.grabcount: str(ctr)})
 
         if req.grabheader:
             for hdrname, variable in req.grabheader:
                 hdrs = response.msg.getheaders(hdrname)
                 if hdrs:
-                    self.manager.server_info.addextrasubs({variable: hdrs[0].encode("utf-8")})
+                    ctx.server_info.addextrasubs({variable: hdrs[0].encode("utf-8")})
                 else:
                     result = False
                     resulttxt += "\nHeader %s was not extracted from response\n" % (hdrname,)
@@ -799,12 +1155,12 @@ class caldavtest(object):
             if response.status == 207:
                 for propname, variable in req.grabproperty:
                     # grab the property here
-                    propvalue = self.extractProperty(propname, respdata)
+                    propvalue = self.extractProperty(propname, responseBody(response, respdata))
                     if propvalue is None:
                         result = False
                         resulttxt += "\nProperty %s was not extracted from multistatus response\n" % (propname,)
                     else:
-                        self.manager.server_info.addextrasubs({variable: propvalue.encode("utf-8")})
+                        ctx.server_info.addextrasubs({variable: propvalue.encode("utf-8")})
 
         if req.grabelement:
             for item in req.grabelement:
@@ -813,9 +1169,9 @@ class caldavtest(object):
                     parent = None
                 else:
                     elementpath, parent, variables = item
-                    parent = self.manager.server_info.extrasubs(parent)
+                    parent = ctx.server_info.extrasubs(parent)
                 # grab the property here
-                elementvalues = self.extractElements(elementpath, parent, respdata)
+                elementvalues = self.extractElements(elementpath, parent, responseBody(response, respdata))
                 if elementvalues is None:
                     result = False
                     resulttxt += "\nElement %s was not extracted from response\n" % (elementpath,)
@@ -824,12 +1180,12 @@ class caldavtest(object):
                     resulttxt += "\n%d found but expecting %d for element %s from response\n" % (len(elementvalues), len(variables), elementpath,)
                 else:
                     for variable, elementvalue in zip(variables, elementvalues):
-                        self.manager.server_info.addextrasubs({variable: elementvalue.encode("utf-8") if elementvalue else ""})
+                        ctx.server_info.addextrasubs({variable: elementvalue.encode("utf-8") if elementvalue else ""})
 
         if req.grabjson:
             for pointer, variables in req.grabjson:
                 # grab the JSON value here
-                pointervalues = self.extractPointer(pointer, respdata)
+                pointervalues = self.extractPointer(pointer, responseBody(response, respdata))
                 if pointervalues is None:
                     result = False
                     resulttxt += "\Pointer %s was not extracted from response\n" % (pointer,)
@@ -838,35 +1194,35 @@ class caldavtest(object):
                     resulttxt += "\n%d found but expecting %d for pointer %s from response\n" % (len(pointervalues), len(variables), pointer,)
                 else:
                     for variable, pointervalue in zip(variables, pointervalues):
-                        self.manager.server_info.addextrasubs({variable: pointervalue.encode("utf-8") if pointervalue else ""})
+                        ctx.server_info.addextrasubs({variable: pointervalue.encode("utf-8") if pointervalue else ""})
 
         if req.grabcalprop:
             for propname, variable in req.grabcalprop:
                 # grab the property here
-                propname = self.manager.server_info.subs(propname)
-                propname = self.manager.server_info.extrasubs(propname)
-                propvalue = self.extractCalProperty(propname, respdata)
+                propname = ctx.server_info.subs(propname)
+                propname = ctx.server_info.extrasubs(propname)
+                propvalue = self.extractCalProperty(propname, responseBody(response, respdata))
                 if propvalue is None:
                     result = False
                     resulttxt += "\nCalendar property %s was not extracted from response\n" % (propname,)
                 else:
-                    self.manager.server_info.addextrasubs({variable: propvalue.encode("utf-8")})
+                    ctx.server_info.addextrasubs({variable: propvalue.encode("utf-8")})
 
         if req.grabcalparam:
             for paramname, variable in req.grabcalparam:
                 # grab the property here
-                paramname = self.manager.server_info.subs(paramname)
-                paramname = self.manager.server_info.extrasubs(paramname)
-                paramvalue = self.extractCalParameter(paramname, respdata)
+                paramname = ctx.server_info.subs(paramname)
+                paramname = ctx.server_info.extrasubs(paramname)
+                paramvalue = self.extractCalParameter(paramname, responseBody(response, respdata))
                 if paramvalue is None:
                     result = False
                     resulttxt += "\nCalendar Parameter %s was not extracted from response\n" % (paramname,)
                 else:
-                    self.manager.server_info.addextrasubs({variable: paramvalue.encode("utf-8")})
+                    ctx.server_info.addextrasubs({variable: paramvalue.encode("utf-8")})
 
         return result, resulttxt, response, respdata
 
-    def verifyrequest(self, req, uri, response, respdata):
+    def verifyrequest(self, ctx, req, uri, response, respdata):
 
         result = True
         resulttxt = ""
@@ -882,7 +1238,7 @@ class caldavtest(object):
                     continue
                 if len(verifier.excludedFeatures()) != 0:
                     continue
-                iresult, iresulttxt = verifier.doVerify(uri, response, respdata)
+                iresult, iresulttxt = verifier.doVerify(ctx, uri, response, respdata)
                 if not iresult:
                     result = False
                     if len(resulttxt):
@@ -898,7 +1254,17 @@ class caldavtest(object):
                 resulttxt = ""
             return result, resulttxt
 
-    def parseXML(self, node):
+    # Elements that L{parseHeader} deals with, which come before all others
+    headerElements = (
+        src.xmlDefs.ELEMENT_DESCRIPTION,
+        src.xmlDefs.ELEMENT_REQUIRE_FEATURE,
+        src.xmlDefs.ELEMENT_EXCLUDE_FEATURE,
+    )
+
+    def parseHeader(self, node):
+        """
+        Parse just the details needed to decide whether to run the test file.
+        """
         self.ignore_all = node.get(src.xmlDefs.ATTR_IGNORE_ALL, src.xmlDefs.ATTR_VALUE_NO) == src.xmlDefs.ATTR_VALUE_YES
 
         for child in node.getchildren():
@@ -908,7 +1274,12 @@ class caldavtest(object):
                 self.parseFeatures(child, require=True)
             elif child.tag == src.xmlDefs.ELEMENT_EXCLUDE_FEATURE:
                 self.parseFeatures(child, require=False)
-            elif child.tag == src.xmlDefs.ELEMENT_START:
+
+    def parseXML(self, node):
+        self.parseHeader(node)
+
+        for child in node.getchildren():
+            if child.tag == src.xmlDefs.ELEMENT_START:
                 self.start_requests = request.parseList(self.manager, child)
             elif child.tag == src.xmlDefs.ELEMENT_TESTSUITE:
                 suite = testsuite(self.manager)
@@ -922,57 +1293,33 @@ class caldavtest(object):
             if child.tag == src.xmlDefs.ELEMENT_FEATURE:
                 (self.require_features if require else self.exclude_features).add(child.text.encode("utf-8"))
 
-    def extractProperty(self, propertyname, respdata):
+    def extractProperty(self, propertyname, body):
 
         try:
-            tree = ElementTree(file=StringIO(respdata))
+            responses = body.multistatus()
         except Exception:
             return None
 
-        for response in tree.findall("{DAV:}response"):
-            # Get all property status
-            propstatus = response.findall("{DAV:}propstat")
-            for props in propstatus:
-                # Determine status for this propstat
-                status = props.findall("{DAV:}status")
-                if len(status) == 1:
-                    statustxt = status[0].text
-                    status = False
-                    if statustxt.startswith("HTTP/1.1 ") and (len(statustxt) >= 10):
-                        status = (statustxt[9] == "2")
+        for response in responses:
+            child = response.okProperty(propertyname)
+            if child is not None:
+                if len(child):
+                    # Copy sub-element data as text into one long string and strip leading/trailing space
+                    value = ""
+                    for p in child.getchildren():
+                        temp = tostring(p)
+                        temp = temp.strip()
+                        value += temp
                 else:
-                    status = False
-
-                if not status:
-                    continue
-
-                # Get properties for this propstat
-                prop = props.findall("{DAV:}prop")
-                if len(prop) != 1:
-                    return False, "           Wrong number of DAV:prop elements\n"
-
-                for child in prop[0].getchildren():
-                    fqname = child.tag
-                    if len(child):
-                        # Copy sub-element data as text into one long string and strip leading/trailing space
-                        value = ""
-                        for p in child.getchildren():
-                            temp = tostring(p)
-                            temp = temp.strip()
-                            value += temp
-                    else:
-                        value = child.text
-
-                    if fqname == propertyname:
-                        return value
+                    value = child.text
+                return value
 
         return None
 
-    def extractElement(self, elementpath, respdata):
+    def extractElement(self, elementpath, body):
 
         try:
-            tree = ElementTree()
-            tree.parse(StringIO(respdata))
+            tree = body.xml()
         except:
             return None
 
@@ -994,11 +1341,10 @@ class caldavtest(object):
         else:
             return None
 
-    def extractElements(self, elementpath, parent, respdata):
+    def extractElements(self, elementpath, parent, body):
 
         try:
-            tree = ElementTree()
-            tree.parse(StringIO(respdata))
+            tree = body.xml()
         except:
             return None
 
@@ -1039,23 +1385,23 @@ class caldavtest(object):
         else:
             return None
 
-    def extractPointer(self, pointer, respdata):
+    def extractPointer(self, pointer, body):
 
         jp = JSONMatcher(pointer)
 
         try:
-            j = json.loads(respdata)
+            j = body.json()
         except:
             return None
 
         return jp.match(j)
 
-    def extractCalProperty(self, propertyname, respdata):
+    def extractCalProperty(self, propertyname, body):
 
-        prop = self._calProperty(propertyname, respdata)
+        prop = self._calProperty(propertyname, body)
         return prop.getValue().getValue() if prop else None
 
-    def extractCalParameter(self, parametername, respdata):
+    def extractCalParameter(self, parametername, body):
 
         # propname is a path consisting of component names and the last one a property name
         # e.g. VEVENT/ATTACH
@@ -1067,17 +1413,17 @@ class caldavtest(object):
         if len(bits) > 1:
             propertyname += "$%s" % (bits[1],)
 
-        prop = self._calProperty(propertyname, respdata)
+        prop = self._calProperty(propertyname, body)
 
         try:
             return prop.getParameterValue(pname) if prop else None
         except KeyError:
             return None
 
-    def _calProperty(self, propertyname, respdata):
+    def _calProperty(self, propertyname, body):
 
         try:
-            cal = Calendar.parseText(respdata)
+            cal = body.calendar()
         except Exception:
             return None
 
@@ -1122,11 +1468,11 @@ class caldavtest(object):
 
         return 0
 
-    def postgresResult(self, startCount, indent):
+    def postgresResult(self, ctx, startCount, indent):
 
         if self.manager.postgresLog:
             if os.path.exists(self.manager.postgresLog):
                 newCount = int(commands.getoutput("grep \"LOG:  statement:\" %s | wc -l" % (self.manager.postgresLog,)))
             else:
                 newCount = 0
-            self.manager.message("trace", "Postgres Statements: %d" % (newCount - startCount,))
+            ctx.message("trace", "Postgres Statements: %d" % (newCount - startCount,))
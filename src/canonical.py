@@ -0,0 +1,92 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Cheap canonical forms of iCalendar and vCard data, for spotting data that is
+identical to what is expected without fully parsing it.
+"""
+
+import hashlib
+import json
+import re
+
+_nameEnd = re.compile("[;:]")
+
+
+def canonicalHash(data, is_json=False, dropped=()):
+    """
+    Get a hash of the canonical form of iCalendar or vCard data, in which
+    lines are unfolded, the properties of each component are sorted, and
+    properties with a dropped name are removed. Data with the same hash is
+    semantically the same, but semantically equal data can have different
+    hashes, so a difference in hashes means a full comparison is needed.
+
+    @param data: the text or JSON data
+    @type data: L{str} or L{unicode}
+    @param is_json: whether the data is jCal or jCard
+    @type is_json: L{bool}
+    @param dropped: upper case names of properties to ignore
+    @type dropped: L{frozenset}
+    @return: the hash, or L{None} if the data cannot be canonicalized
+    @rtype: L{str}
+    """
+    try:
+        if is_json:
+            text = json.dumps(_canonicalJSON(json.loads(data), dropped), sort_keys=True)
+        else:
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            text = _canonicalText(data, dropped)
+    except (ValueError, TypeError, IndexError):
+        return None
+    return hashlib.sha1(text).digest()
+
+
+def _canonicalText(data, dropped):
+    data = data.replace("\r\n", "\n").replace("\n ", "").replace("\n\t", "")
+
+    # Each entry is a component's BEGIN line, property lines and sub-components
+    stack = [(None, [], [],)]
+    for line in data.split("\n"):
+        if not line:
+            continue
+        if line.startswith("BEGIN:"):
+            stack.append((line, [], [],))
+        elif line.startswith("END:"):
+            if len(stack) == 1:
+                raise ValueError("END without BEGIN")
+            begin, properties, components = stack.pop()
+            properties.sort()
+            stack[-1][2].append("\n".join([begin] + properties + components + [line]))
+        elif _nameEnd.split(line, 1)[0].upper() not in dropped:
+            stack[-1][1].append(line)
+
+    if len(stack) != 1 or stack[0][1]:
+        raise ValueError("Data outside of a component")
+    return "\n".join(stack[0][2])
+
+
+def _canonicalJSON(component, dropped):
+    # A component is [name, properties, sub-components], with no
+    # sub-components for jCard
+    properties = sorted(
+        [property for property in component[1] if property[0].upper() not in dropped],
+        key=lambda property: json.dumps(property, sort_keys=True),
+    )
+    result = [component[0], properties]
+    if len(component) > 2:
+        result.append([_canonicalJSON(subcomponent, dropped) for subcomponent in component[2]])
+    return result
@@ -0,0 +1,116 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to hold the state of a single test run.
+"""
+
+import time
+
+
+class context(object):
+    """
+    Holds all the mutable state used whilst running a test file: the
+    substitution variables (via a private copy of the server info), grabbed
+    locations, UID maps, collection sync-tokens and delayed deletes. Each
+    running test file gets its own context so that several can run at the same
+    time.
+
+    Anything not held by the context itself is looked up on the L{manager}, so
+    a context can be passed to verifiers and generators in place of the
+    manager.
+    """
+
+    def __init__(self, manager):
+        """
+        @param manager: the manager running the tests
+        @type manager: L{manager}
+        """
+        self.manager = manager
+        self.server_info = manager.server_info.clone()
+        self.grabbedlocation = None
+        self.previously_found = set()
+        self.uidmaps = {}
+        self.synctokens = {}
+        self.end_deletes = []
+        self.deferred_teardown = None
+        self.waited = 0.0
+        self.cleanuptime = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.manager, name)
+
+    def sleep(self, seconds):
+        """
+        Pause the run, adding the time to the total time spent waiting.
+
+        @param seconds: how long to wait for
+        @type seconds: L{float}
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+            self.waited += seconds
+
+
+class recordingcontext(context):
+    """
+    A L{context} that records the results and messages of a test run instead
+    of passing them on to the manager. This allows a test file to be run away
+    from the manager, e.g. in a worker process, with the results merged back
+    into the manager, in order, via L{replay}.
+    """
+
+    def __init__(self, manager):
+        super(recordingcontext, self).__init__(manager)
+        self.events = []
+        self.handles = 0
+
+    def _record(self, method, parent, args, kwargs, handle=None):
+        self.events.append((method, handle, parent, args, kwargs,))
+        return handle
+
+    def _newHandle(self):
+        self.handles += 1
+        return self.handles
+
+    def message(self, message, *args, **kwargs):
+        self._record("message", None, (message,) + args, kwargs)
+
+    def testFile(self, name, details, result=None):
+        return self._record("testFile", None, (name, details, result,), {}, self._newHandle())
+
+    def testSuite(self, testfile, name, details, result=None):
+        return self._record("testSuite", testfile, (name, details, result,), {}, self._newHandle())
+
+    def testResult(self, testsuite, name, details, result, addons=None):
+        self._record("testResult", testsuite, (name, details, result, addons,), {})
+
+    def replay(self, manager):
+        """
+        Pass the recorded results and messages on to the manager, then forget
+        them.
+
+        @param manager: the manager to pass the results to
+        @type manager: L{manager}
+        """
+        results = {}
+        events, self.events = self.events, []
+        for method, handle, parent, args, kwargs in events:
+            if parent is not None:
+                args = (results[parent],) + args
+            result = getattr(manager, method)(*args, **kwargs)
+            if handle is not None:
+                results[handle] = result
@@ -0,0 +1,88 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to cache expected data once it has been normalized for comparison.
+"""
+
+import collections
+import hashlib
+import threading
+
+
+class expectedcache(object):
+    """
+    A least recently used cache of expected data that has been parsed and
+    normalized by a verifier, so that when the same expected data is compared
+    against many responses only the response needs to be parsed each time.
+    The cached values are shared, so must not be changed by the verifiers;
+    a verifier that needs to change one must change a copy.
+    """
+
+    def __init__(self, maxentries=1000):
+        """
+        @param maxentries: number of normalized values to keep
+        @type maxentries: L{int}
+        """
+        self.maxentries = maxentries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, data, *options):
+        """
+        Get the cache key for some expected data.
+
+        @param kind: the kind of normalization
+        @type kind: L{str}
+        @param data: the expected data, after substitutions
+        @type data: L{str} or L{unicode}
+        @param options: anything else that changes the normalized value
+        @rtype: L{tuple}
+        """
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        return (kind, hashlib.sha1(data).digest(),) + options
+
+    def get(self, key, normalize):
+        """
+        Get a normalized value, normalizing and caching it if not cached.
+        Nothing is cached if the normalization fails.
+
+        @param key: the cache key from L{key}
+        @type key: L{tuple}
+        @param normalize: called with no arguments to make the value
+        @type normalize: callable
+        @return: the normalized value
+        """
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+                self.hits += 1
+                return value
+
+        value = normalize()
+
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = value
+            while len(self.entries) > self.maxentries:
+                self.entries.popitem(last=False)
+
+        return value
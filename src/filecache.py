@@ -0,0 +1,189 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to cache the contents of request body and expected data files.
+"""
+
+import collections
+import io
+import mmap
+import os
+import threading
+
+
+class filecache(object):
+    """
+    A least recently used cache of file contents, bounded by the total size of
+    the files held. An entry is only used if the file's modification time and
+    size are unchanged, so files edited during a run are read again. Files at
+    least L{mapsize} bytes long are memory-mapped rather than read in.
+
+    If a L{bundle} is set, files in it are served straight from the bundle,
+    and only files missing from the bundle are looked for on disk.
+    """
+
+    def __init__(self, maxsize=64 * 1024 * 1024, mapsize=1024 * 1024):
+        """
+        @param maxsize: total size of the files to keep
+        @type maxsize: L{int}
+        @param mapsize: size at which files are memory-mapped
+        @type mapsize: L{int}
+        """
+        self.maxsize = maxsize
+        self.mapsize = mapsize
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+        self.bundle = None
+
+    def read(self, path):
+        """
+        Get the contents of a file.
+
+        @param path: path of the file
+        @type path: L{str}
+        @rtype: L{str}
+        @raise IOError: if the file cannot be read
+        """
+        data = self.get(path)
+        return data if isinstance(data, str) else data[:]
+
+    def get(self, path):
+        """
+        Get the contents of a file, which for large files is a read-only
+        L{mmap.mmap} that must not be closed, and for files in the bundle is a
+        L{buffer}.
+
+        @param path: path of the file
+        @type path: L{str}
+        @rtype: L{str}, L{mmap.mmap} or L{buffer}
+        @raise IOError: if the file cannot be read
+        """
+        if self.bundle is not None:
+            data = self.bundle.get(path)
+            if data is not None:
+                with self.lock:
+                    self.hits += 1
+                    self.saved += len(data)
+                return data
+
+        try:
+            st = os.stat(path)
+        except OSError, e:
+            raise IOError(e.errno, e.strerror, path)
+
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                mtime, size, data = entry
+                if mtime == st.st_mtime and size == st.st_size:
+                    self.entries[path] = entry
+                    self.hits += 1
+                    self.saved += size
+                    return data
+                self.size -= size
+
+        with open(path, "rb") as f:
+            if st.st_size >= self.mapsize:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+
+        with self.lock:
+            self.misses += 1
+            if st.st_size <= self.maxsize:
+                entry = self.entries.pop(path, None)
+                if entry is not None:
+                    self.size -= entry[1]
+                self.entries[path] = (st.st_mtime, st.st_size, data,)
+                self.size += st.st_size
+
+                # Mapped files are closed once the last user lets go of them
+                while self.size > self.maxsize:
+                    _ignore_path, (_ignore_mtime, size, _ignore_data) = self.entries.popitem(last=False)
+                    self.size -= size
+
+        return data
+
+    def open(self, path):
+        """
+        Open a file for reading, from the bundle if it has the file. Files on
+        disk are opened directly rather than cached, for reading just part of
+        a file.
+
+        @param path: path of the file
+        @type path: L{str}
+        @rtype: file-like object
+        @raise IOError: if the file cannot be opened
+        """
+        if self.bundle is not None:
+            data = self.bundle.get(path)
+            if data is not None:
+                return io.BytesIO(data)
+        return open(path, "rb")
+
+    def listdir(self, path):
+        """
+        Get the names of the entries in a directory, from the bundle if it
+        has the directory.
+
+        @param path: path of the directory
+        @type path: L{str}
+        @rtype: L{list} of L{str}
+        @raise OSError: if the directory cannot be listed
+        """
+        if self.bundle is not None:
+            names = self.bundle.listdir(path)
+            if names is not None:
+                return names
+        return os.listdir(path)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        @rtype: L{dict}
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved": self.saved,
+        }
+
+    def addStats(self, stats):
+        """
+        Add in the statistics from another cache, as returned by its
+        L{stats}.
+
+        @type stats: L{dict}
+        """
+        with self.lock:
+            self.hits += stats["hits"]
+            self.misses += stats["misses"]
+            self.saved += stats["saved"]
+
+    def resetStats(self):
+        """
+        Reset the statistics, keeping the cached files.
+        """
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.saved = 0
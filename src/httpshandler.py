@@ -15,38 +15,212 @@
 ##
 
 import httplib
+import json
+import select
 import socket
 import ssl as sslmodule
+import threading
+import time
 
-# Used to track what type of connection was previously used to connect to a
-# specific server so we don't need to keep iterate over all types to see what
-# works).
-cached_types = ()
-
-# ssl module may be missing some of these attributes depending on how
-# the backend ssl library is configured.
-for attrname in ("PROTOCOL_TLSv1", "PROTOCOL_SSLv3", "PROTOCOL_SSLv23"):
-    if hasattr(sslmodule, attrname):
-        cached_types += ((set(), getattr(sslmodule, attrname)),)
-if len(cached_types) == 0:
+# The TLS protocol types to try, in order, when connecting to a server. The ssl
+# module may be missing some of these attributes depending on how the backend
+# ssl library is configured.
+ssl_protocols = tuple([
+    (attrname, getattr(sslmodule, attrname))
+    for attrname in ("PROTOCOL_TLSv1", "PROTOCOL_SSLv3", "PROTOCOL_SSLv23")
+    if hasattr(sslmodule, attrname)
+])
+if len(ssl_protocols) == 0:
     raise RuntimeError("Unable to find suitable SSL protocol to use")
 
 
+class TLSConnectionFactory(object):
+    """
+    Sets up the TLS layer for L{HTTPSVersionConnection}s. One C{SSLContext} is
+    created for each protocol and client cert pair and shared by all connections
+    using them, and TLS sessions are re-used across connections to the same
+    server where the ssl module supports it. The protocol that worked for each
+    server is remembered, and optionally persisted to a cache file, so that
+    later connections (and later runs) do not need to probe all protocols.
+    It is safe to share one factory between threads.
+    """
+
+    def __init__(self, cachePath=None):
+        """
+        @param cachePath: path of a file used to persist the protocol that
+            worked for each server, or L{None} to not persist them
+        @type cachePath: L{str}
+        """
+        self.cachePath = cachePath
+        self.lock = threading.RLock()
+        self.contexts = {}
+        self.sessions = {}
+        self.protocols = {}
+
+        # Statistics
+        self.handshakes = 0
+        self.resumed = 0
+
+        self.loadProtocols()
+
+    def loadProtocols(self):
+        """
+        Read the per-server protocol names from the cache file.
+        """
+        if self.cachePath:
+            try:
+                with open(self.cachePath) as f:
+                    protocols = json.load(f)
+            except (IOError, ValueError):
+                return
+            known = dict(ssl_protocols)
+            for server, name in protocols.items():
+                if name in known:
+                    self.protocols[server.encode("utf-8")] = name.encode("utf-8")
+
+    def saveProtocols(self):
+        """
+        Write the per-server protocol names to the cache file.
+        """
+        if self.cachePath:
+            try:
+                with open(self.cachePath, "w") as f:
+                    json.dump(self.protocols, f)
+            except IOError:
+                pass
+
+    def getProtocol(self, host, port):
+        """
+        Get the name of the protocol that last worked for a server.
+
+        @return: name of the ssl module protocol constant or L{None}
+        @rtype: L{str}
+        """
+        return self.protocols.get("{}:{}".format(host, port))
+
+    def setProtocol(self, host, port, name):
+        """
+        Record the name of the protocol that worked for a server, or remove it
+        when L{None}.
+        """
+        server = "{}:{}".format(host, port)
+        with self.lock:
+            if self.protocols.get(server) != name:
+                if name is None:
+                    del self.protocols[server]
+                else:
+                    self.protocols[server] = name
+                self.saveProtocols()
+
+    def getContext(self, protocol, cert=None):
+        """
+        Get the shared C{SSLContext} for a protocol and client cert.
+        """
+        key = (protocol, cert,)
+        with self.lock:
+            if key not in self.contexts:
+                context = sslmodule.SSLContext(protocol)
+                if cert:
+                    context.load_cert_chain(cert)
+                self.contexts[key] = context
+            return self.contexts[key]
+
+    def wrapSocket(self, sock, host, port, protocol, cert=None):
+        """
+        Do the TLS handshake on a connected socket, resuming a previous TLS
+        session with the same server if possible.
+
+        @return: the TLS socket
+        @rtype: C{ssl.SSLSocket}
+        """
+        key = (host, port, protocol, cert,)
+        kwargs = {}
+        with self.lock:
+            if key in self.sessions:
+                kwargs["session"] = self.sessions[key]
+        tlssock = self.getContext(protocol, cert).wrap_socket(sock, **kwargs)
+
+        # Older ssl modules do not expose sessions
+        with self.lock:
+            self.handshakes += 1
+            if getattr(tlssock, "session_reused", False):
+                self.resumed += 1
+            if getattr(tlssock, "session", None) is not None:
+                self.sessions[key] = tlssock.session
+        return tlssock
+
+
+class DigestSessionCache(object):
+    """
+    Caches the digest authentication challenge last received from each server
+    for each user, along with the HA1 derived from it, so that requests can be
+    authorized pre-emptively without waiting to be challenged. The nonce count
+    for each challenge is incremented as it is used. It is safe to share one
+    cache between threads.
+    """
+
+    def __init__(self, lifetime=600):
+        """
+        @param lifetime: number of seconds a challenge is used for before a new
+            one is needed
+        @type lifetime: L{int}
+        """
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def setSession(self, key, details):
+        """
+        Cache a new challenge.
+
+        @param key: identifies the server and user
+        @type key: L{tuple}
+        @param details: the challenge parameters and HA1
+        @type details: L{dict}
+        """
+        session = dict(details)
+        session["nc"] = 0
+        session["expires"] = time.time() + self.lifetime
+        with self.lock:
+            self.sessions[key] = session
+
+    def nextSession(self, key):
+        """
+        Get the cached challenge with its next nonce count.
+
+        @param key: identifies the server and user
+        @type key: L{tuple}
+        @return: a copy of the challenge parameters, or L{None} if there is no
+            challenge or it has expired
+        @rtype: L{dict}
+        """
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                return None
+            if session["expires"] <= time.time():
+                del self.sessions[key]
+                return None
+            session["nc"] += 1
+            return dict(session)
+
+
 class HTTPSVersionConnection(httplib.HTTPSConnection):
     """
     An L{httplib.HTTPSConnection} class that allows the TLS protocol version to be set.
     """
 
-    def __init__(self, host, port, ssl_version=cached_types[0][1], cert_file=None):
+    def __init__(self, host, port, ssl_version=ssl_protocols[0][1], cert_file=None, tls=None):
 
         httplib.HTTPSConnection.__init__(self, host, port, cert_file=cert_file)
         self._ssl_version = ssl_version
+        self._tls = tls if tls is not None else TLSConnectionFactory()
 
     def connect(self):
         "Connect to a host on a given (SSL) port."
 
         sock = socket.create_connection((self.host, self.port), self.timeout)
-        self.sock = sslmodule.wrap_socket(sock, self.key_file, self.cert_file, ssl_version=self._ssl_version)
+        self.sock = self._tls.wrapSocket(sock, self.host, self.port, self._ssl_version, self.cert_file)
 
 
 class UnixSocketHTTPConnection(httplib.HTTPConnection):
@@ -66,12 +240,12 @@ class UnixSocketHTTPConnection(httplib.HTTPConnection):
         self.sock.connect(self.path)
 
 
-def SmartHTTPConnection(host, port, ssl, afunix, cert=None):
+def SmartHTTPConnection(host, port, ssl, afunix, cert=None, tls=None):
     """
     Create the appropriate L{httplib.HTTPConnection} derived class for the supplied arguments.
     This attempts to connect to a server using the available SSL protocol types (as per
-    L{cached_types} and if that succeeds it records the host/port in L{cached_types} for
-    use with subsequent connections.
+    L{ssl_protocols}) and if that succeeds it records the protocol for the host/port in
+    the L{TLSConnectionFactory} for use with subsequent connections.
 
     @param host: TCP host name
     @type host: L{str}
@@ -83,33 +257,232 @@ def SmartHTTPConnection(host, port, ssl, afunix, cert=None):
     @type afunix: L{str}
     @param cert: SSL client cert path to use or L{None}
     @type cert: L{str}
+    @param tls: the TLS setup to use or L{None} for a new one
+    @type tls: L{TLSConnectionFactory}
     """
 
+    if tls is None:
+        tls = TLSConnectionFactory()
+
     def trySSL(version, cert=None):
-        connect = HTTPSVersionConnection(host, port, ssl_version=version, cert_file=cert)
+        connect = HTTPSVersionConnection(host, port, ssl_version=version, cert_file=cert, tls=tls)
         connect.connect()
         return connect
 
     if afunix:
         connect = UnixSocketHTTPConnection(afunix, host, port)
     elif ssl:
-        # Iterate over the TL:S versions and find one that works and cache it for future use.
-        for cached, connection_type in cached_types:
-            if (host, port) in cached:
+        # Use the TLS version that previously worked, otherwise iterate over the TLS versions
+        # and find one that works and cache it for future use.
+        cached = tls.getProtocol(host, port)
+        for name, connection_type in ssl_protocols:
+            if name == cached:
                 try:
                     return trySSL(connection_type, cert)
                 except:
-                    cached.remove((host, port))
+                    tls.setProtocol(host, port, None)
 
-        for cached, connection_type in cached_types:
+        for name, connection_type in ssl_protocols:
+            if name == cached:
+                continue
             try:
-                cached.add((host, port))
-                return trySSL(connection_type, cert)
+                connect = trySSL(connection_type, cert)
             except:
-                cached.remove((host, port))
+                pass
+            else:
+                tls.setProtocol(host, port, name)
+                return connect
 
         raise RuntimeError("Cannot connect via with TLSv1, SSLv3 or SSLv23")
     else:
         connect = httplib.HTTPConnection(host, port)
     connect.connect()
     return connect
+
+
+class HTTPConnectionPool(object):
+    """
+    A pool of persistent HTTP/1.1 connections. Connections are keyed by the
+    host, port, SSL, unix socket and client certificate details so that any
+    subsequent request to the same server can re-use an idle connection rather
+    than paying for a new TCP (and TLS) handshake. A connection that the server
+    has closed whilst idle is transparently replaced with a new one, and the
+    request re-tried if it is safe to send it again. The pool can be shared by
+    several threads each running their own requests.
+    """
+
+    # Methods that can be sent again if a re-used connection fails, as
+    # sending them twice has the same effect as sending them once
+    idempotent = frozenset(("GET", "HEAD", "PROPFIND", "REPORT", "OPTIONS", "PUT", "DELETE",))
+
+    def __init__(self, maxIdle=4, tls=None):
+        """
+        @param maxIdle: maximum number of idle connections kept for each
+            server, zero disables connection re-use
+        @type maxIdle: L{int}
+        @param tls: the TLS setup shared by all connections
+        @type tls: L{TLSConnectionFactory}
+        """
+        self.maxIdle = maxIdle
+        self.tls = tls if tls is not None else TLSConnectionFactory()
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.digest = DigestSessionCache()
+
+        # Statistics
+        self.opened = 0
+        self.reused = 0
+        self.handshakeTime = 0.0
+
+    def getConnection(self, host, port, ssl, afunix, cert=None):
+        """
+        Get an idle connection for the specified server, or create a new one.
+
+        @return: a connected L{httplib.HTTPConnection}
+        """
+        key = (host, port, ssl, afunix, cert,)
+        with self.lock:
+            idle = self.idle.get(key)
+            connect = idle.pop() if idle else None
+            if connect is not None:
+                self.reused += 1
+        if connect is not None:
+            connect.reused = True
+        else:
+            start = time.time()
+            connect = SmartHTTPConnection(host, port, ssl, afunix, cert=cert, tls=self.tls)
+            with self.lock:
+                self.handshakeTime += time.time() - start
+                self.opened += 1
+            connect.reused = False
+        connect.poolKey = key
+        return connect
+
+    def releaseConnection(self, connect, response=None):
+        """
+        Return a connection to the pool once the response to the last request
+        on it has been fully read. Connections that the server wants closed, or
+        that exceed the idle limit for the server, are closed instead.
+
+        @param connect: the connection to release
+        @type connect: L{httplib.HTTPConnection}
+        @param response: the last response read from the connection or L{None}
+            if the request did not complete
+        @type response: L{httplib.HTTPResponse}
+        """
+        if (
+            response is None or
+            response.will_close or
+            not response.isclosed() or
+            connect.sock is None
+        ):
+            connect.close()
+            return
+
+        with self.lock:
+            idle = self.idle.setdefault(connect.poolKey, [])
+            if len(idle) < self.maxIdle:
+                idle.append(connect)
+                return
+        connect.close()
+
+    def request(self, host, port, ssl, afunix, cert, method, uri, body=None, headers={}):
+        """
+        Send a request on a pooled connection and return the connection and its
+        response. If a re-used connection turns out to have been closed by the
+        server, only an idempotent request is re-tried on a new connection, as
+        the server may have acted on it before closing. Other requests are
+        only sent on a re-used connection that the server has not already
+        closed. The caller must read the response and then pass both back to
+        L{releaseConnection}.
+
+        @return: L{tuple} of connection and L{httplib.HTTPResponse}
+        """
+        while True:
+            connect = self.getConnection(host, port, ssl, afunix, cert)
+            if connect.reused and method not in self.idempotent and self.closedByServer(connect):
+                connect.close()
+                with self.lock:
+                    self.reused -= 1
+                continue
+            connect.requestData = ""
+            try:
+                connect.request(method, uri, body, headers)
+                return connect, connect.getresponse()
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                connect.close()
+                if not connect.reused or method not in self.idempotent:
+                    raise
+                with self.lock:
+                    self.reused -= 1
+
+    @staticmethod
+    def closedByServer(connect):
+        """
+        Determine whether the server has closed an idle connection. Nothing is
+        expected from the server on an idle connection, so it has been closed
+        if there is anything to read.
+
+        @param connect: the idle connection
+        @type connect: L{httplib.HTTPConnection}
+        @rtype: L{bool}
+        """
+        try:
+            readable, _ignore_writable, _ignore_errors = select.select([connect.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return len(readable) != 0
+
+    def forgetConnections(self):
+        """
+        Drop all idle connections without closing them, and reset the
+        statistics. This is used in a forked child process where the
+        connections still belong to the parent.
+        """
+        with self.lock:
+            self.idle = {}
+            self.opened = 0
+            self.reused = 0
+            self.handshakeTime = 0.0
+        with self.tls.lock:
+            self.tls.handshakes = 0
+            self.tls.resumed = 0
+
+    def stats(self):
+        """
+        Get the connection statistics.
+
+        @rtype: L{dict}
+        """
+        return {
+            "opened": self.opened,
+            "reused": self.reused,
+            "handshakeTime": self.handshakeTime,
+            "handshakes": self.tls.handshakes,
+            "resumed": self.tls.resumed,
+        }
+
+    def addStats(self, stats):
+        """
+        Add in the connection statistics from another pool, as returned by its
+        L{stats}.
+
+        @type stats: L{dict}
+        """
+        with self.lock:
+            self.opened += stats["opened"]
+            self.reused += stats["reused"]
+            self.handshakeTime += stats["handshakeTime"]
+        with self.tls.lock:
+            self.tls.handshakes += stats["handshakes"]
+            self.tls.resumed += stats["resumed"]
+
+    def closeAll(self):
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connect in connections:
+                connect.close()
@@ -18,14 +18,24 @@
 Class to manage the testing process.
 """
 
+from multiprocessing.pool import ThreadPool
+from src.bundle import bundle
+from src.context import context, recordingcontext
+from src.expectedcache import expectedcache
+from src.filecache import filecache
+from src.httpshandler import HTTPConnectionPool
+from src.plancache import plancache
+from src.responsebody import responsebody
 from src.serverinfo import serverinfo
-from xml.etree.cElementTree import ElementTree
+from xml.etree.cElementTree import ElementTree, iterparse
 from xml.parsers.expat import ExpatError
 import getopt
+import multiprocessing
 import os
 import random
 import src.xmlDefs
 import sys
+import threading
 import time
 
 # Exceptions
@@ -33,6 +43,48 @@ import time
 EX_INVALID_CONFIG_FILE = "Invalid Config File"
 EX_FAILED_REQUEST = "HTTP Request Failed"
 
+# The manager used by worker processes, inherited from the parent when forked
+_workerManager = None
+
+
+def _parseWorkerTestFile(fname):
+    """
+    Parse a test file in a worker process.
+
+    @param fname: path of the test file
+    @type fname: L{str}
+    @return: the test serialized by L{plancache.dumps}
+    @rtype: L{str}
+    """
+    return _workerManager.planCache.dumps(_workerManager.parseTestFile(fname))
+
+
+def _initWorker():
+    _workerManager.connectionPool.forgetConnections()
+
+
+def _runWorkerTest(index):
+    """
+    Run a test file in a worker process.
+
+    @param index: index of the test file in the manager's tests
+    @type index: L{int}
+    @return: L{tuple} of the recorded results, the result of
+        L{manager.runTestFile} and the connection and file statistics
+    """
+    ctx = _workerManager.createContext(recording=True)
+    try:
+        result = _workerManager.runTestFile(_workerManager.tests[index], ctx)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        result = (0, 1, 0, False,)
+    _workerManager.tests[index].unload()
+    stats = _workerManager.stats()
+    _workerManager.connectionPool.forgetConnections()
+    _workerManager.fileCache.resetStats()
+    return ctx.events, result, stats
+
 
 class manager(object):
 
@@ -57,9 +109,17 @@ class manager(object):
         self.memUsage = None
         self.randomSeed = None
         self.logFile = None
-        self.digestCache = {}
+        self.connectionPool = HTTPConnectionPool()
+        self.fileCache = filecache()
+        self.expectedCache = expectedcache()
         self.postgresLog = ""
         self.stoponfail = False
+        self.workers = 1
+        self.threads = 1
+        self.cleanupConcurrency = 4
+        self.overlapTeardown = False
+        self.planCache = None
+        self.spoolThreshold = 16 * 1024 * 1024
         self.print_request = False
         self.print_response = False
         self.print_request_response_on_error = False
@@ -175,29 +235,23 @@ class manager(object):
 
         self.server_info.addsubs(moresubs)
 
-        from src.caldavtest import caldavtest
+        plans = self.loadPlans(testfiles) if self.planCache is not None else {}
 
         def _loadFile(fname, ignore_root=True):
-            # Open and parse the config file
-            try:
-                tree = ElementTree(file=fname)
-            except ExpatError, e:
-                raise RuntimeError("Unable to parse file '%s' because: %s" % (fname, e,))
-            caldavtest_node = tree.getroot()
-            if caldavtest_node.tag != src.xmlDefs.ELEMENT_CALDAVTEST:
+            if fname in plans:
+                test = plans[fname]
+            elif ignore_root:
+                test = self.scanTestFile(fname)
+            else:
+                test = self.parseTestFile(fname)
+            if test is None:
                 if ignore_root:
                     self.message("trace", "Ignoring file \"{f}\" because it is not a test file".format(f=fname))
                     return None
                 else:
                     raise EX_INVALID_CONFIG_FILE
-            if not len(caldavtest_node):
-                raise EX_INVALID_CONFIG_FILE
 
             self.message("Reading Test Details from \"{f}\"".format(f=fname))
-            if self.base_dir:
-                fname = fname[len(self.base_dir) + 1:]
-            test = caldavtest(self, fname)
-            test.parseXML(caldavtest_node)
             return test
 
         for ctr, testfile in enumerate(testfiles):
@@ -219,6 +273,123 @@ class manager(object):
 
         self.message("load", None, ctr + 1, len(testfiles))
 
+    def parseTestFile(self, fname):
+        """
+        Parse a test file.
+
+        @param fname: path of the test file
+        @type fname: L{str}
+        @return: the test, or L{None} if the file is not a test file
+        @rtype: L{caldavtest}
+        """
+        from src.caldavtest import caldavtest
+
+        # Open and parse the config file
+        try:
+            with self.fileCache.open(fname) as f:
+                tree = ElementTree(file=f)
+        except ExpatError, e:
+            raise RuntimeError("Unable to parse file '%s' because: %s" % (fname, e,))
+        caldavtest_node = tree.getroot()
+        if caldavtest_node.tag != src.xmlDefs.ELEMENT_CALDAVTEST:
+            return None
+        if not len(caldavtest_node):
+            raise EX_INVALID_CONFIG_FILE
+
+        if self.base_dir:
+            fname = fname[len(self.base_dir) + 1:]
+        test = caldavtest(self, fname)
+        test.parseXML(caldavtest_node)
+        return test
+
+    def scanTestFile(self, fname):
+        """
+        Parse just the header of a test file, leaving the rest to be parsed
+        when the test file is run, so that test files that are not run are
+        never fully parsed.
+
+        @param fname: path of the test file
+        @type fname: L{str}
+        @return: the test, or L{None} if the file is not a test file
+        @rtype: L{caldavtest}
+        """
+        from src.caldavtest import caldavtest
+
+        caldavtest_node = None
+        empty = True
+        depth = 0
+        try:
+            with self.fileCache.open(fname) as f:
+                for event, node in iterparse(f, events=("start", "end",)):
+                    if event == "start":
+                        depth += 1
+                        if depth == 1:
+                            if node.tag != src.xmlDefs.ELEMENT_CALDAVTEST:
+                                return None
+                            caldavtest_node = node
+                        elif depth == 2:
+                            empty = False
+                            if node.tag not in caldavtest.headerElements:
+                                break
+                    else:
+                        depth -= 1
+        except (ExpatError, SyntaxError), e:
+            raise RuntimeError("Unable to parse file '%s' because: %s" % (fname, e,))
+        if empty:
+            raise EX_INVALID_CONFIG_FILE
+
+        name = fname[len(self.base_dir) + 1:] if self.base_dir else fname
+        test = caldavtest(self, name, fname)
+        test.parseHeader(caldavtest_node)
+        return test
+
+    def loadPlans(self, testfiles):
+        """
+        Load test files from the plan cache, parsing and caching any that are
+        not in the cache. When there are several of those they are parsed in
+        worker processes.
+
+        @param testfiles: paths of the test files
+        @type testfiles: L{list} of L{str}
+        @return: the tests (or L{None} for files that are not test files),
+            keyed by path, for the test files that could be cached
+        @rtype: L{dict}
+        """
+        plans = {}
+        misses = []
+        for fname in testfiles:
+            key = self.planCache.key(fname)
+            if key is None:
+                continue
+            test = self.planCache.load(key)
+            if test is not None:
+                plans[fname] = test
+            else:
+                misses.append((fname, key,))
+
+        processes = min(self.workers if self.workers > 1 else multiprocessing.cpu_count(), len(misses))
+        if processes > 1:
+            global _workerManager
+            _workerManager = self
+            try:
+                pool = multiprocessing.Pool(processes)
+                try:
+                    results = pool.map(_parseWorkerTestFile, [fname for fname, _ignore_key in misses])
+                finally:
+                    pool.terminate()
+            finally:
+                _workerManager = None
+            for (fname, key), data in zip(misses, results):
+                self.planCache.store(key, data)
+                plans[fname] = self.planCache.loads(data)
+        else:
+            for fname, key in misses:
+                plans[fname] = self.parseTestFile(fname)
+                self.planCache.store(key, self.planCache.dumps(plans[fname]))
+
+        self.message("trace", "Plan cache: {h} loaded, {m} parsed".format(h=self.planCache.hits, m=len(misses)))
+        return plans
+
     def readCommandLine(self):
         sname = "scripts/server/serverinfo.xml"
         dname = "scripts/tests"
@@ -231,6 +402,7 @@ class manager(object):
         random_order = False
         random_seed = str(random.randint(0, 1000000))
         observer_names = []
+        tls_cache = None
 
         options, args = getopt.getopt(
             sys.argv[1:],
@@ -250,6 +422,16 @@ class manager(object):
                 "random-seed=",
                 "stop",
                 "print-details-onfail",
+                "max-idle=",
+                "tls-cache=",
+                "workers=",
+                "threads=",
+                "cleanup-concurrency=",
+                "overlap-teardown",
+                "plan-cache=",
+                "bundle=",
+                "stream-threshold=",
+                "spool-threshold=",
                 "always-print-request",
                 "always-print-response",
                 "debug"
@@ -297,6 +479,26 @@ class manager(object):
                 self.stoponfail = True
             elif option == "--print-details-onfail":
                 self.print_request_response_on_error = True
+            elif option == "--max-idle":
+                self.connectionPool.maxIdle = int(value)
+            elif option == "--tls-cache":
+                tls_cache = os.path.expanduser(value)
+            elif option == "--workers":
+                self.workers = int(value)
+            elif option == "--threads":
+                self.threads = int(value)
+            elif option == "--cleanup-concurrency":
+                self.cleanupConcurrency = int(value)
+            elif option == "--overlap-teardown":
+                self.overlapTeardown = True
+            elif option == "--plan-cache":
+                self.planCache = plancache(self, os.path.expanduser(value))
+            elif option == "--bundle":
+                self.fileCache.bundle = bundle(os.path.expanduser(value))
+            elif option == "--stream-threshold":
+                responsebody.streamThreshold = int(value)
+            elif option == "--spool-threshold":
+                self.spoolThreshold = int(value)
             elif option == "--always-print-request":
                 self.print_request = True
             elif option == "--always-print-response":
@@ -343,15 +545,29 @@ class manager(object):
         if self.posttest is not None:
             self.posttest = _normPath(self.posttest)
 
+        # The pre- and post- test files check and clean up the same accounts
+        # as every test file, so would see the data of test files running at
+        # the same time
+        if (self.workers > 1 or self.threads > 1) and (self.pretest is not None or self.posttest is not None):
+            raise ValueError("--pretest and --posttest cannot be used with --workers or --threads")
+
         # Randomize file list
         if random_order and len(fnames) > 1:
             random.seed(random_seed)
             random.shuffle(fnames)
             self.randomSeed = random_seed
 
+        # Remember the TLS protocol used for each server across runs
+        if ssl and tls_cache:
+            self.connectionPool.tls.cachePath = tls_cache
+            self.connectionPool.tls.loadProtocols()
+
         # Load observers
         map(lambda name: self.loadObserver(name), observer_names if observer_names else ["log", ])
 
+        if self.fileCache.bundle is not None and self.fileCache.bundle.stale:
+            self.message("trace", "Ignoring bundle \"{b}\" because files have changed since it was packed".format(b=self.fileCache.bundle.path))
+
         self.readXML(sname, fnames, ssl, all)
 
         if self.memUsage:
@@ -359,41 +575,289 @@ class manager(object):
             s = fd.read()
             self.pid = int(s)
 
-    def runAll(self):
+    def createContext(self, recording=False):
+        """
+        Create the state for running one test file, along with its pre- and
+        post- test files.
 
-        startTime = time.time()
+        @param recording: whether results are to be recorded rather than
+            reported straight away
+        @type recording: L{bool}
+        @rtype: L{context}
+        """
+        return recordingcontext(self) if recording else context(self)
 
-        self.message("start")
+    def runTestFile(self, test, ctx, teardown=True):
+        """
+        Run a test file, together with any pre- and post- test files.
+
+        @param test: the test file to run
+        @type test: L{caldavtest}
+        @param ctx: the state for the run
+        @type ctx: L{context}
+        @param teardown: whether to run the end deletes and end requests of
+            the test file, or leave them to the caller
+        @type teardown: L{bool}
+        @return: L{tuple} of the ok, failed and ignored counts for the test
+            file, and whether no more test files are to be run
+        """
+        if self.pretest is not None:
+            _ignore_ok, f, _ignore_ignored = self.pretest.run(ctx)
+
+            # Always stop the tests if the pretest fails
+            if f != 0:
+                return 0, 0, 0, True
+
+        ok, failed, ignored = test.run(ctx, teardown)
+        if failed != 0 and self.stoponfail:
+            return ok, failed, ignored, True
 
+        if self.posttest is not None:
+            _ignore_ok, f, _ignore_ignored = self.posttest.run(ctx)
+
+            # Always stop the tests if the posttest fails
+            if f != 0:
+                return ok, failed, ignored, True
+
+        return ok, failed, ignored, False
+
+    def runTestFiles(self):
+        """
+        Run each test file in turn.
+
+        @return: L{tuple} of the total ok, failed and ignored counts
+        """
         ok = 0
         failed = 0
         ignored = 0
+        for ctr, test in enumerate(self.tests):
+            if len(self.tests) > 1:
+                self.testProgress(ctr + 1, len(self.tests))
+            o, f, i, stop = self.runTestFile(test, self.createContext())
+            test.unload()
+            ok += o
+            failed += f
+            ignored += i
+            if stop:
+                break
+
+        return ok, failed, ignored
+
+    def runTestFilesOverlapped(self):
+        """
+        Run each test file in turn, but with the end deletes and end requests
+        of each test file running in the background whilst the next test file
+        starts. The next test file waits for them instead if any of its
+        requests, or those of the pretest, target the same collections.
+        Results are reported, in order, once each test file has been torn
+        down.
+
+        @return: L{tuple} of the total ok, failed and ignored counts
+        """
+        ok = 0
+        failed = 0
+        ignored = 0
+        pending = None
         try:
             for ctr, test in enumerate(self.tests):
-                if len(self.tests) > 1:
-                    self.testProgress(ctr + 1, len(self.tests))
-                if self.pretest is not None:
-                    o, f, i = self.pretest.run()
+                ctx = self.createContext(recording=True)
+                if pending is not None and self.teardownConflicts(pending, test, ctx):
+                    failed += self.finishTeardown(pending)
+                    pending = None
 
-                    # Always stop the tests if the pretest fails
-                    if f != 0:
-                        break
-
-                o, f, i = test.run()
+                o, f, i, stop = self.runTestFile(test, ctx, teardown=False)
                 ok += o
                 failed += f
                 ignored += i
 
-                if failed != 0 and self.stoponfail:
+                if pending is not None:
+                    failed += self.finishTeardown(pending)
+                pending = (ctr, ctx, None, [], [0],)
+                if ctx.deferred_teardown is not None:
+                    teardown = ctx.deferred_teardown
+                    result = [0]
+                    thread = threading.Thread(target=self._runTeardown, args=(teardown, ctx, result,))
+                    pending = (ctr, ctx, thread, teardown.teardownURIs(ctx), result,)
+                    thread.start()
+
+                if stop:
                     break
+        finally:
+            if pending is not None:
+                failed += self.finishTeardown(pending)
+
+        return ok, failed, ignored
+
+    def _runTeardown(self, test, ctx, result):
+        result[0] = test.teardown(ctx)
+
+    def teardownConflicts(self, pending, test, ctx):
+        """
+        Determine whether the next test file must wait for the background
+        teardown of the previous one, because it targets the collections the
+        teardown changes: the parents of the teardown's URIs, or anything
+        within them or above them. URIs with variables that are not known yet
+        are assumed to conflict.
+        """
+        _ignore_ctr, _ignore_ctx, thread, teardown_uris, _ignore_result = pending
+        if thread is None:
+            return False
+        try:
+            uris = test.targetURIs(ctx)
+            if self.pretest is not None:
+                uris.extend(self.pretest.targetURIs(ctx))
+        except Exception:
+            # Let the test file itself report the problem
+            return True
+        for uri in teardown_uris + uris:
+            if "$" in uri:
+                return True
+
+        def _within(uri, collection):
+            return uri == collection or uri.startswith(collection + "/")
+
+        collections = set([uri.rstrip("/").rsplit("/", 1)[0] for uri in teardown_uris])
+        for uri in set([uri.rstrip("/") for uri in uris]):
+            for collection in collections:
+                if _within(uri, collection) or _within(collection, uri):
+                    return True
+        return False
+
+    def finishTeardown(self, pending):
+        """
+        Wait for the background teardown of a test file, then report the
+        results of the test file.
+
+        @return: the number of teardown failures
+        @rtype: L{int}
+        """
+        ctr, ctx, thread, _ignore_uris, result = pending
+        if thread is not None:
+            thread.join()
+        self.tests[ctr].unload()
+        if len(self.tests) > 1:
+            self.testProgress(ctr + 1, len(self.tests))
+        ctx.replay(self)
+        return result[0]
+
+    def runTestFilesInWorkers(self):
+        """
+        Run the test files spread over a pool of worker processes.
+
+        @return: L{tuple} of the total ok, failed and ignored counts
+        """
+        global _workerManager
+        _workerManager = self
+        try:
+            pool = multiprocessing.Pool(min(self.workers, len(self.tests)), _initWorker)
+            return self.runTestFilesInPool(pool, _runWorkerTest)
+        finally:
+            _workerManager = None
 
-                if self.posttest is not None:
-                    o, f, i = self.posttest.run()
+    def runTestFilesInThreads(self):
+        """
+        Run the test files spread over a pool of threads in this process, all
+        sharing the same connection pool.
+
+        @return: L{tuple} of the total ok, failed and ignored counts
+        """
+        pool = ThreadPool(min(self.threads, len(self.tests)))
+        return self.runTestFilesInPool(pool, self._runThreadTest)
 
-                    # Always stop the tests if the posttest fails
-                    if f != 0:
-                        break
+    def _runThreadTest(self, index):
+        ctx = self.createContext(recording=True)
+        try:
+            result = self.runTestFile(self.tests[index], ctx)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            result = (0, 1, 0, False,)
+        self.tests[index].unload()
+        return ctx.events, result, None
 
+    def runTestFilesInPool(self, pool, runner):
+        """
+        Run the test files spread over a pool of workers. The results of each
+        test file are merged back in the same order as L{runTestFiles} would
+        produce them, and any outstanding test files are cancelled when the
+        tests are to be stopped.
+
+        @param pool: the pool of workers
+        @type pool: L{multiprocessing.pool.Pool}
+        @param runner: runs the test file with the supplied index, returning
+            the recorded results, the result of L{runTestFile} and the
+            statistics from L{stats} to add in, or L{None}
+        @type runner: L{callable}
+        @return: L{tuple} of the total ok, failed and ignored counts
+        """
+        ok = 0
+        failed = 0
+        ignored = 0
+        try:
+            ctx = self.createContext(recording=True)
+            for ctr, (events, result, stats) in enumerate(pool.imap(runner, range(len(self.tests)))):
+                if len(self.tests) > 1:
+                    self.testProgress(ctr + 1, len(self.tests))
+                ctx.events = events
+                ctx.replay(self)
+                if stats is not None:
+                    self.addStats(stats)
+                o, f, i, stop = result
+                ok += o
+                failed += f
+                ignored += i
+                if stop:
+                    pool.terminate()
+                    break
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        return ok, failed, ignored
+
+    def stats(self):
+        """
+        Get the connection and file statistics.
+
+        @rtype: L{dict}
+        """
+        return {
+            "connections": self.connectionPool.stats(),
+            "files": self.fileCache.stats(),
+        }
+
+    def addStats(self, stats):
+        """
+        Add in the statistics from another manager, as returned by its
+        L{stats}.
+
+        @type stats: L{dict}
+        """
+        self.connectionPool.addStats(stats["connections"])
+        self.fileCache.addStats(stats["files"])
+
+    def runAll(self):
+
+        startTime = time.time()
+
+        self.message("start")
+
+        ok = 0
+        failed = 0
+        ignored = 0
+        try:
+            if self.workers > 1 and len(self.tests) > 1:
+                ok, failed, ignored = self.runTestFilesInWorkers()
+            elif self.threads > 1 and len(self.tests) > 1:
+                ok, failed, ignored = self.runTestFilesInThreads()
+            elif self.overlapTeardown and self.posttest is None:
+                ok, failed, ignored = self.runTestFilesOverlapped()
+            else:
+                ok, failed, ignored = self.runTestFiles()
         except:
             failed += 1
             import traceback
@@ -401,6 +865,25 @@ class manager(object):
 
         endTime = time.time()
 
+        self.connectionPool.closeAll()
+        self.message("trace", "Connections: {o} opened, {r} reused, {t:.3f} secs connecting".format(
+            o=self.connectionPool.opened,
+            r=self.connectionPool.reused,
+            t=self.connectionPool.handshakeTime,
+        ))
+        if self.connectionPool.tls.handshakes:
+            self.message("trace", "TLS: {h} handshakes, {r} sessions resumed".format(
+                h=self.connectionPool.tls.handshakes,
+                r=self.connectionPool.tls.resumed,
+            ))
+        if self.fileCache.hits or self.fileCache.misses:
+            self.message("trace", "Files: {h} hits, {m} misses ({p:.0f}% hit rate), {s} bytes saved".format(
+                h=self.fileCache.hits,
+                m=self.fileCache.misses,
+                p=100.0 * self.fileCache.hits / (self.fileCache.hits + self.fileCache.misses),
+                s=self.fileCache.saved,
+            ))
+
         self.timeDiff = endTime - startTime
         self.message("finish")
 
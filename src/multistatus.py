@@ -0,0 +1,186 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Classes to index the responses in a WebDAV multistatus response body.
+"""
+
+from xml.etree.cElementTree import iterparse
+import urllib
+
+
+def statusCode(statustxt):
+    """
+    Get the code from an HTTP status line, such as the text of a DAV:status
+    element.
+
+    @param statustxt: the status line, e.g. "HTTP/1.1 200 OK"
+    @type statustxt: L{str}
+    @return: the status code, or 0 if the text is not a status line
+    @rtype: L{int}
+    """
+    if statustxt:
+        parts = statustxt.split(None, 2)
+        if len(parts) >= 2 and parts[0].startswith("HTTP/"):
+            try:
+                return int(parts[1])
+            except ValueError:
+                pass
+    return 0
+
+
+def isOK(code):
+    """
+    Whether a status code from L{statusCode} is a success code.
+
+    @type code: L{int}
+    @rtype: L{bool}
+    """
+    return 200 <= code < 300
+
+
+class msresponse(object):
+    """
+    One DAV:response in a multistatus.
+
+    @ivar node: the DAV:response element
+    @ivar hrefs: the text of each DAV:href element
+    @ivar href: the text of the DAV:href element, or L{None} if there is not
+        exactly one
+    @ivar status: the code in the DAV:status element, or L{None} if there is
+        not exactly one
+    @ivar propstats: L{tuple} of the status code and DAV:prop elements of each
+        DAV:propstat, with a code of 0 if there is not exactly one DAV:status
+    @ivar properties: map of the name of each property in a DAV:prop to the
+        status code of its DAV:propstat and the property element, for the
+        first occurrence of each property
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.hrefs = [href.text for href in node.findall("{DAV:}href")]
+        self.href = self.hrefs[0] if len(self.hrefs) == 1 else None
+
+        status = node.findall("{DAV:}status")
+        self.status = statusCode(status[0].text) if len(status) == 1 else None
+
+        self.propstats = []
+        self.properties = {}
+        for propstat in node.findall("{DAV:}propstat"):
+            status = propstat.findall("{DAV:}status")
+            code = statusCode(status[0].text) if len(status) == 1 else 0
+            props = propstat.findall("{DAV:}prop")
+            self.propstats.append((code, props,))
+            for prop in props:
+                for child in prop:
+                    self.properties.setdefault(child.tag, (code, child,))
+
+    def unquoted(self):
+        """
+        @return: the unquoted href, or L{None} if there is not exactly one
+        @rtype: L{str}
+        """
+        return urllib.unquote(self.href) if self.href is not None else None
+
+    def okProperty(self, name):
+        """
+        Get a property returned with a success status.
+
+        @param name: the property name, in ElementTree "{namespace}name" form
+        @type name: L{str}
+        @return: the property element, or L{None} if not returned with a
+            success status
+        """
+        for code, props in self.propstats:
+            if isOK(code):
+                for prop in props:
+                    child = prop.find(name)
+                    if child is not None:
+                        return child
+        return None
+
+
+class multistatus(object):
+    """
+    An index of the DAV:response elements in a multistatus, built once for a
+    response body and shared by everything that looks at the responses. The
+    elements it refers to are part of the shared parsed response body, so
+    must not be changed.
+    """
+
+    def __init__(self, tree):
+        """
+        @param tree: the parsed response body
+        @type tree: L{ElementTree}
+        """
+        self.root = tree.getroot()
+        self.responses = [msresponse(node) for node in self.root.findall("{DAV:}response")]
+        self.byhref = {}
+        for response in self.responses:
+            if response.href is not None:
+                self.byhref.setdefault(self.normalize(response.href), response)
+
+    def __iter__(self):
+        return iter(self.responses)
+
+    def __len__(self):
+        return len(self.responses)
+
+    @staticmethod
+    def normalize(href):
+        """
+        Normalize an href for comparison, ignoring quoting and a trailing
+        "/".
+
+        @type href: L{str}
+        @rtype: L{str}
+        """
+        return urllib.unquote(href).rstrip("/")
+
+    def get(self, href):
+        """
+        Get the response for an href.
+
+        @param href: the href, which need not be normalized
+        @type href: L{str}
+        @rtype: L{msresponse} or L{None}
+        """
+        return self.byhref.get(self.normalize(href))
+
+
+def iterresponses(source):
+    """
+    Parse a multistatus incrementally, returning each DAV:response as it is
+    parsed and then discarding it, so that memory use does not grow with the
+    number of responses. Each L{msresponse}, and the elements it refers to,
+    must not be used once the next one has been returned.
+
+    @param source: the multistatus response body
+    @type source: file-like object
+    @rtype: iterator of L{msresponse}
+    """
+    root = None
+    depth = 0
+    for event, node in iterparse(source, events=("start", "end",)):
+        if event == "start":
+            if root is None:
+                root = node
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1 and node.tag == "{DAV:}response":
+                yield msresponse(node)
+                root.remove(node)
@@ -0,0 +1,184 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to cache parsed test files on disk between runs.
+"""
+
+from cStringIO import StringIO
+import cPickle
+import hashlib
+import os
+import tempfile
+
+# Bump this whenever the classes that make up a parsed test file change
+PLAN_CACHE_VERSION = 1
+
+
+class plancache(object):
+    """
+    An on-disk cache of parsed test files (L{caldavtest} objects), so that
+    test files that have not changed do not need to be parsed again on the
+    next run. Each entry is keyed on the contents of the test file and on the
+    server info the test file was parsed with, since substitutions are done
+    whilst parsing.
+
+    The manager referenced by the parsed objects is not stored; the manager
+    loading the cache takes its place.
+    """
+
+    def __init__(self, manager, cachedir):
+        """
+        @param manager: the manager loading the tests
+        @type manager: L{manager}
+        @param cachedir: directory to store the cache entries in
+        @type cachedir: L{str}
+        """
+        self.manager = manager
+        self.cachedir = cachedir
+        self.hits = 0
+        self.misses = 0
+        self._signature = None
+
+    def signature(self):
+        """
+        Hash of everything other than the test file itself that affects how a
+        test file is parsed.
+
+        @rtype: L{str}
+        """
+        if self._signature is None:
+            sha = hashlib.sha1()
+            sha.update(str(PLAN_CACHE_VERSION))
+            sha.update(repr(self._normalize(vars(self.manager.server_info))))
+            sha.update(repr((
+                self.manager.base_dir,
+                self.manager.print_request,
+                self.manager.print_response,
+            )))
+            self._signature = sha.hexdigest()
+        return self._signature
+
+    def _normalize(self, value):
+        if isinstance(value, dict):
+            return sorted([(k, self._normalize(v)) for k, v in value.items() if not k.startswith("_") and k != "subspattern"])
+        elif isinstance(value, (set, frozenset)):
+            return sorted(value)
+        elif isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        else:
+            return value
+
+    def key(self, fname):
+        """
+        Get the cache key for a test file.
+
+        @param fname: path of the test file
+        @type fname: L{str}
+        @return: the key, or L{None} if the test file cannot be cached
+        @rtype: L{str}
+        """
+        try:
+            contents = self.manager.fileCache.read(fname)
+        except IOError:
+            return None
+
+        # Random values are generated whilst parsing, so must be different each run
+        if "$uidrandom:" in contents:
+            return None
+
+        sha = hashlib.sha1()
+        sha.update(self.signature())
+        sha.update(fname)
+        sha.update(contents)
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key + ".plan")
+
+    def load(self, key):
+        """
+        Load a cached test file.
+
+        @param key: the cache key from L{key}
+        @type key: L{str}
+        @return: the test, or L{None} if not cached
+        @rtype: L{caldavtest}
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            test = self.loads(data)
+        except Exception:
+            # Damaged or out of date entry - just parse the test file again
+            self.misses += 1
+            return None
+        self.hits += 1
+        return test
+
+    def store(self, key, data):
+        """
+        Store a test file in the cache.
+
+        @param key: the cache key from L{key}
+        @type key: L{str}
+        @param data: the test as returned by L{dumps}
+        @type data: L{str}
+        """
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            fd, tmpname = tempfile.mkstemp(dir=self.cachedir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmpname, self.path(key))
+        except (IOError, OSError), e:
+            self.manager.message("trace", "Unable to write plan cache entry: {e}".format(e=e))
+
+    def dumps(self, test):
+        """
+        Serialize a test, leaving out the manager.
+
+        @param test: the test to serialize
+        @type test: L{caldavtest}
+        @rtype: L{str}
+        """
+        f = StringIO()
+        pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: "manager" if obj is self.manager else None
+        pickler.dump(test)
+        return f.getvalue()
+
+    def loads(self, data):
+        """
+        Deserialize a test, referencing this cache's manager.
+
+        @param data: the serialized test from L{dumps}
+        @type data: L{str}
+        @rtype: L{caldavtest}
+        """
+        unpickler = cPickle.Unpickler(StringIO(data))
+
+        def _load(pid):
+            if pid == "manager":
+                return self.manager
+            raise cPickle.UnpicklingError("Unknown persistent id: %s" % (pid,))
+        unpickler.persistent_load = _load
+        return unpickler.load()
@@ -0,0 +1,134 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Registries of the verifiers and generators that test files refer to by name.
+"""
+
+import threading
+
+try:
+    # Treat setuptools as optional
+    import pkg_resources
+except ImportError:
+    pkg_resources = None
+
+
+class registry(object):
+    """
+    Maps callback names used in test files to the plugin objects that
+    implement them. Plugins are looked up, in order:
+
+        1. amongst those registered with L{register}
+        2. in the module named after the callback, within the registry's
+            package, as the class with the registry's class name
+        3. amongst the setuptools entry points in the registry's group, so
+            that separately installed packages can provide plugins
+
+    Plugins must not keep any state between calls, as a single instance of
+    each is shared by all the tests.
+    """
+
+    def __init__(self, kind, package, classname, group):
+        """
+        @param kind: what the plugins are, used in error messages
+        @type kind: L{str}
+        @param package: module prefix of built-in plugins
+        @type package: L{str}
+        @param classname: name of the plugin class in built-in plugin modules
+        @type classname: L{str}
+        @param group: name of the setuptools entry point group
+        @type group: L{str}
+        """
+        self.kind = kind
+        self.package = package
+        self.classname = classname
+        self.group = group
+        self.plugins = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, cl):
+        """
+        Register a plugin class, replacing any existing plugin with that name.
+
+        @param name: the callback name used in test files
+        @type name: L{str}
+        @param cl: the plugin class
+        @type cl: L{type}
+        """
+        with self.lock:
+            self.plugins[name] = cl()
+
+    def lookup(self, name):
+        """
+        Get the plugin for a callback name.
+
+        @param name: the callback name used in test files
+        @type name: L{str}
+        @return: the plugin
+        @raise RuntimeError: if there is no such plugin
+        """
+        try:
+            return self.plugins[name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if name not in self.plugins:
+                cl = self._importPlugin(name)
+                if cl is None:
+                    cl = self._loadEntryPoint(name)
+                if cl is None:
+                    raise RuntimeError("Unknown {k} callback: '{n}'".format(k=self.kind, n=name))
+                self.plugins[name] = cl()
+            return self.plugins[name]
+
+    def _importPlugin(self, name):
+        modulename = self.package + name
+        try:
+            module = __import__(modulename, globals(), locals(), [self.classname])
+        except ImportError, e:
+            # Only a missing plugin module means there is no plugin - problems
+            # within the plugin module need to be reported
+            if str(e) == "No module named {m}".format(m=modulename.rsplit(".", 1)[-1]):
+                return None
+            raise
+        return getattr(module, self.classname, None)
+
+    def _loadEntryPoint(self, name):
+        if pkg_resources is None:
+            return None
+        for entrypoint in pkg_resources.iter_entry_points(self.group, name):
+            return entrypoint.load()
+        return None
+
+
+verifiers = registry("verifier", "verifiers.", "Verifier", "caldavtester.verifiers")
+generators = registry("generator", "", "Generator", "caldavtester.generators")
+
+
+def registerVerifier(name, cl):
+    """
+    Register a verifier class for use as a verify callback in test files.
+    """
+    verifiers.register(name, cl)
+
+
+def registerGenerator(name, cl):
+    """
+    Register a generator class for use as a generator callback in test files.
+    """
+    generators.register(name, cl)
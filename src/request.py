@@ -19,16 +19,14 @@ Defines the 'request' class which encapsulates an HTTP request and verification.
 """
 
 from hashlib import md5, sha1
-from src.httpshandler import SmartHTTPConnection
 from src.xmlUtils import getYesNoAttributeValue
 import base64
 import datetime
 import os
 import re
+import src.plugins
 import src.xmlDefs
 import time
-import urllib
-import urlparse
 import uuid
 
 algorithms = {
@@ -131,6 +129,37 @@ def calcResponse(
     return respHash
 
 
+# Matches each name=value part of a WWW-Authenticate challenge
+challengeParams = re.compile(r'([\w-]+)\s*=\s*("[^"]*"|[^,\s]*)')
+
+
+def parseDigestChallenge(wwwauthenticate):
+    """
+    Parse the first digest challenge in a set of WWW-Authenticate header values.
+
+    @param wwwauthenticate: the WWW-Authenticate header values
+    @type wwwauthenticate: L{list} of L{str}
+    @return: the challenge parameters or L{None} if there is no digest challenge
+    @rtype: L{dict}
+    """
+    for item in wwwauthenticate:
+        if not item.lower().startswith("digest "):
+            continue
+        details = {}
+        for name, value in challengeParams.findall(item[7:]):
+            if value[:1] == value[-1:] == '"' and len(value) > 1:
+                value = value[1:-1]
+            details[name.lower()] = value
+
+        # Only auth is supported if the server offers a choice of qop
+        if details.get("qop") and "," in details["qop"]:
+            qops = [qop.strip() for qop in details["qop"].split(",")]
+            details["qop"] = "auth" if "auth" in qops else qops[0]
+        return details
+
+    return None
+
+
 class pause (object):
     pass
 
@@ -141,8 +170,6 @@ class request(object):
     be used to determine a satisfactory output or not.
     """
 
-    nc = {}  # Keep track of nonce count
-
     def __init__(self, manager):
         self.manager = manager
         self.host = self.manager.server_info.host
@@ -195,10 +222,9 @@ class request(object):
                 uri = uri.replace("##", str(self.count))
         return uri
 
-    def getHeaders(self, si):
-        hdrs = self.headers
-        for key, value in hdrs.items():
-            hdrs[key] = si.extrasubs(value)
+    def getHeaders(self, ctx, uri=None):
+        si = ctx.server_info
+        hdrs = dict((key, si.extrasubs(value)) for key, value in self.headers.items())
 
         # Content type
         if self.data is not None:
@@ -209,7 +235,9 @@ class request(object):
             if si.authtype.lower() == "basic":
                 hdrs["Authorization"] = self.gethttpbasicauth(si)
             elif si.authtype.lower() == "digest":
-                hdrs["Authorization"] = self.gethttpdigestauth(si)
+                digestauth = self.gethttpdigestauth(ctx, uri if uri is not None else self.getURI(si))
+                if digestauth:
+                    hdrs["Authorization"] = digestauth
 
         return hdrs
 
@@ -221,84 +249,82 @@ class request(object):
         basicauth = basicauth.replace("\n", "")
         return basicauth
 
-    def gethttpdigestauth(self, si, wwwauthorize=None):
-
-        # Check the nonce cache to see if we've used this user before, or if the nonce is more than 5 minutes old
+    def getdigestsessionkey(self, si):
         user = [self.user, si.user][self.user == ""]
         pswd = [self.pswd, si.pswd][self.pswd == ""]
-        details = None
-        if user in self.manager.digestCache and self.manager.digestCache[user]["max-nonce-time"] > time.time():
-            details = self.manager.digestCache[user]
+        return (self.host, self.port, user, pswd,)
+
+    def gethttpdigestauth(self, ctx, uri):
+        """
+        Get the digest Authorization header value from the cached challenge for
+        the server and user, or an empty string if there is no challenge yet.
+        """
+
+        key = self.getdigestsessionkey(ctx.server_info)
+        details = ctx.connectionPool.digest.nextSession(key)
+        if details is None:
+            return ""
+
+        nc = "%08x" % (details["nc"],) if details.get("qop") else None
+        digest = calcResponse(
+            details["ha1"], details.get("algorithm", "md5"), details.get("nonce"), nc, details.get("cnonce"), details.get("qop"), self.method, uri, None
+        )
+
+        user = key[2]
+        if details.get("qop"):
+            response = (
+                'Digest username="%s", realm="%s", '
+                'nonce="%s", uri="%s", '
+                'response=%s, algorithm=%s, cnonce="%s", qop=%s, nc=%s' %
+                (user, details.get("realm"), details.get("nonce"), uri, digest, details.get("algorithm", "md5"), details.get("cnonce"), details.get("qop"), nc,)
+            )
         else:
-            # Redo digest auth from scratch to get a new nonce etc
-            http = SmartHTTPConnection(si.host, si.port, si.ssl, si.afunix)
-            try:
-                puri = list(urlparse.urlparse(self.getURI(si)))
-                puri[2] = urllib.quote(puri[2])
-                quri = urlparse.urlunparse(puri)
-                http.request("OPTIONS", quri)
-
-                response = http.getresponse()
-
-            finally:
-                http.close()
-
-            if response.status == 401:
-
-                wwwauthorize = response.msg.getheaders("WWW-Authenticate")
-                for item in wwwauthorize:
-                    if not item.lower().startswith("digest "):
-                        continue
-                    wwwauthorize = item[7:]
-
-                    def unq(s):
-                        if s[0] == s[-1] == '"':
-                            return s[1:-1]
-                        return s
-                    parts = wwwauthorize.split(',')
-
-                    details = {}
-
-                    for (k, v) in [p.split('=', 1) for p in parts]:
-                        details[k.strip()] = unq(v.strip())
-
-                    details["max-nonce-time"] = time.time() + 600
-                    self.manager.digestCache[user] = details
-                    break
-
-        if details:
-            if details.get('qop'):
-                if self.nc.get(details.get('nonce')) is None:
-                    self.nc[details.get('nonce')] = 1
-                else:
-                    self.nc[details.get('nonce')] += 1
-                details['nc'] = "%08x" % self.nc[details.get('nonce')]
-                if details.get('cnonce') is None:
-                    details['cnonce'] = "D4AAE4FF-ADA1-4149-BFE2-B506F9264318"
-
-            digest = calcResponse(
-                calcHA1(details.get('algorithm', 'md5'), user, details.get('realm'), pswd, details.get('nonce'), details.get('cnonce')),
-                details.get('algorithm', 'md5'), details.get('nonce'), details.get('nc'), details.get('cnonce'), details.get('qop'), self.method, self.getURI(si), None
+            response = (
+                'Digest username="%s", realm="%s", '
+                'nonce="%s", uri="%s", '
+                'response=%s, algorithm=%s' %
+                (user, details.get("realm"), details.get("nonce"), uri, digest, details.get("algorithm"),)
             )
+        if details.get("opaque") is not None:
+            response += ', opaque="%s"' % (details["opaque"],)
 
-            if details.get('qop'):
-                response = (
-                    'Digest username="%s", realm="%s", '
-                    'nonce="%s", uri="%s", '
-                    'response=%s, algorithm=%s, cnonce="%s", qop=%s, nc=%s' %
-                    (user, details.get('realm'), details.get('nonce'), self.getURI(si), digest, details.get('algorithm', 'md5'), details.get('cnonce'), details.get('qop'), details.get('nc'),)
-                )
-            else:
-                response = (
-                    'Digest username="%s", realm="%s", '
-                    'nonce="%s", uri="%s", '
-                    'response=%s, algorithm=%s' %
-                    (user, details.get('realm'), details.get('nonce'), self.getURI(si), digest, details.get('algorithm'),)
-                )
-
-            return response
-        else:
-            return ""
+        return response
+
+    def digestChallenged(self, ctx, response, uri, headers):
+        """
+        Cache a new digest challenge from a 401 response and update the
+        Authorization header to answer it. A request is only worth re-trying
+        if it was not authorized, or the server says the nonce it used is stale,
+        as otherwise the credentials themselves were rejected.
+
+        @param response: the 401 response
+        @type response: L{httplib.HTTPResponse}
+        @param uri: the request URI
+        @type uri: L{str}
+        @param headers: the request headers, updated with the new Authorization
+        @type headers: L{dict}
+        @return: L{True} if the request should be re-tried
+        @rtype: L{bool}
+        """
+        si = ctx.server_info
+        if not self.auth or si.authtype.lower() != "digest":
+            return False
+
+        details = parseDigestChallenge(response.msg.getheaders("WWW-Authenticate"))
+        if details is None:
+            return False
+        if "Authorization" in headers and details.get("stale", "").lower() != "true":
+            return False
+
+        # The HA1 only depends on the challenge so calculate it once for the session
+        key = self.getdigestsessionkey(si)
+        if details.get("qop") and details.get("cnonce") is None:
+            details["cnonce"] = "D4AAE4FF-ADA1-4149-BFE2-B506F9264318"
+        details["ha1"] = calcHA1(details.get("algorithm", "md5"), key[2], details.get("realm"), key[3], details.get("nonce"), details.get("cnonce"))
+        ctx.connectionPool.digest.setSession(key, details)
+
+        headers["Authorization"] = self.gethttpdigestauth(ctx, uri)
+        return True
 
     def getFilePath(self):
         if self.data is not None:
@@ -306,33 +332,34 @@ class request(object):
         else:
             return ""
 
-    def getData(self):
+    def getData(self, ctx):
         data = ""
         if self.data is not None:
             if len(self.data.value) != 0:
                 data = self.data.value
             elif self.data.filepath:
+                path = self.data.nextpath if hasattr(self.data, "nextpath") else self.getFilePath()
+                if self.data.verbatim:
+                    # Send the file as it is, without copying it out of the file cache
+                    return ctx.fileCache.get(path)
+
                 # read in the file data
-                fd = open(self.data.nextpath if hasattr(self.data, "nextpath") else self.getFilePath(), "r")
-                try:
-                    data = fd.read()
-                finally:
-                    fd.close()
-            data = str(self.manager.server_info.subs(data))
-            self.manager.server_info.addextrasubs({"$request_count:": str(self.count)})
-            data = self.manager.server_info.extrasubs(data)
+                data = ctx.fileCache.read(path)
+            data = str(ctx.server_info.subs(data))
+            ctx.server_info.addextrasubs({"$request_count:": str(self.count)})
+            data = ctx.server_info.extrasubs(data)
             if self.data.substitutions:
-                data = self.manager.server_info.subs(data, self.data.substitutions)
+                data = ctx.server_info.subs(data, self.data.substitutions)
             if self.data.generate:
                 if self.data.content_type.startswith("text/calendar"):
                     data = self.generateCalendarData(data)
             elif self.data.generator:
-                data = self.data.generator.doGenerate()
+                data = self.data.generator.doGenerate(ctx)
         return data
 
     def getNextData(self):
         if not hasattr(self, "dataList"):
-            self.dataList = sorted([path for path in os.listdir(self.getFilePath()) if not path.startswith(".")])
+            self.dataList = sorted([path for path in self.manager.fileCache.listdir(self.getFilePath()) if not path.startswith(".")])
         if len(self.dataList):
             self.data.nextpath = os.path.join(self.getFilePath(), self.dataList.pop(0))
             return True
@@ -344,7 +371,7 @@ class request(object):
             return False
 
     def hasNextData(self):
-        dataList = sorted([path for path in os.listdir(self.getFilePath()) if not path.startswith(".")])
+        dataList = sorted([path for path in self.manager.fileCache.listdir(self.getFilePath()) if not path.startswith(".")])
         return len(dataList) != 0
 
     def generateCalendarData(self, data):
@@ -494,11 +521,13 @@ class data(object):
         self.substitutions = {}
         self.substitute = False
         self.generate = False
+        self.verbatim = False
 
     def parseXML(self, node):
 
         self.substitute = node.get(src.xmlDefs.ATTR_SUBSTITUTIONS, src.xmlDefs.ATTR_VALUE_YES) == src.xmlDefs.ATTR_VALUE_YES
         self.generate = node.get(src.xmlDefs.ATTR_GENERATE, src.xmlDefs.ATTR_VALUE_NO) == src.xmlDefs.ATTR_VALUE_YES
+        self.verbatim = node.get(src.xmlDefs.ATTR_VERBATIM, src.xmlDefs.ATTR_VALUE_NO) == src.xmlDefs.ATTR_VALUE_YES
 
         for child in node.getchildren():
             if child.tag == src.xmlDefs.ELEMENT_CONTENTTYPE:
@@ -533,28 +562,19 @@ class generator(object):
         self.callback = None
         self.args = {}
 
-    def doGenerate(self):
-
-        # Re-do substitutions from values generated during the current test run
-        if self.manager.server_info.hasextrasubs():
-            for name, values in self.args.iteritems():
-                newvalues = [self.manager.server_info.extrasubs(value) for value in values]
-                self.args[name] = newvalues
+    def doGenerate(self, ctx):
 
-        generatorClass = self._importName(self.callback, "Generator")
-        gen = generatorClass()
+        gen = src.plugins.generators.lookup(self.callback)
 
-        # Always clone the args as this verifier may be called multiple times
+        # Always clone the args as this generator may be called multiple times
         args = dict((k, list(v)) for k, v in self.args.items())
 
-        return gen.generate(self.manager, args)
+        # Re-do substitutions from values generated during the current test run
+        if ctx.server_info.hasextrasubs():
+            for name, values in args.iteritems():
+                args[name] = [ctx.server_info.extrasubs(value) for value in values]
 
-    def _importName(self, modulename, name):
-        """
-        Import a named object from a module in the context of this function.
-        """
-        module = __import__(modulename, globals(), locals(), [name])
-        return getattr(module, name)
+        return gen.generate(ctx, args)
 
     def parseXML(self, node):
 
@@ -564,6 +584,9 @@ class generator(object):
             elif child.tag == src.xmlDefs.ELEMENT_ARG:
                 self.parseArgXML(child)
 
+        # Make sure the generator exists before any test is run
+        src.plugins.generators.lookup(self.callback)
+
     def parseArgXML(self, node):
         name = None
         values = []
@@ -600,28 +623,19 @@ class verify(object):
     def excludedFeatures(self):
         return self.exclude_features & self.manager.server_info.features
 
-    def doVerify(self, uri, response, respdata):
+    def doVerify(self, ctx, uri, response, respdata):
 
-        # Re-do substitutions from values generated during the current test run
-        if self.manager.server_info.hasextrasubs():
-            for name, values in self.args.iteritems():
-                newvalues = [self.manager.server_info.extrasubs(value) for value in values]
-                self.args[name] = newvalues
-
-        verifierClass = self._importName("verifiers." + self.callback, "Verifier")
-        verifier = verifierClass()
+        verifier = src.plugins.verifiers.lookup(self.callback)
 
         # Always clone the args as this verifier may be called multiple times
         args = dict((k, list(v)) for k, v in self.args.items())
 
-        return verifier.verify(self.manager, uri, response, respdata, args)
+        # Re-do substitutions from values generated during the current test run
+        if ctx.server_info.hasextrasubs():
+            for name, values in args.iteritems():
+                args[name] = [ctx.server_info.extrasubs(value) for value in values]
 
-    def _importName(self, modulename, name):
-        """
-        Import a named object from a module in the context of this function.
-        """
-        module = __import__(modulename, globals(), locals(), [name])
-        return getattr(module, name)
+        return verifier.verify(ctx, uri, response, respdata, args)
 
     def parseXML(self, node):
 
@@ -635,6 +649,11 @@ class verify(object):
             elif child.tag == src.xmlDefs.ELEMENT_ARG:
                 self.parseArgXML(child)
 
+        # Make sure the verifier exists before any test is run, unless it will
+        # never be used
+        if len(self.missingFeatures()) == 0 and len(self.excludedFeatures()) == 0:
+            src.plugins.verifiers.lookup(self.callback)
+
     def parseFeatures(self, node, require=True):
         for child in node.getchildren():
             if child.tag == src.xmlDefs.ELEMENT_FEATURE:
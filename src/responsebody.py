@@ -0,0 +1,146 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to share the parsed forms of a response body.
+"""
+
+try:
+    # Treat pycalendar as optional
+    from pycalendar.icalendar.calendar import Calendar
+    from pycalendar.vcard.card import Card
+except ImportError:
+    pass
+from cStringIO import StringIO
+from src.multistatus import iterresponses, multistatus
+from src.spool import spooledbody
+from xml.etree.cElementTree import ElementTree
+import json
+
+
+class responsebody(object):
+    """
+    The body of a response, together with its parsed forms. Each form is only
+    parsed the first time it is asked for, and is then shared by all the
+    verifiers and grab steps that look at the response, so the parsed objects
+    must not be changed. Parse errors are remembered and raised again each
+    time that form is asked for.
+
+    Multistatus bodies of at least L{streamThreshold} bytes are parsed
+    incrementally by L{responses}, unless already parsed, so that the whole
+    tree is never held in memory.
+    """
+
+    streamThreshold = 8 * 1024 * 1024
+
+    def __init__(self, data):
+        """
+        @param data: the response body
+        @type data: L{str} or L{spooledbody}
+        """
+        self.data = data
+        self._parsed = {}
+
+    def open(self):
+        """
+        @return: a file-like object for reading the body, e.g. for
+            incremental parsing
+        """
+        if isinstance(self.data, spooledbody):
+            return self.data.open()
+        return StringIO(self.data)
+
+    def _parse(self, kind, parser):
+        try:
+            result, error = self._parsed[kind]
+        except KeyError:
+            try:
+                result, error = parser(self.data), None
+            except Exception, e:
+                result, error = None, e
+            self._parsed[kind] = (result, error,)
+        if error is not None:
+            raise error
+        return result
+
+    def xml(self):
+        """
+        @return: the body parsed as XML
+        @rtype: L{ElementTree}
+        """
+        return self._parse("xml", lambda data: ElementTree(file=self.open()))
+
+    def multistatus(self):
+        """
+        @return: the index of the responses in the body parsed as a
+            multistatus
+        @rtype: L{multistatus}
+        """
+        return self._parse("multistatus", lambda data: multistatus(self.xml()))
+
+    def responses(self):
+        """
+        Iterate over the responses in the body parsed as a multistatus. When
+        the body is parsed incrementally, each response must not be used once
+        the next one has been returned, and parse errors are raised during
+        the iteration.
+
+        @rtype: iterator of L{msresponse}
+        """
+        if len(self.data) < self.streamThreshold or "multistatus" in self._parsed or "xml" in self._parsed:
+            return iter(self.multistatus())
+        return iterresponses(self.open())
+
+    def json(self):
+        """
+        @return: the body parsed as JSON
+        """
+        return self._parse("json", lambda data: json.loads(str(data)))
+
+    def calendar(self):
+        """
+        @return: the body parsed as iCalendar data
+        @rtype: L{Calendar}
+        """
+        return self._parse("calendar", lambda data: Calendar.parseText(str(data)))
+
+    def card(self):
+        """
+        @return: the body parsed as vCard data
+        @rtype: L{Card}
+        """
+        return self._parse("card", lambda data: Card.parseText(str(data)))
+
+
+def responseBody(response, respdata):
+    """
+    Get the L{responsebody} for a response, which is kept on the response so
+    that it is shared by everything looking at that response.
+
+    @param response: the response
+    @type response: L{httplib.HTTPResponse}
+    @param respdata: the response body
+    @type respdata: L{str} or L{spooledbody}
+    @rtype: L{responsebody}
+    """
+    body = getattr(response, "parsed", None)
+    if body is None or body.data is not respdata:
+        body = responsebody(respdata)
+        try:
+            response.parsed = body
+        except AttributeError:
+            pass
+    return body
@@ -18,6 +18,7 @@
 Class that encapsulates the server information for a CalDAV test run.
 """
 
+import copy
 import datetime
 import re
 import src.xmlDefs
@@ -25,6 +26,52 @@ from uuid import uuid4
 from urlparse import urlparse
 
 
+class substitutions(dict):
+    """
+    A map of substitution variables to values that counts the changes made to
+    it, so that results cached from it can be discarded when it changes.
+    Setting a variable to the value it already has is not a change.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(substitutions, self).__init__(*args, **kwargs)
+        self.generation = 0
+
+    def __setitem__(self, key, value):
+        if key in self and self[key] == value:
+            return
+        super(substitutions, self).__setitem__(key, value)
+        self.generation += 1
+
+    def __delitem__(self, key):
+        super(substitutions, self).__delitem__(key)
+        self.generation += 1
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+    def pop(self, *args):
+        self.generation += 1
+        return super(substitutions, self).pop(*args)
+
+    def popitem(self):
+        self.generation += 1
+        return super(substitutions, self).popitem()
+
+    def clear(self):
+        super(substitutions, self).clear()
+        self.generation += 1
+
+    def copy(self):
+        return substitutions(self)
+
+
 class serverinfo(object):
     """
     Maintains information about the server being targeted.
@@ -33,6 +80,14 @@ class serverinfo(object):
     # RegEx pattern to match substitution variables
     subspattern = re.compile("(?P<name>\\$[_a-zA-Z][_a-zA-Z0-9\\-]*\\:)")
 
+    # RegEx pattern to match relative date-times
+    nowpattern = re.compile("\\$now\\.(?:(?P<unit>year|month|week)\\.)?(?P<offset>[^:]*):")
+
+    # Strings split into alternating literal text and variable names, shared
+    # by all instances as it does not depend on the values of the variables
+    compiled = {}
+    compiledLimit = 10000
+
     def __init__(self):
         self.host = ""
         self.nonsslport = 80
@@ -50,8 +105,14 @@ class serverinfo(object):
         self.waitcount = 120
         self.waitdelay = 0.25
         self.waitsuccess = 10
-        self.subsdict = {}
-        self.extrasubsdict = {}
+        self.waitbackoff = 1.0
+        self.waitmaxdelay = 5.0
+        self.waitjitter = 0.0
+        self.multigetbatch = 50
+        self.subsdict = substitutions()
+        self.extrasubsdict = substitutions()
+        self._subscache = None
+        self._extrasubscache = None
         self.calendardatafilters = []
         self.addressdatafilters = []
 
@@ -59,6 +120,21 @@ class serverinfo(object):
         # run over a day boundary.
         self.dtnow = datetime.date.today()
 
+    def clone(self):
+        """
+        Copy this server info, with its own substitution variables, so that
+        substitutions added whilst running a test do not affect other tests.
+
+        @return: the copy
+        @rtype: L{serverinfo}
+        """
+        other = copy.copy(self)
+        other.subsdict = self.subsdict.copy()
+        other.extrasubsdict = self.extrasubsdict.copy()
+        other._subscache = None
+        other._extrasubscache = None
+        return other
+
     def _re_subs(self, sub, mapping):
         """
         Do a regex substitution via the supplied mapping, only if the mapping exists.
@@ -77,43 +153,143 @@ class serverinfo(object):
                 return named
         return self.subspattern.sub(convert, sub)
 
-    def subs(self, sub, db=None):
+    def _compile(self, sub):
+        """
+        Split a string into alternating literal text and variable names.
 
-        # Special handling for relative date-times
-        pos = sub.find("$now.")
-        while pos != -1:
-            endpos = pos + sub[pos:].find(":")
-            if sub[pos:].startswith("$now.year."):
-                yearoffset = int(sub[pos + 10:endpos])
-                value = "%d" % (self.dtnow.year + yearoffset,)
-            elif sub[pos:].startswith("$now.month."):
-                monthoffset = int(sub[pos + 11:endpos])
-                month = self.dtnow.month + monthoffset
-                year = self.dtnow.year + divmod(month - 1, 12)[0]
-                month = divmod(month - 1, 12)[1] + 1
-                value = "%d%02d" % (year, month,)
-            elif sub[pos:].startswith("$now.week."):
-                weekoffset = int(sub[pos + 10:endpos])
-                dtoffset = self.dtnow + datetime.timedelta(days=7 * weekoffset)
-                value = "%d%02d%02d" % (dtoffset.year, dtoffset.month, dtoffset.day,)
+        @param sub: string to split
+        @type sub: L{str}
+        @rtype: L{list} of L{str}
+        """
+        try:
+            return serverinfo.compiled[sub]
+        except KeyError:
+            pass
+        segments = self.subspattern.split(sub)
+        if len(serverinfo.compiled) >= serverinfo.compiledLimit:
+            serverinfo.compiled.clear()
+        serverinfo.compiled[sub] = segments
+        return segments
+
+    def _cache(self, db):
+        """
+        Get the cached results for a substitution map, discarding them if the
+        map has changed since they were cached.
+
+        @param db: the substitution map
+        @type db: L{substitutions}
+        @return: L{tuple} of the map, its generation, the results of L{subs}
+            and the fully substituted value of each variable, or L{None} if
+            results from the map are not cached
+        """
+        if db is self.subsdict:
+            attr = "_subscache"
+        elif db is self.extrasubsdict:
+            attr = "_extrasubscache"
+        else:
+            return None
+        cache = getattr(self, attr)
+        if cache is None or cache[0] is not db or cache[1] != db.generation:
+            cache = (db, db.generation, {}, {})
+            setattr(self, attr, cache)
+        return cache
+
+    def _expand(self, sub, db, resolved, resolving=()):
+        """
+        Substitute variables in a string, with the value of each variable
+        itself fully substituted.
+
+        @param sub: string to do substitution in
+        @type sub: L{str}
+        @param db: mapping of substitution name to value
+        @type db: L{dict}
+        @param resolved: the fully substituted values of variables
+        @type resolved: L{dict}
+        @param resolving: the variables currently being substituted, so that
+            variables that refer to themselves are left alone
+        @type resolving: L{tuple}
+        """
+        segments = self._compile(sub)
+        if len(segments) == 1:
+            return sub
+        result = []
+        for ctr, segment in enumerate(segments):
+            if ctr % 2 == 0:
+                result.append(segment)
+            elif segment in resolved:
+                result.append(resolved[segment])
+            elif segment in db and segment not in resolving:
+                value = db[segment]
+                if '$' in value:
+                    value = self._expand(value, db, resolved, resolving + (segment,))
+                resolved[segment] = value
+                result.append(value)
             else:
-                dayoffset = int(sub[pos + 5:endpos])
-                dtoffset = self.dtnow + datetime.timedelta(days=dayoffset)
-                value = "%d%02d%02d" % (dtoffset.year, dtoffset.month, dtoffset.day,)
-            sub = "%s%s%s" % (sub[:pos], value, sub[endpos + 1:])
-            pos = sub.find("$now.")
+                result.append(segment)
+        return "".join(result)
 
-        if sub.find("$uidrandom:") != -1:
-            sub = sub.replace("$uidrandom:", str(uuid4()))
+    def _now(self, mo):
+        """
+        Get the value of a relative date-time substitution.
+        """
+        unit = mo.group("unit")
+        offset = int(mo.group("offset"))
+        if unit == "year":
+            return "%d" % (self.dtnow.year + offset,)
+        elif unit == "month":
+            month = self.dtnow.month + offset
+            year = self.dtnow.year + divmod(month - 1, 12)[0]
+            month = divmod(month - 1, 12)[1] + 1
+            return "%d%02d" % (year, month,)
+        elif unit == "week":
+            dtoffset = self.dtnow + datetime.timedelta(days=7 * offset)
+        else:
+            dtoffset = self.dtnow + datetime.timedelta(days=offset)
+        return "%d%02d%02d" % (dtoffset.year, dtoffset.month, dtoffset.day,)
+
+    def subs(self, sub, db=None):
+
+        # Nothing to do if there are no variables
+        if '$' not in sub:
+            return sub
 
         if db is None:
             db = self.subsdict
-        while '$' in sub:
-            newstr = self._re_subs(sub, db)
-            if newstr == sub:
+        cache = self._cache(db)
+        if cache is not None:
+            try:
+                return cache[2][sub]
+            except KeyError:
+                pass
+            resolved = cache[3]
+        else:
+            resolved = {}
+
+        result = sub
+
+        # Special handling for relative date-times
+        if "$now." in result:
+            result = self.nowpattern.sub(self._now, result)
+
+        # A new random value is needed every time
+        random = result.find("$uidrandom:") != -1
+        if random:
+            result = result.replace("$uidrandom:", str(uuid4()))
+
+        result = self._expand(result, db, resolved)
+
+        # Substituted values next to each other might form new variables
+        while '$' in result:
+            newstr = self._re_subs(result, db)
+            if newstr == result:
                 break
-            sub = newstr
-        return sub
+            result = newstr
+
+        if cache is not None and not random:
+            if len(cache[2]) >= self.compiledLimit:
+                cache[2].clear()
+            cache[2][sub] = result
+        return result
 
     def addsubs(self, items, db=None):
         if db is None:
@@ -121,7 +297,8 @@ class serverinfo(object):
         else:
             db_actual = db
         for key, value in items.iteritems():
-            db_actual[key] = value
+            if key not in db_actual or db_actual[key] != value:
+                db_actual[key] = value
 
         if db is None:
             self.updateParams()
@@ -193,6 +370,14 @@ class serverinfo(object):
                 self.waitdelay = float(child.text.encode("utf-8"))
             elif child.tag == src.xmlDefs.ELEMENT_WAITSUCCESS:
                 self.waitsuccess = int(child.text.encode("utf-8"))
+            elif child.tag == src.xmlDefs.ELEMENT_WAITBACKOFF:
+                self.waitbackoff = float(child.text.encode("utf-8"))
+            elif child.tag == src.xmlDefs.ELEMENT_WAITMAXDELAY:
+                self.waitmaxdelay = float(child.text.encode("utf-8"))
+            elif child.tag == src.xmlDefs.ELEMENT_WAITJITTER:
+                self.waitjitter = float(child.text.encode("utf-8"))
+            elif child.tag == src.xmlDefs.ELEMENT_MULTIGETBATCH:
+                self.multigetbatch = int(child.text.encode("utf-8"))
             elif child.tag == src.xmlDefs.ELEMENT_FEATURES:
                 self.parseFeatures(child)
             elif child.tag == src.xmlDefs.ELEMENT_SUBSTITUTIONS:
@@ -0,0 +1,202 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to hold large response bodies in a temporary file rather than in memory.
+"""
+
+import hashlib
+import mmap
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+def readResponse(response, threshold):
+    """
+    Read the body of a response. Bodies of at least L{threshold} bytes are
+    written to a temporary file as they are read, and returned as a
+    L{spooledbody}.
+
+    @param response: the response
+    @type response: L{httplib.HTTPResponse}
+    @param threshold: size at which bodies are spooled, or 0 to never spool
+    @type threshold: L{int}
+    @rtype: L{str} or L{spooledbody}
+    """
+    if not threshold:
+        return response.read()
+
+    chunks = []
+    size = 0
+    while size < threshold:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            return "".join(chunks)
+        chunks.append(chunk)
+        size += len(chunk)
+
+    spool = spooledbody()
+    for chunk in chunks:
+        spool.write(chunk)
+    del chunks[:]
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.close()
+    return spool
+
+
+class spooledbody(object):
+    """
+    A response body kept in a temporary file and memory-mapped once written,
+    so that it is paged in by the operating system as needed rather than
+    being held in memory. It behaves enough like a L{str} for the verifiers:
+    it can be measured, indexed, sliced, searched and compared without being
+    copied into memory. Any other L{str} method works on a copy of the whole
+    body. Spooled bodies are never empty.
+
+    @ivar md5: hex MD5 digest of the body
+    @ivar sha1: hex SHA-1 digest of the body
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix="caldavtester-")
+        self.map = None
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._sha1 = hashlib.sha1()
+        self.md5 = None
+        self.sha1 = None
+
+    def write(self, data):
+        """
+        Add data to the end of the body, whilst it is being read.
+
+        @type data: L{str}
+        """
+        self.file.write(data)
+        self._md5.update(data)
+        self._sha1.update(data)
+        self.size += len(data)
+
+    def close(self):
+        """
+        Finish writing the body, and map it for reading.
+        """
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        self.md5 = self._md5.hexdigest()
+        self.sha1 = self._sha1.hexdigest()
+        self._md5 = self._sha1 = None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.map[index]
+
+    def __str__(self):
+        return self.map[:]
+
+    def __repr__(self):
+        return "<spooledbody %d bytes md5=%s>" % (self.size, self.md5,)
+
+    def __getattr__(self, name):
+        # Any other str method works on a copy
+        if name.startswith("_") or self.__dict__.get("map") is None:
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+    def __contains__(self, sub):
+        return self.find(sub) != -1
+
+    def __eq__(self, other):
+        if isinstance(other, spooledbody):
+            if self.size != other.size or self.sha1 != other.sha1:
+                return False
+        elif not isinstance(other, basestring) or len(other) != self.size:
+            return False
+        for start, chunk in self.chunks():
+            if chunk != other[start:start + len(chunk)]:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def find(self, sub, start=0, end=None):
+        return self.map.find(sub, start, end if end is not None else self.size)
+
+    def startswith(self, prefix):
+        return self[:len(prefix)] == prefix
+
+    def endswith(self, suffix):
+        return self[self.size - len(suffix):] == suffix if len(suffix) <= self.size else False
+
+    def chunks(self, size=CHUNK_SIZE):
+        """
+        Iterate over the body in pieces.
+
+        @param size: size of each piece
+        @type size: L{int}
+        @return: the offset and data of each piece
+        @rtype: iterator of L{tuple}
+        """
+        for start in xrange(0, self.size, size):
+            yield start, self.map[start:start + size]
+
+    def open(self):
+        """
+        @return: a new file-like object for reading the body from the start,
+            e.g. for incremental parsing
+        """
+        return spoolreader(self)
+
+
+class spoolreader(object):
+    """
+    Reads a L{spooledbody}, independently of any other reader.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = self.spool.size if size is None or size < 0 else min(self.pos + size, self.spool.size)
+        data = self.spool[self.pos:end]
+        self.pos = end
+        return data
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -38,14 +38,14 @@ class testsuite(object):
         self.exclude_features = set()
         self.tests = []
 
-    def aboutToRun(self):
+    def aboutToRun(self, ctx):
         """
         Typically we need the calendar/contact data for a test file to have a common set
         of UIDs, and for each overall test file to have unique UIDs. Occasionally, within
         a test file we also need test suites to have unique UIDs. The "change-uid" attribute
         can be used to reset the active UIDs for a test suite.
         """
-        return self.manager.server_info.newUIDs() if self.changeuid else set()
+        return ctx.server_info.newUIDs() if self.changeuid else set()
 
     def missingFeatures(self):
         return self.require_features - self.manager.server_info.features
@@ -0,0 +1,108 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from src.bundle import bundle, pack
+from src.filecache import filecache
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBundle(unittest.TestCase):
+
+    files = {
+        "a.txt": "first file",
+        "empty.txt": "",
+        os.path.join("sub", "b.bin"): "\x00\x01\x02binary\xff",
+        os.path.join("sub", "deeper", "c.xml"): "<x/>",
+    }
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name, data in self.files.items():
+            path = os.path.join(self.dir, "data", name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+        self.path = os.path.join(self.dir, "test.bundle")
+        self.assertEqual(pack(self.path, [os.path.join(self.dir, "data")]), len(self.files))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def dataPath(self, *names):
+        return os.path.join(self.dir, "data", *names)
+
+    def testRoundTrip(self):
+        packed = bundle(self.path)
+        self.assertEqual(len(packed), len(self.files))
+        for name, data in self.files.items():
+            self.assertEqual(packed.get(self.dataPath(name))[:], data, "Failed test: %s" % (name,))
+
+        # Paths are normalized
+        self.assertEqual(packed.get(self.dataPath("sub", "..", "a.txt"))[:], "first file")
+        self.assertEqual(packed.get(self.dataPath("missing.txt")), None)
+
+    def testListDir(self):
+        packed = bundle(self.path)
+        self.assertEqual(sorted(packed.listdir(self.dataPath())), ["a.txt", "empty.txt", "sub"])
+        self.assertEqual(sorted(packed.listdir(self.dataPath("sub"))), ["b.bin", "deeper"])
+        self.assertEqual(packed.listdir(self.dataPath("missing")), None)
+
+    def testChangedOnDisk(self):
+        self.assertFalse(bundle(self.path).stale)
+
+        # Only checked when the bundle is opened
+        packed = bundle(self.path)
+        os.remove(self.dataPath("sub", "b.bin"))
+        self.assertEqual(packed.get(self.dataPath("sub", "b.bin"))[:], self.files[os.path.join("sub", "b.bin")])
+
+        packed = bundle(self.path)
+        self.assertTrue(packed.stale)
+        self.assertEqual(len(packed), 0)
+        self.assertEqual(packed.get(self.dataPath("a.txt")), None)
+        self.assertEqual(packed.listdir(self.dataPath()), None)
+
+    def testAddedOnDisk(self):
+        path = self.dataPath("sub", "deeper", "d.xml")
+        with open(path, "wb") as f:
+            f.write("<y/>")
+        st = os.stat(self.dataPath("sub", "deeper"))
+        os.utime(self.dataPath("sub", "deeper"), (st.st_atime, st.st_mtime + 10,))
+        self.assertTrue(bundle(self.path).stale)
+
+    def testFileCache(self):
+        cache = filecache()
+        cache.bundle = bundle(self.path)
+        path = self.dataPath("a.txt")
+        self.assertEqual(cache.read(path), "first file")
+        self.assertEqual(cache.open(path).read(), "first file")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 0, "saved": 10})
+
+        # Replaced files are read from disk
+        with open(path + ".new", "wb") as f:
+            f.write("changed")
+        os.rename(path + ".new", path)
+        st = os.stat(self.dataPath())
+        os.utime(self.dataPath(), (st.st_atime, st.st_mtime + 10,))
+        cache.bundle = bundle(self.path)
+        self.assertEqual(cache.read(path), "changed")
+        self.assertEqual(cache.open(path).read(), "changed")
+
+    def testNotBundle(self):
+        self.assertRaises(ValueError, bundle, self.dataPath("a.txt"))
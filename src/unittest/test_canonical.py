@@ -0,0 +1,110 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import unittest
+from src.canonical import canonicalHash
+
+
+class TestCanonicalHash(unittest.TestCase):
+
+    calendar = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Example//EN
+BEGIN:VEVENT
+UID:1234
+DTSTART:20080601T120000Z
+DTSTAMP:20080601T000000Z
+SUMMARY:A long summary that
+  has been folded
+END:VEVENT
+END:VCALENDAR
+"""
+
+    def testTextMatches(self):
+        data = (
+            (
+                "CRLF line endings",
+                self.calendar.replace("\n", "\r\n"),
+                frozenset(),
+            ),
+            (
+                "Unfolded lines",
+                self.calendar.replace("that\n  has", "that has"),
+                frozenset(),
+            ),
+            (
+                "Properties reordered",
+                self.calendar.replace("UID:1234\nDTSTART:20080601T120000Z", "DTSTART:20080601T120000Z\nUID:1234"),
+                frozenset(),
+            ),
+            (
+                "Dropped property differs",
+                self.calendar.replace("DTSTAMP:20080601T000000Z", "DTSTAMP:20090101T000000Z"),
+                frozenset(("DTSTAMP",)),
+            ),
+        )
+
+        for title, other, dropped in data:
+            self.assertEqual(
+                canonicalHash(other, dropped=dropped),
+                canonicalHash(self.calendar, dropped=dropped),
+                "Failed test: %s" % (title,),
+            )
+
+    def testTextMismatches(self):
+        data = (
+            (
+                "Property differs",
+                self.calendar.replace("UID:1234", "UID:5678"),
+            ),
+            (
+                "Property not dropped",
+                self.calendar.replace("DTSTAMP:20080601T000000Z", "DTSTAMP:20090101T000000Z"),
+            ),
+            (
+                "Property moved to another component",
+                self.calendar.replace("UID:1234\n", "").replace("VERSION:2.0\n", "VERSION:2.0\nUID:1234\n"),
+            ),
+        )
+
+        for title, other in data:
+            self.assertNotEqual(
+                canonicalHash(other),
+                canonicalHash(self.calendar),
+                "Failed test: %s" % (title,),
+            )
+
+    def testInvalid(self):
+        data = (
+            "UID:1234\n",
+            "BEGIN:VCALENDAR\nVERSION:2.0\n",
+            "END:VCALENDAR\n",
+        )
+
+        for other in data:
+            self.assertEqual(canonicalHash(other), None, "Failed test: %r" % (other,))
+
+    def testJSON(self):
+        jcal = """["vcalendar", [["version", {}, "text", "2.0"]], [
+            ["vevent", [["uid", {}, "text", "1234"], ["dtstamp", {}, "date-time", "2008-06-01T00:00:00Z"]], []]
+        ]]"""
+        reordered = """["vcalendar", [["version", {}, "text", "2.0"]], [
+            ["vevent", [["dtstamp", {}, "date-time", "2009-01-01T00:00:00Z"], ["uid", {}, "text", "1234"]], []]
+        ]]"""
+
+        self.assertEqual(canonicalHash(jcal, True, frozenset(("DTSTAMP",))), canonicalHash(reordered, True, frozenset(("DTSTAMP",))))
+        self.assertNotEqual(canonicalHash(jcal, True), canonicalHash(reordered, True))
+        self.assertEqual(canonicalHash("[", True), None)
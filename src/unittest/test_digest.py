@@ -0,0 +1,129 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from cStringIO import StringIO
+from hashlib import md5
+from src.httpshandler import DigestSessionCache
+from src.manager import manager
+from src.request import parseDigestChallenge, request
+import httplib
+import re
+import unittest
+
+
+class TestDigestChallenge(unittest.TestCase):
+
+    def testParse(self):
+        details = parseDigestChallenge([
+            'Basic realm="Test Realm"',
+            'Digest realm="Test Realm", nonce="abc, def=1", qop="auth-int, auth", algorithm=md5, stale=true, opaque="xyz"',
+            'Digest realm="Other Realm", nonce="other"',
+        ])
+        self.assertEqual(details, {
+            "realm": "Test Realm",
+            "nonce": "abc, def=1",
+            "qop": "auth",
+            "algorithm": "md5",
+            "stale": "true",
+            "opaque": "xyz",
+        })
+
+    def testParseQop(self):
+        data = (
+            ('Digest realm="r", nonce="n", qop="auth"', "auth"),
+            ('Digest realm="r", nonce="n", qop="auth-int"', "auth-int"),
+            ('Digest realm="r", nonce="n", qop="auth-int,auth"', "auth"),
+            ('Digest realm="r", nonce="n", qop="auth-int, auth-conf"', "auth-int"),
+            ('Digest realm="r", nonce="n"', None),
+        )
+
+        for challenge, qop in data:
+            self.assertEqual(parseDigestChallenge([challenge]).get("qop"), qop, "Failed test: %s" % (challenge,))
+
+    def testParseNone(self):
+        self.assertEqual(parseDigestChallenge([]), None)
+        self.assertEqual(parseDigestChallenge(['Basic realm="Test Realm"']), None)
+
+
+class TestDigestSessionCache(unittest.TestCase):
+
+    def testNonceCount(self):
+        cache = DigestSessionCache()
+        self.assertEqual(cache.nextSession("key"), None)
+        cache.setSession("key", {"nonce": "abc"})
+        first = cache.nextSession("key")
+        second = cache.nextSession("key")
+        self.assertEqual((first["nonce"], first["nc"],), ("abc", 1,))
+        self.assertEqual(second["nc"], 2)
+
+        # A new challenge starts the count again
+        cache.setSession("key", {"nonce": "def"})
+        self.assertEqual(cache.nextSession("key")["nc"], 1)
+        self.assertEqual(cache.nextSession("other"), None)
+
+    def testExpiry(self):
+        cache = DigestSessionCache(lifetime=0)
+        cache.setSession("key", {"nonce": "abc"})
+        self.assertEqual(cache.nextSession("key"), None)
+
+
+class TestDigestChallenged(unittest.TestCase):
+
+    def setUp(self):
+        m = manager(text=False)
+        m.server_info.host = "localhost"
+        m.server_info.ssl = False
+        m.server_info.port = m.server_info.port2 = 8008
+        m.server_info.authtype = "digest"
+        m.server_info.addsubs({"$userid1:": "user01", "$pswd1:": "user01"})
+        self.ctx = m.createContext()
+        self.req = request(m)
+        self.req.method = "GET"
+
+    def challenge(self, params):
+        """
+        Make the parts of a 401 response looked at by digestChallenged.
+        """
+        class response(object):
+            msg = httplib.HTTPMessage(StringIO('WWW-Authenticate: Digest realm="Test Realm", %s\r\n\r\n' % (params,)))
+        return response()
+
+    def checkAuthorization(self, authorization, uri, nonce, nc):
+        params = dict(re.findall(r'(\w+)="?([^",]*)"?', authorization[len("Digest "):]))
+        self.assertEqual(params["username"], "user01")
+        self.assertEqual(params["nonce"], nonce)
+        self.assertEqual(params["uri"], uri)
+        self.assertEqual(params["nc"], nc)
+        ha1 = md5("user01:Test Realm:user01").hexdigest()
+        ha2 = md5("GET:%s" % (uri,)).hexdigest()
+        expected = md5(":".join((ha1, nonce, nc, params["cnonce"], "auth", ha2,))).hexdigest()
+        self.assertEqual(params["response"], expected)
+
+    def testChallenged(self):
+        uri = "/calendars/user01/"
+        headers = {}
+        self.assertTrue(self.req.digestChallenged(self.ctx, self.challenge('nonce="abc", qop="auth-int, auth"'), uri, headers))
+        self.checkAuthorization(headers["Authorization"], uri, "abc", "00000001")
+
+        # Later requests are authorized pre-emptively
+        self.checkAuthorization(self.req.getHeaders(self.ctx, uri)["Authorization"], uri, "abc", "00000002")
+
+        # A challenge to an authorized request means the credentials are wrong
+        self.assertFalse(self.req.digestChallenged(self.ctx, self.challenge('nonce="def", qop="auth"'), uri, headers))
+
+        # Unless the nonce was stale
+        self.assertTrue(self.req.digestChallenged(self.ctx, self.challenge('nonce="def", qop="auth", stale=true'), uri, headers))
+        self.checkAuthorization(headers["Authorization"], uri, "def", "00000001")
@@ -0,0 +1,94 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from src.filecache import filecache
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeFile(self, name, data, mtime=None):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime,))
+        return path
+
+    def testHits(self):
+        cache = filecache()
+        path = self.writeFile("a.txt", "abcdef")
+        self.assertEqual(cache.read(path), "abcdef")
+        self.assertEqual(cache.read(path), "abcdef")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "saved": 6})
+        self.assertRaises(IOError, cache.read, os.path.join(self.dir, "missing.txt"))
+
+    def testModified(self):
+        cache = filecache()
+        path = self.writeFile("a.txt", "abcdef", 1000000000)
+        self.assertEqual(cache.read(path), "abcdef")
+
+        # Same size, new modification time
+        self.writeFile("a.txt", "ghijkl", 1000000010)
+        self.assertEqual(cache.read(path), "ghijkl")
+
+        # New size, same modification time
+        self.writeFile("a.txt", "mnopqrstu", 1000000010)
+        self.assertEqual(cache.read(path), "mnopqrstu")
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.size, 9)
+
+    def testEviction(self):
+        cache = filecache(maxsize=10)
+        a = self.writeFile("a.txt", "aaaa")
+        b = self.writeFile("b.txt", "bbbb")
+        c = self.writeFile("c.txt", "cccc")
+        big = self.writeFile("big.txt", "x" * 11)
+
+        cache.read(a)
+        cache.read(b)
+        cache.read(a)
+        cache.read(c)
+        self.assertEqual(cache.entries.keys(), [a, c])
+        self.assertEqual(cache.size, 8)
+
+        # Too big to cache at all
+        self.assertEqual(cache.read(big), "x" * 11)
+        self.assertEqual(cache.entries.keys(), [a, c])
+
+        cache.read(b)
+        self.assertEqual(cache.entries.keys(), [c, b])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 5, "saved": 4})
+
+    def testMapped(self):
+        cache = filecache(mapsize=8)
+        small = self.writeFile("small.txt", "small")
+        large = self.writeFile("large.txt", "large file")
+        self.assertTrue(isinstance(cache.get(small), str))
+        self.assertTrue(isinstance(cache.get(large), mmap.mmap))
+        self.assertEqual(cache.read(large), "large file")
+        self.assertTrue(isinstance(cache.read(large), str))
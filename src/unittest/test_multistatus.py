@@ -0,0 +1,115 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from cStringIO import StringIO
+from src.multistatus import isOK, iterresponses, multistatus, statusCode
+from xml.etree.cElementTree import ElementTree
+import unittest
+
+
+class TestMultistatus(unittest.TestCase):
+
+    data = """<?xml version="1.0" encoding="utf-8" ?>
+<D:multistatus xmlns:D="DAV:">
+  <D:response>
+    <D:href>/calendars/user01/calendar/</D:href>
+    <D:propstat>
+      <D:prop><D:getetag>"1"</D:getetag></D:prop>
+      <D:status>HTTP/1.1 200 OK</D:status>
+    </D:propstat>
+    <D:propstat>
+      <D:prop><D:displayname/></D:prop>
+      <D:status>HTTP/1.1 404 Not Found</D:status>
+    </D:propstat>
+  </D:response>
+  <D:response>
+    <D:href>/calendars/user01/calendar/a%20b.ics</D:href>
+    <D:status>HTTP/1.1 404 Not Found</D:status>
+  </D:response>
+  <D:response>
+    <D:href>/calendars/user01/calendar/2.ics</D:href>
+    <D:href>/calendars/user01/calendar/3.ics</D:href>
+    <D:status>HTTP/1.1 200 OK</D:status>
+  </D:response>
+  <D:sync-token>token</D:sync-token>
+</D:multistatus>
+"""
+
+    def testStatusCode(self):
+        data = (
+            ("HTTP/1.1 200 OK", 200),
+            ("HTTP/1.1 404 Not Found", 404),
+            ("  HTTP/1.1 207  ", 207),
+            ("HTTP/1.1 OK", 0),
+            ("200 OK", 0),
+            ("", 0),
+            (None, 0),
+        )
+
+        for txt, code in data:
+            self.assertEqual(statusCode(txt), code, "Failed test: %s" % (txt,))
+
+        self.assertTrue(isOK(200))
+        self.assertTrue(isOK(204))
+        self.assertFalse(isOK(404))
+        self.assertFalse(isOK(0))
+
+    def testIndex(self):
+        responses = multistatus(ElementTree(file=StringIO(self.data)))
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(responses.root.find("{DAV:}sync-token").text, "token")
+
+        collection, missing, multiple = responses
+        self.assertEqual(collection.href, "/calendars/user01/calendar/")
+        self.assertEqual(collection.status, None)
+        self.assertEqual([code for code, _ignore_props in collection.propstats], [200, 404])
+        self.assertEqual(collection.properties["{DAV:}getetag"][0], 200)
+        self.assertEqual(collection.properties["{DAV:}displayname"][0], 404)
+        self.assertEqual(collection.okProperty("{DAV:}getetag").text, '"1"')
+        self.assertEqual(collection.okProperty("{DAV:}displayname"), None)
+
+        self.assertEqual(missing.status, 404)
+        self.assertEqual(missing.unquoted(), "/calendars/user01/calendar/a b.ics")
+        self.assertEqual(multiple.href, None)
+        self.assertEqual(len(multiple.hrefs), 2)
+
+        self.assertTrue(responses.get("/calendars/user01/calendar") is collection)
+        self.assertTrue(responses.get("/calendars/user01/calendar/a b.ics") is missing)
+        self.assertEqual(responses.get("/calendars/user01/calendar/2.ics"), None)
+
+    def testIterResponses(self):
+        responses = multistatus(ElementTree(file=StringIO(self.data)))
+        expected = [(response.hrefs, response.status, response.propstats and [code for code, _ignore_props in response.propstats]) for response in responses]
+        streamed = [(response.hrefs, response.status, response.propstats and [code for code, _ignore_props in response.propstats]) for response in iterresponses(StringIO(self.data))]
+        self.assertEqual(streamed, expected)
+
+    def testIterResponsesNested(self):
+        # Only top-level responses are returned, not elements of the same name
+        # within a property
+        data = self.data.replace(
+            "<D:prop><D:displayname/></D:prop>",
+            "<D:prop><D:response><D:href>/nested</D:href></D:response></D:prop>",
+        )
+        hrefs = [response.hrefs for response in iterresponses(StringIO(data))]
+        self.assertEqual(hrefs, [
+            ["/calendars/user01/calendar/"],
+            ["/calendars/user01/calendar/a%20b.ics"],
+            ["/calendars/user01/calendar/2.ics", "/calendars/user01/calendar/3.ics"],
+        ])
+
+    def testIterResponsesError(self):
+        responses = iterresponses(StringIO(self.data[:self.data.index("<D:response>", 200)]))
+        self.assertRaises(SyntaxError, list, responses)
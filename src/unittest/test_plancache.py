@@ -0,0 +1,114 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from src.manager import manager
+from src.plancache import plancache
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestPlanCache(unittest.TestCase):
+
+    testfile = """<?xml version="1.0" standalone="no"?>
+<caldavtest>
+	<description>Plan cache</description>
+	<start>
+		<request><method>MKCALENDAR</method><ruri>$calendarpath1:/</ruri></request>
+	</start>
+	<test-suite name="suite">
+		<test name="put">
+			<request end-delete="yes">
+				<method>PUT</method>
+				<ruri>$calendarpath1:/1.ics</ruri>
+				<data><content-type>text/calendar</content-type><filepath>Resource/CalDAV/put/1.ics</filepath></data>
+				<verify><callback>statusCode</callback></verify>
+			</request>
+		</test>
+	</test-suite>
+	<end>
+		<request><method>DELETEALL</method><ruri>$calendarpath1:/</ruri></request>
+	</end>
+</caldavtest>
+"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, "test.xml")
+        with open(self.fname, "w") as f:
+            f.write(self.testfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def makeManager(self):
+        m = manager(text=False)
+        m.server_info.host = "localhost"
+        m.server_info.ssl = False
+        m.server_info.port = m.server_info.port2 = 8008
+        m.server_info.addsubs({
+            "$userid1:": "user01",
+            "$pswd1:": "user01",
+            "$calendarpath1:": "/calendars/user01/calendar",
+        })
+        return m
+
+    def testRoundTrip(self):
+        m1 = self.makeManager()
+        test = m1.parseTestFile(self.fname)
+        data = plancache(m1, self.dir).dumps(test)
+
+        m2 = self.makeManager()
+        loaded = plancache(m2, self.dir).loads(data)
+        self.assertTrue(loaded.manager is m2)
+        self.assertEqual(loaded.description, "Plan cache")
+        self.assertEqual([req.ruri for req in loaded.start_requests], ["/calendars/user01/calendar/"])
+        self.assertEqual([req.method for req in loaded.end_requests], ["DELETEALL"])
+
+        self.assertEqual([suite.name for suite in loaded.suites], ["suite"])
+        suite = loaded.suites[0]
+        self.assertTrue(suite.manager is m2)
+        self.assertEqual([t.name for t in suite.tests], ["put"])
+        req = suite.tests[0].requests[0]
+        self.assertTrue(req.manager is m2)
+        self.assertTrue(req.data.manager is m2)
+        self.assertTrue(req.end_delete)
+        self.assertEqual(req.ruri, "/calendars/user01/calendar/1.ics")
+        self.assertEqual(req.data.filepath, "Resource/CalDAV/put/1.ics")
+        self.assertEqual(len(req.verifiers), 1)
+
+    def testStoreLoad(self):
+        m = self.makeManager()
+        cache = plancache(m, os.path.join(self.dir, "cache"))
+        key = cache.key(self.fname)
+        self.assertNotEqual(key, None)
+        self.assertEqual(cache.load(key), None)
+
+        cache.store(key, cache.dumps(m.parseTestFile(self.fname)))
+        loaded = cache.load(key)
+        self.assertEqual(loaded.suites[0].tests[0].requests[0].ruri, "/calendars/user01/calendar/1.ics")
+        self.assertEqual((cache.hits, cache.misses,), (1, 1,))
+
+        # Different server info means a different key
+        other = self.makeManager()
+        other.server_info.addsubs({"$calendarpath1:": "/calendars/user02/calendar"})
+        self.assertNotEqual(plancache(other, cache.cachedir).key(self.fname), key)
+
+    def testRandom(self):
+        with open(self.fname, "w") as f:
+            f.write(self.testfile.replace("1.ics", "$uidrandom:.ics"))
+        self.assertEqual(plancache(self.makeManager(), self.dir).key(self.fname), None)
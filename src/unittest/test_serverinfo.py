@@ -0,0 +1,136 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import datetime
+import unittest
+from src.serverinfo import serverinfo
+
+
+class TestSubstitutions(unittest.TestCase):
+
+    def setUp(self):
+        self.info = serverinfo()
+        self.info.addsubs({
+            "$userid1:": "user01",
+            "$pswd1:": "user01",
+            "$userguid1:": "10000000-0000-0000-0000-000000000001",
+            "$calendars:": "/calendars",
+            "$calendarhome1:": "$calendars:/__uids__/$userguid1:",
+            "$calendarpath1:": "$calendarhome1:/calendar",
+        })
+
+    def testNested(self):
+        data = (
+            ("$userid1:", "user01"),
+            ("$calendarhome1:", "/calendars/__uids__/10000000-0000-0000-0000-000000000001"),
+            ("$calendarpath1:/1.ics", "/calendars/__uids__/10000000-0000-0000-0000-000000000001/calendar/1.ics"),
+            ("$unknown: $userid1:", "$unknown: user01"),
+            ("no variables", "no variables"),
+        )
+
+        for sub, result in data:
+            self.assertEqual(self.info.subs(sub), result, "Failed test: %s" % (sub,))
+
+    def testNestedExtra(self):
+        self.info.addextrasubs({
+            "$outer:": "[$inner:]",
+            "$inner:": "<$innermost:>",
+            "$innermost:": "value",
+            "$self:": "$self:",
+        })
+        self.assertEqual(self.info.extrasubs("$outer:"), "[<value>]")
+        self.assertEqual(self.info.extrasubs("$self:"), "$self:")
+
+    def testAdjacent(self):
+        self.info.addextrasubs({
+            "$prefix:": "$cal",
+            "$suffix:": "endar:",
+            "$calendar:": "calendar",
+        })
+        self.assertEqual(self.info.extrasubs("/$prefix:$suffix:/"), "/calendar/")
+
+    def testNow(self):
+        self.info.dtnow = datetime.date(2016, 1, 31)
+        data = (
+            ("$now.0:", "20160131"),
+            ("$now.1:", "20160201"),
+            ("$now.-31:", "20151231"),
+            ("$now.week.1:", "20160207"),
+            ("$now.month.1:", "201602"),
+            ("$now.month.-1:", "201512"),
+            ("$now.month.12:", "201701"),
+            ("$now.year.1:0101T120000Z", "20170101T120000Z"),
+            ("$now.0:T000000Z/$userid1:", "20160131T000000Z/user01"),
+        )
+
+        for sub, result in data:
+            self.assertEqual(self.info.subs(sub), result, "Failed test: %s" % (sub,))
+
+    def testUIDRandom(self):
+        for sub in ("$uidrandom:", "$userid1:-$uidrandom:"):
+            first = self.info.subs(sub)
+            second = self.info.subs(sub)
+            self.assertNotEqual(first, second, "Failed test: %s" % (sub,))
+            self.assertTrue("$uidrandom:" not in first, "Failed test: %s" % (sub,))
+        self.assertTrue(self.info.subs("$userid1:-$uidrandom:").startswith("user01-"))
+
+    def testInvalidateAddSubs(self):
+        self.assertEqual(self.info.subs("$userid1:/$calendars:"), "user01//calendars")
+        self.info.addsubs({"$calendars:": "/other"})
+        self.assertEqual(self.info.subs("$userid1:/$calendars:"), "user01//other")
+        self.info.addsubs({"$userid1:": "user02"})
+        self.assertEqual(self.info.subs("$userid1:/$calendars:"), "user02//other")
+        self.assertEqual(self.info.user, "user02")
+
+    def testInvalidateAddExtraSubs(self):
+        self.info.addextrasubs({"$href:": "/1.ics", "$outer:": "[$href:]"})
+        self.assertEqual(self.info.extrasubs("$outer:"), "[/1.ics]")
+        self.info.addextrasubs({"$href:": "/2.ics"})
+        self.assertEqual(self.info.extrasubs("$outer:"), "[/2.ics]")
+        self.info.addextrasubs({"basename($path:)": "/calendars/user01/calendar/"})
+        self.assertEqual(self.info.extrasubs("$path:"), "calendar")
+
+    def testKeepCache(self):
+        self.info.addextrasubs({"$request_count:": "1", "$outer:": "[$request_count:]"})
+        self.assertEqual(self.info.extrasubs("$outer:"), "[1]")
+        generation = self.info.extrasubsdict.generation
+        cache = self.info._extrasubscache
+
+        # Setting the same values again is not a change
+        self.info.addextrasubs({"$request_count:": "1"})
+        self.info.extrasubsdict.update({"$outer:": "[$request_count:]"})
+        self.assertEqual(self.info.extrasubs("$outer:"), "[1]")
+        self.assertEqual(self.info.extrasubsdict.generation, generation)
+        self.assertTrue(self.info._extrasubscache is cache)
+
+        self.info.addextrasubs({"$request_count:": "2"})
+        self.assertEqual(self.info.extrasubs("$outer:"), "[2]")
+        self.assertFalse(self.info._extrasubscache is cache)
+
+    def testClone(self):
+        self.info.addextrasubs({"$href:": "/1.ics"})
+        self.assertEqual(self.info.subs("$userid1:"), "user01")
+        self.assertEqual(self.info.extrasubs("$href:"), "/1.ics")
+
+        other = self.info.clone()
+        other.addsubs({"$userid1:": "user02"})
+        other.addextrasubs({"$href:": "/2.ics"})
+        self.assertEqual(other.subs("$userid1:"), "user02")
+        self.assertEqual(other.extrasubs("$href:"), "/2.ics")
+
+        self.assertEqual(self.info.subs("$userid1:"), "user01")
+        self.assertEqual(self.info.extrasubs("$href:"), "/1.ics")
+        self.assertEqual(self.info.user, "user01")
@@ -0,0 +1,98 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from cStringIO import StringIO
+from src.spool import readResponse, spooledbody
+import hashlib
+import unittest
+
+
+def makeSpool(data):
+    spool = spooledbody()
+    for start in range(0, len(data), 1000):
+        spool.write(data[start:start + 1000])
+    spool.close()
+    return spool
+
+
+class TestSpooledBody(unittest.TestCase):
+
+    data = "".join(["line %05d\n" % (ctr,) for ctr in range(20000)])
+
+    def testSlicing(self):
+        spool = makeSpool(self.data)
+        self.assertEqual(len(spool), len(self.data))
+        self.assertEqual(str(spool), self.data)
+        data = (
+            (0, 10),
+            (5, 17),
+            (65530, 65550),
+            (len(self.data) - 10, len(self.data)),
+            (len(self.data) - 10, len(self.data) + 10),
+            (100, 50),
+        )
+        for start, end in data:
+            self.assertEqual(spool[start:end], self.data[start:end], "Failed test: %s" % ((start, end,),))
+        self.assertEqual(spool[:4096], self.data[:4096])
+        self.assertEqual(spool[0], "l")
+        self.assertEqual(spool.md5, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(spool.sha1, hashlib.sha1(self.data).hexdigest())
+
+    def testEquality(self):
+        spool = makeSpool(self.data)
+        changed = self.data[:100000] + "X" + self.data[100001:]
+        data = (
+            (self.data, True),
+            (makeSpool(self.data), True),
+            (changed, False),
+            (makeSpool(changed), False),
+            (self.data[:-1], False),
+            (self.data + "\n", False),
+            (None, False),
+        )
+        for other, result in data:
+            self.assertEqual(spool == other, result, "Failed test: %r" % (other,))
+            self.assertEqual(spool != other, not result, "Failed test: %r" % (other,))
+
+    def testSearching(self):
+        spool = makeSpool(self.data)
+        self.assertEqual(spool.find("line 10000"), self.data.find("line 10000"))
+        self.assertEqual(spool.find("missing"), -1)
+        self.assertTrue("line 19999\n" in spool)
+        self.assertTrue(spool.startswith("line 00000"))
+        self.assertTrue(spool.endswith("line 19999\n"))
+        self.assertFalse(spool.endswith("line 00000"))
+        self.assertEqual(spool.splitlines()[-1], "line 19999")
+
+    def testRead(self):
+        spool = makeSpool(self.data)
+        with spool.open() as f:
+            first = f.read(10)
+            rest = f.read()
+        self.assertEqual(first + rest, self.data)
+        self.assertEqual("".join([chunk for _ignore_start, chunk in spool.chunks()]), self.data)
+
+    def testReadResponse(self):
+        data = (
+            (0, str),
+            (len(self.data) + 1, str),
+            (len(self.data), spooledbody),
+            (1000, spooledbody),
+        )
+        for threshold, result in data:
+            body = readResponse(StringIO(self.data), threshold)
+            self.assertTrue(isinstance(body, result), "Failed test: %s" % (threshold,))
+            self.assertEqual(body, self.data, "Failed test: %s" % (threshold,))
@@ -0,0 +1,66 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from src.context import context
+from src.manager import manager
+from src.waiter import waiter
+import unittest
+
+
+class sleeplesscontext(context):
+    """
+    A L{context} that records the pauses instead of sleeping.
+    """
+
+    def __init__(self, manager):
+        super(sleeplesscontext, self).__init__(manager)
+        self.delays = []
+
+    def sleep(self, seconds):
+        self.delays.append(seconds)
+
+
+class TestWaiter(unittest.TestCase):
+
+    def makeContext(self, delay, backoff, maxdelay, jitter=0.0):
+        ctx = sleeplesscontext(manager(text=False))
+        ctx.server_info.waitdelay = delay
+        ctx.server_info.waitbackoff = backoff
+        ctx.server_info.waitmaxdelay = maxdelay
+        ctx.server_info.waitjitter = jitter
+        return ctx
+
+    def pauses(self, ctx, count):
+        waiting = waiter(ctx)
+        for _ignore in range(count):
+            waiting.pause()
+        return ctx.delays
+
+    def testBackoff(self):
+        data = (
+            ((0.25, 1.0, 5.0), [0.25, 0.25, 0.25, 0.25]),
+            ((0.25, 2.0, 5.0), [0.25, 0.5, 1.0, 2.0, 4.0, 5.0, 5.0]),
+            ((1.0, 3.0, 5.0), [1.0, 3.0, 5.0, 5.0]),
+            # A maximum below the first delay never shortens it
+            ((2.0, 2.0, 1.0), [2.0, 2.0, 2.0]),
+        )
+        for args, result in data:
+            self.assertEqual(self.pauses(self.makeContext(*args), len(result)), result, "Failed test: %s" % (args,))
+
+    def testJitter(self):
+        ctx = self.makeContext(1.0, 2.0, 4.0, 0.5)
+        for delay, base in zip(self.pauses(ctx, 20), [1.0, 2.0] + [4.0] * 18):
+            self.assertTrue(base * 0.5 <= delay <= base * 1.5, "Failed test: %s" % (delay,))
@@ -0,0 +1,50 @@
+##
+# Copyright (c) 2006-2016 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Class to pace requests that poll the server.
+"""
+
+import random
+
+
+class waiter(object):
+    """
+    Paces a series of polls of the server by sleeping between them. The first
+    delay is the server info's waitdelay. Each following delay is multiplied by
+    waitbackoff, up to at most waitmaxdelay, and a random fraction of up to
+    waitjitter is added or removed so that several runners do not poll in
+    lock-step.
+    """
+
+    def __init__(self, ctx):
+        """
+        @param ctx: the state for the run, which records the time spent waiting
+        @type ctx: L{context}
+        """
+        self.ctx = ctx
+        self.delay = ctx.server_info.waitdelay
+
+    def pause(self):
+        """
+        Sleep until the next poll is due.
+        """
+        si = self.ctx.server_info
+        delay = self.delay
+        if si.waitjitter:
+            delay *= 1.0 + random.uniform(-si.waitjitter, si.waitjitter)
+        self.ctx.sleep(delay)
+        self.delay = min(self.delay * si.waitbackoff, max(si.waitmaxdelay, si.waitdelay))
@@ -50,6 +50,7 @@ ELEMENT_LOGGING = "logging"
 ELEMENT_MAILFROM = "mailfrom"
 ELEMENT_MAILTO = "mailto"
 ELEMENT_METHOD = "method"
+ELEMENT_MULTIGETBATCH = "multigetbatch"
 ELEMENT_NAME = "name"
 ELEMENT_NONSSLPORT = "nonsslport"
 ELEMENT_NONSSLPORT2 = "nonsslport2"
@@ -84,8 +85,11 @@ ELEMENT_UNIX2 = "unix2"
 ELEMENT_VALUE = "value"
 ELEMENT_VARIABLE = "variable"
 ELEMENT_VERIFY = "verify"
+ELEMENT_WAITBACKOFF = "waitbackoff"
 ELEMENT_WAITCOUNT = "waitcount"
 ELEMENT_WAITDELAY = "waitdelay"
+ELEMENT_WAITJITTER = "waitjitter"
+ELEMENT_WAITMAXDELAY = "waitmaxdelay"
 ELEMENT_WAITSUCCESS = "waitsuccess"
 ELEMENT_WARNINGTIME = "warningtime"
 
@@ -113,6 +117,7 @@ ATTR_STATS = "stats"
 ATTR_SUBSTITUTIONS = "substitutions"
 ATTR_TIME_EXCEEDED = "time-exceeded"
 ATTR_USER = "user"
+ATTR_VERBATIM = "verbatim"
 ATTR_WAIT_FOR_SUCCESS = "wait-for-success"
 
 ATTR_VALUE_NO = "no"
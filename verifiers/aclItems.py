@@ -19,9 +19,7 @@ Verifier that checks a propfind response to make sure that the specified ACL pri
 are available for the currently authenticated user.
 """
 
-from xml.etree.cElementTree import ElementTree
-from StringIO import StringIO
-import urllib
+from src.responsebody import responseBody
 
 
 class Verifier(object):
@@ -39,26 +37,24 @@ class Verifier(object):
             return False, "           HTTP Status for Request: %d\n" % (response.status,)
 
         try:
-            tree = ElementTree(file=StringIO(respdata))
+            responses = responseBody(response, respdata).multistatus()
         except Exception:
             return False, "           HTTP response is not valid XML: %d\n" % (respdata,)
 
         result = True
         resulttxt = ""
-        for response in tree.findall("{DAV:}response"):
+        for response in responses:
 
             # Get href for this response
-            href = response.findall("{DAV:}href")
-            if len(href) != 1:
+            if response.href is None:
                 return False, "           Wrong number of DAV:href elements\n"
-            href = urllib.unquote(href[0].text)
+            href = response.unquoted()
 
             # Get all privileges
             granted_privs = []
-            privset = response.getiterator("{DAV:}current-user-privilege-set")
-            for props in privset:
-                # Determine status for this propstat
-                privileges = props.findall("{DAV:}privilege")
+            _ignore_code, privset = response.properties.get("{DAV:}current-user-privilege-set", (None, None,))
+            if privset is not None:
+                privileges = privset.findall("{DAV:}privilege")
                 for privilege in privileges:
                     for child in privilege.getchildren():
                         granted_privs.append(child.tag)
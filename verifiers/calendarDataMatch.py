@@ -22,6 +22,7 @@ try:
     from pycalendar.parameter import Parameter
 except ImportError:
     pass
+from src.canonical import canonicalHash
 import os
 
 """
@@ -70,13 +71,9 @@ class Verifier(object):
 
         # read in all data from specified file or use provided data
         if len(files):
-            fd = open(files[0], "r")
             try:
-                try:
-                    data = fd.read()
-                finally:
-                    fd.close()
-            except:
+                data = manager.fileCache.read(files[0])
+            except IOError:
                 data = None
         else:
             data = caldata[0] if len(caldata) else None
@@ -124,25 +121,25 @@ class Verifier(object):
                             if property.getName() == filter:
                                 component.removeProperty(property)
 
+        def getRids(calendar):
+            """
+            Get all the recurrence ids of the specified calendar.
+            """
+            results = set()
+            master = None
+            for subcomponent in calendar.getComponents():
+                if isinstance(subcomponent, ComponentRecur):
+                    rid = subcomponent.getRecurrenceID()
+                    if rid:
+                        results.add(rid.duplicateAsUTC())
+                    else:
+                        master = subcomponent
+            return results, master
+
         def reconcileRecurrenceOverrides(calendar1, calendar2):
             """
             Make sure that the same set of overridden components appears in both calendar objects.
             """
-            def _getRids(calendar):
-                """
-                Get all the recurrence ids of the specified calendar.
-                """
-                results = set()
-                master = None
-                for subcomponent in calendar.getComponents():
-                    if isinstance(subcomponent, ComponentRecur):
-                        rid = subcomponent.getRecurrenceID()
-                        if rid:
-                            results.add(rid.duplicateAsUTC())
-                        else:
-                            master = subcomponent
-                return results, master
-
             def _addOverrides(calendar, master, missing_rids):
                 """
                 Derive instances for the missing overrides in the specified calendar object.
@@ -155,25 +152,46 @@ class Verifier(object):
                     if newcomp is not None:
                         calendar.addComponent(newcomp)
 
-            rids1, master1 = _getRids(calendar1)
-            rids2, master2 = _getRids(calendar2)
+            rids1, master1 = getRids(calendar1)
+            rids2, master2 = getRids(calendar2)
 
             _addOverrides(calendar1, master1, rids2 - rids1)
             _addOverrides(calendar2, master2, rids1 - rids2)
 
+        # Properties that are removed entirely can be ignored when looking for an exact match
+        dropped = frozenset([afilter.upper() for afilter in filters if ":" not in afilter and "=" not in afilter])
+
+        def normalizeData():
+            data_calendar = Calendar.parseData(data, format=format)
+            removePropertiesParameters(data_calendar)
+            return (
+                data_calendar,
+                data_calendar.getText(includeTimezones=Calendar.NO_TIMEZONES, format=format),
+                canonicalHash(data, is_json, dropped),
+            )
+
         try:
             format = Calendar.sFormatJSON if is_json else Calendar.sFormatText
 
-            resp_calendar = Calendar.parseData(respdata, format=format)
-            removePropertiesParameters(resp_calendar)
+            key = manager.expectedCache.key("calendar", data, format, frozenset(filters), doTimezones)
+            data_calendar, data, data_hash = manager.expectedCache.get(key, normalizeData)
 
-            data_calendar = Calendar.parseData(data, format=format)
-            removePropertiesParameters(data_calendar)
+            # Only compare semantically when the response is not exactly what is expected
+            if data_hash is not None and canonicalHash(respdata, is_json, dropped) == data_hash:
+                return True, ""
+
+            resp_calendar = Calendar.parseData(str(respdata), format=format)
+            removePropertiesParameters(resp_calendar)
 
-            reconcileRecurrenceOverrides(resp_calendar, data_calendar)
+            # The normalized expected data is shared, so only change a copy of it
+            if getRids(resp_calendar)[0] - getRids(data_calendar)[0]:
+                data_calendar = data_calendar.duplicate()
+                reconcileRecurrenceOverrides(resp_calendar, data_calendar)
+                data = data_calendar.getText(includeTimezones=Calendar.NO_TIMEZONES, format=format)
+            else:
+                reconcileRecurrenceOverrides(resp_calendar, data_calendar)
 
             respdata = resp_calendar.getText(includeTimezones=Calendar.NO_TIMEZONES, format=format)
-            data = data_calendar.getText(includeTimezones=Calendar.NO_TIMEZONES, format=format)
 
             result = resp_calendar == data_calendar
             if not result:
@@ -45,13 +45,9 @@ class Verifier(object):
             return False, "        No file to compare response to"
 
         # read in all data from specified file
-        fd = open(files[0], "r")
         try:
-            try:
-                data = fd.read()
-            finally:
-                fd.close()
-        except:
+            data = manager.fileCache.read(files[0])
+        except IOError:
             data = None
 
         if data is None:
@@ -59,10 +55,11 @@ class Verifier(object):
 
         data = manager.server_info.subs(data)
 
+        # A spooled response body compares itself with the data a chunk at a time
         result = True
-        if data != respdata:
+        if respdata != data:
             data = data.replace("\n", "\r\n")
-            if data != respdata:
+            if respdata != data:
                 # If we have an iCalendar file, then unwrap data and do compare
                 if files[0].endswith(".ics"):
                     data = data.replace("\r\n ", "")
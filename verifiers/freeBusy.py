@@ -20,10 +20,10 @@ Verifier that checks the response of a free-busy-query.
 
 try:
     # pycalendar is optional
-    from pycalendar.icalendar.calendar import Calendar
     from pycalendar.exceptions import InvalidData
 except ImportError:
     pass
+from src.responsebody import responseBody
 
 
 class Verifier(object):
@@ -42,7 +42,7 @@ class Verifier(object):
 
         # Parse data as calendar object
         try:
-            calendar = Calendar.parseText(respdata)
+            calendar = responseBody(response, respdata).calendar()
 
             # Check for calendar
             if calendar is None:
@@ -24,8 +24,8 @@ JSON pointer syntax is extended as follows:
 2) A "." as a path segment will match any JSON object member or array item.
 """
 
-import json
 from src.jsonPointer import JSONMatcher, JSONPointerMatchError
+from src.responsebody import responseBody
 
 
 class Verifier(object):
@@ -56,7 +56,7 @@ class Verifier(object):
 
         # Read in json
         try:
-            j = json.loads(respdata)
+            j = responseBody(response, respdata).json()
         except Exception, e:
             return False, "        Response data is not JSON data: %s" % (e,)
 
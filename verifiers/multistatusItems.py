@@ -19,10 +19,9 @@ Verifier that checks a multistatus response to make sure that the specified href
 are returned with appropriate status codes.
 """
 
+from src.multistatus import isOK, multistatus
+from src.responsebody import responseBody
 from src.utils import processHrefSubstitutions
-from xml.etree.cElementTree import ElementTree
-from StringIO import StringIO
-import urllib
 
 
 class Verifier(object):
@@ -71,47 +70,35 @@ class Verifier(object):
         if response.status != 207:
             return False, "           HTTP Status for Request: %d\n" % (response.status,)
 
-        try:
-            tree = ElementTree(file=StringIO(respdata))
-        except Exception:
-            return False, "           HTTP response is not valid XML: %s\n" % (respdata,)
-
+        # Large responses are parsed as they are read, so parse errors show up part way through
         ok_status_hrefs = []
         bad_status_hrefs = []
         status_code_hrefs = {}
-        for response in tree.findall("{DAV:}response"):
-
-            # Get href for this response
-            href = response.findall("{DAV:}href")
-            if href is None or len(href) != 1:
-                return False, "        Incorrect/missing DAV:Href element in response"
-            href = urllib.unquote(href[0].text).rstrip("/")
-
-            # Verify status
-            status = response.findall("{DAV:}status")
-            if len(status) == 1:
-                statustxt = status[0].text
-                status = False
-                if statustxt.startswith("HTTP/1.1 ") and (len(statustxt) >= 10):
-                    status = (statustxt[9] == "2")
-                    try:
-                        code = int(statustxt[9:12])
-                    except ValueError:
-                        code = 0
-            else:
-                propstatus = response.findall("{DAV:}propstat")
-                if len(propstatus) > 0:
-                    statustxt = "OK"
-                    status = True
+        try:
+            responses = responseBody(response, respdata).responses()
+            for response in responses:
+
+                # Get href for this response
+                if response.href is None:
+                    return False, "        Incorrect/missing DAV:Href element in response"
+                href = multistatus.normalize(response.href)
+
+                # Verify status
+                if response.status is not None:
+                    code = response.status
+                    status = isOK(code)
                 else:
-                    status = False
-                code = 0
-
-            if status:
-                ok_status_hrefs.append(href)
-            else:
-                bad_status_hrefs.append(href)
-            status_code_hrefs.setdefault(code, set()).add(href)
+                    code = 0
+                    status = len(response.propstats) > 0
+
+                if status:
+                    ok_status_hrefs.append(href)
+                else:
+                    bad_status_hrefs.append(href)
+                status_code_hrefs.setdefault(code, set()).add(href)
+        except Exception:
+            return False, "           HTTP response is not valid XML: %s\n" % (respdata,)
+
         ok_result_set = set(ok_status_hrefs)
         ok_test_set = set(okhrefs)
         no_test_set = set(nohrefs)
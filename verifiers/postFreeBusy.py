@@ -24,9 +24,8 @@ try:
     from pycalendar.exceptions import InvalidData
 except ImportError:
     pass
-from xml.etree.cElementTree import ElementTree
+from src.responsebody import responseBody
 from xml.parsers.expat import ExpatError
-import StringIO
 
 
 class Verifier(object):
@@ -50,7 +49,7 @@ class Verifier(object):
 
         # Extract each calendar-data object
         try:
-            tree = ElementTree(file=StringIO.StringIO(respdata))
+            tree = responseBody(response, respdata).xml()
         except ExpatError:
             return False, "           Could not parse proper XML response\n"
 
@@ -18,8 +18,7 @@
 Verifier that checks the response for a pre/post-condition <DAV:error> result.
 """
 
-from xml.etree.cElementTree import ElementTree
-from StringIO import StringIO
+from src.responsebody import responseBody
 
 
 class Verifier(object):
@@ -39,7 +38,7 @@ class Verifier(object):
             return False, "        No pre/post condition response body"
 
         try:
-            tree = ElementTree(file=StringIO(respdata))
+            tree = responseBody(response, respdata).xml()
         except Exception, ex:
             return False, "        Could not parse XML: %s" % (ex,)
 
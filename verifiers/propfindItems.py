@@ -19,6 +19,8 @@ Verifier that checks a propfind response to make sure that the specified propert
 are returned with appropriate status codes.
 """
 
+from src.multistatus import isOK
+from src.responsebody import responseBody
 from xml.etree.cElementTree import ElementTree, tostring
 from StringIO import StringIO
 import urllib
@@ -113,24 +115,23 @@ class Verifier(object):
 
         # Read in XML
         try:
-            tree = ElementTree(file=StringIO(respdata))
+            responses = responseBody(response, respdata).multistatus()
         except Exception:
             return False, "           Could not parse proper XML response\n"
 
         # Test root element
-        if tree.getroot().tag != root:
+        if responses.root.tag != root:
             return False, "           Invalid root-element specified: %s\n" % (root,)
 
         result = True
         resulttxt = ""
         ctr = 0
-        for response in tree.findall("{DAV:}response"):
+        for response in responses:
 
             # Get href for this response
-            href = response.find("{DAV:}href")
-            if href is None:
+            if not response.hrefs:
                 return False, "           Wrong number of DAV:href elements\n"
-            href = urllib.unquote(href.text)
+            href = urllib.unquote(response.hrefs[0])
             if href in ignores:
                 continue
             if only and href not in only:
@@ -143,22 +144,11 @@ class Verifier(object):
             # Get all property status
             ok_status_props = []
             bad_status_props = []
-            propstatus = response.findall("{DAV:}propstat")
-            for props in propstatus:
-                # Determine status for this propstat
-                status = props.find("{DAV:}status")
-                if status is not None:
-                    statustxt = status.text
-                    status = False
-                    if statustxt.startswith("HTTP/1.1 ") and (len(statustxt) >= 10):
-                        status = (statustxt[9] == "2")
-                else:
-                    status = False
+            for code, props in response.propstats:
+                status = isOK(code)
 
                 # Get properties for this propstat
-                prop = props.find("{DAV:}prop")
-
-                for child in prop.getchildren():
+                for child in props[0].getchildren():
                     fqname = child.tag
                     if len(child):
                         # Copy sub-element data as text into one long string and strip leading/trailing space
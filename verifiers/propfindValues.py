@@ -18,10 +18,12 @@
 Verifier that checks a propfind response for regex matches to property values.
 """
 
+from src.multistatus import isOK
+from src.responsebody import responseBody
 from xml.etree.cElementTree import ElementTree, tostring
 from StringIO import StringIO
+import copy
 import re
-import urllib
 
 
 class Verifier(object):
@@ -67,19 +69,25 @@ class Verifier(object):
             return False, "           HTTP Status for Request: %d\n" % (response.status,)
 
         try:
-            tree = ElementTree(file=StringIO(respdata))
+            responses = responseBody(response, respdata).multistatus()
         except Exception:
             return False, "           Could not parse proper XML response\n"
 
+        def _removeWhitespace(node):
+
+            for child in node.getchildren():
+                child.text = child.text.strip() if child.text else child.text
+                child.tail = child.tail.strip() if child.tail else child.tail
+                _removeWhitespace(child)
+
         result = True
         resulttxt = ""
-        for response in tree.findall("{DAV:}response"):
+        for response in responses:
 
             # Get href for this response
-            href = response.findall("{DAV:}href")
-            if len(href) != 1:
+            if response.href is None:
                 return False, "           Wrong number of DAV:href elements\n"
-            href = urllib.unquote(href[0].text)
+            href = response.unquoted()
             if href in ignores:
                 continue
             if only and href not in only:
@@ -87,33 +95,16 @@ class Verifier(object):
 
             # Get all property status
             ok_status_props = {}
-            propstatus = response.findall("{DAV:}propstat")
-            for props in propstatus:
-                # Determine status for this propstat
-                status = props.findall("{DAV:}status")
-                if len(status) == 1:
-                    statustxt = status[0].text
-                    status = False
-                    if statustxt.startswith("HTTP/1.1 ") and (len(statustxt) >= 10):
-                        status = (statustxt[9] == "2")
-                else:
-                    status = False
-
+            for code, props in response.propstats:
                 # Get properties for this propstat
-                prop = props.findall("{DAV:}prop")
-                if len(prop) != 1:
+                if len(props) != 1:
                     return False, "           Wrong number of DAV:prop elements\n"
 
-                def _removeWhitespace(node):
-
-                    for child in node.getchildren():
-                        child.text = child.text.strip() if child.text else child.text
-                        child.tail = child.tail.strip() if child.tail else child.tail
-                        _removeWhitespace(child)
-
-                for child in prop[0].getchildren():
+                for child in props[0].getchildren():
                     fqname = child.tag
                     if len(child):
+                        # The parsed response is shared, so strip whitespace from a copy
+                        child = copy.deepcopy(child)
                         value = ""
                         _removeWhitespace(child)
                         for p in child.getchildren():
@@ -123,7 +114,7 @@ class Verifier(object):
                     else:
                         value = None
 
-                    if status:
+                    if isOK(code):
                         ok_status_props[fqname] = value
 
             # Look at each property we want to test and see if present
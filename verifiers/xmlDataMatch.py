@@ -46,13 +46,9 @@ class Verifier(object):
             return False, "        No file to compare response to"
 
         # read in all data from specified file
-        fd = open(files[0], "r")
         try:
-            try:
-                data = fd.read()
-            finally:
-                fd.close()
-        except:
+            data = manager.fileCache.read(files[0])
+        except IOError:
             data = None
 
         if data is None:
@@ -24,6 +24,7 @@ try:
     from pycalendar.icalendar.calendar import Calendar
 except ImportError:
     pass
+from src.responsebody import responseBody
 from xml.etree.cElementTree import ElementTree
 import json
 import re
@@ -48,7 +49,7 @@ class Verifier(object):
 
         # Read in XML
         try:
-            tree = ElementTree(file=StringIO.StringIO(respdata))
+            tree = responseBody(response, respdata).xml()
         except Exception, e:
             return False, "        Response data is not xml data: %s" % (e,)
 